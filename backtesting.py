@@ -2,52 +2,180 @@
 This is main module for strategy backtesting
 """
 
+import os
+import copy
+import hashlib
+import time
+import argparse
+from bisect import bisect_left
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from decimal import Decimal
-from typing import List, Dict, Tuple
+from queue import Queue
+from typing import Callable, List, Dict, Tuple, Optional
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from config.config import BACKTESTING_CONFIG
+from config import config
+from database.cache import cache_dir, read_cache, source_fingerprint, write_cache
 from database.data_service import DataService
-from filter.financial import Financial
-from metrics.metric import Metric, get_returns
-
-from utils import get_date, first_date_of_months, round_lot
-
-
-def create_bt_instance(process_data=True, is_data=True):
+from factors import FactorEngine, FactorWindow
+from filter.financial import PER_SHARE_CODES, Financial
+from journal import FILE_FORMATS, Journal
+from ledger import FixedPointLedger
+from metrics.metric import (
+    BatchMetric,
+    Metric,
+    StreamingMetric,
+    get_returns,
+    resample_returns,
+    summarize_returns,
+)
+from panel import MarketPanel, PanelGroups
+from profiler import Profiler
+from report import IMAGE_FORMATS, Chart, render, render_many
+
+from utils import (
+    Timeline,
+    get_date,
+    first_date_of_months,
+    last_csv_index,
+    round_lots,
+)
+
+
+def create_bt_instance(
+    process_data=True, is_data=True, market_data: Optional["MarketData"] = None
+):
     """
     Create backtesting instance
 
+    Args:
+        process_data (bool, optional): Defaults to True.
+        is_data (bool, optional): Defaults to True.
+        market_data (MarketData, optional): preloaded data to run against instead
+            of processing the data files again. Defaults to None.
+
     Returns:
         _type_: smart_beta, grouped_data, rebalancing_dates
     """
     start_date_str = (
-        BACKTESTING_CONFIG["is_from_date_str"]
+        config.BACKTESTING_CONFIG["is_from_date_str"]
         if is_data
-        else BACKTESTING_CONFIG["os_from_date_str"]
+        else config.BACKTESTING_CONFIG["os_from_date_str"]
     )
     end_date_str = (
-        BACKTESTING_CONFIG["is_end_date_str"]
+        config.BACKTESTING_CONFIG["is_end_date_str"]
         if is_data
-        else BACKTESTING_CONFIG["os_to_date_str"]
+        else config.BACKTESTING_CONFIG["os_to_date_str"]
     )
 
     bt = Backtesting(
-        buy_fee=Decimal(BACKTESTING_CONFIG["buy_fee"]),
-        sell_fee=Decimal(BACKTESTING_CONFIG["sell_fee"]),
+        buy_fee=Decimal(config.BACKTESTING_CONFIG["buy_fee"]),
+        sell_fee=Decimal(config.BACKTESTING_CONFIG["sell_fee"]),
         from_date_str=start_date_str,
         to_date_str=end_date_str,
-        capital=Decimal(BACKTESTING_CONFIG["capital"]),
+        capital=Decimal(config.BACKTESTING_CONFIG["capital"]),
         path="data/is/pe_dps.csv" if is_data else "data/os/pe_dps.csv",
         index_path="data/is/vnindex.csv" if is_data else "data/os/vnindex.csv",
     )
 
+    bt.factor_filters = config.BACKTESTING_CONFIG.get("factor_filters", {})
+    bt.factor_rank = config.BACKTESTING_CONFIG.get("factor_rank")
+
+    if market_data is not None:
+        bt.from_date_str = market_data.from_date_str
+        bt.to_date_str = market_data.to_date_str
+        bt.vnindex_data = market_data.vnindex_data
+        bt.panel = market_data.panel
+        bt.factors = market_data.factors
+        return bt, market_data.grouped_data, market_data.rebalancing_dates()
+
     data, dates = bt.process_data() if process_data else (None, None)
     return bt, data, dates
 
 
+class MarketData:
+    """
+    Read-only market data, processed once and shared by many backtesting instances
+    """
+
+    def __init__(
+        self,
+        is_data=True,
+        bt: Optional["Backtesting"] = None,
+        memory_map: bool = False,
+    ):
+        """
+        Process the data files and keep the daily groups in memory
+
+        Args:
+            is_data (bool, optional): in-sample or out-sample data. Defaults to True.
+            bt (Backtesting, optional): instance of another dataset to process, e.g.
+                the walk-forward history. Defaults to None.
+            memory_map (bool, optional): load the panel memory-mapped, see
+                Backtesting.shared_panel, and rebuild the daily groups from it on
+                access, so that worker processes share one copy of the dataset.
+                Defaults to False.
+        """
+        start = time.perf_counter()
+        if bt is None:
+            bt, _, _ = create_bt_instance(process_data=False, is_data=is_data)
+        self.from_date_str = bt.from_date_str
+        self.to_date_str = bt.to_date_str
+        if memory_map:
+            self.panel = bt.shared_panel()
+            self.grouped_data = PanelGroups(self.panel)
+        else:
+            grouped_data, _ = bt.process_data()
+            self.grouped_data = list(grouped_data)
+            self.panel = MarketPanel(self.grouped_data)
+        bt.panel = self.panel
+        self.factors = bt.factor_engine()
+        self.vnindex_data = bt.vnindex_data
+        self.load_time = time.perf_counter() - start
+
+    def window(self, from_date_str: str, to_date_str: str) -> "MarketData":
+        """
+        Get the dates from from_date_str to before to_date_str, sharing the panel
+        and the factors of the whole history (no look back is lost)
+
+        Args:
+            from_date_str (str)
+            to_date_str (str)
+
+        Returns:
+            MarketData
+        """
+        from_date = datetime.strptime(from_date_str, "%Y-%m-%d").date()
+        to_date = datetime.strptime(to_date_str, "%Y-%m-%d").date()
+        rows = slice(
+            bisect_left(self.panel.dates, from_date),
+            bisect_left(self.panel.dates, to_date),
+        )
+
+        window = copy.copy(self)
+        window.from_date_str = from_date_str
+        window.to_date_str = to_date_str
+        window.grouped_data = self.grouped_data[rows]
+        window.panel = self.panel.window(rows)
+        window.factors = FactorWindow(self.factors, rows, window.panel)
+        window.vnindex_data = self.vnindex_data[
+            (self.vnindex_data["date"] >= from_date)
+            & (self.vnindex_data["date"] < to_date)
+        ].reset_index(drop=True)
+        return window
+
+    def rebalancing_dates(self) -> Queue:
+        """
+        Get a fresh queue of rebalancing dates, the queue is consumed by a run
+
+        Returns:
+            Queue
+        """
+        return first_date_of_months(self.from_date_str, self.to_date_str)
+
+
 class Backtesting:
     """
     Backtesting main class
@@ -85,21 +213,34 @@ class Backtesting:
         self.to_date_str = to_date_str
         self.data_service = DataService()
         self.metric = None
+        # Interim sharpe ratio of run, only fed when a progress callback is given
+        self.streaming_metric: Optional[StreamingMetric] = None
+        self.profiler: Optional[Profiler] = None
+        self.panel: Optional[MarketPanel] = None
+
+        # Selection on registered factors on top of pe and dy, see factors.py
+        self.factors: Optional[FactorEngine] = None
+        self.factor_filters: Dict[str, List[float]] = {}
+        self.factor_rank: Optional[Dict] = None
         self.code = [
             72,  # NET_PROFIT_AFTER_TAX_ATTRIBUTE_TO_SHAREHOLDER = 72
             4110,  # OWNER_CAPITAL = 4110
             308,  #  DIVIDENDS_PAID
         ]
+        # Per share factors computed from the codes, see Financial.per_share
+        self.per_share_codes: Dict[str, int] = dict(PER_SHARE_CODES)
 
         self.capital = capital
         self.portfolio: Dict[str, Decimal] = {"CASH": capital}
         self.period_returns: List[Decimal] = []
         self.ac_returns: List[Decimal] = []
         self.assets: List[Decimal] = [capital]
+        # int64 ledger of run_fixed_point
+        self.ledger: Optional[FixedPointLedger] = None
 
         self.old_price: Dict[str, Decimal] = {}
-        self.suspended_stock = []
-        self.allocation = []
+        # Trades, positions, cash and suspensions of the run, see journal.py
+        self.journal: Optional[Journal] = None
 
         # Date tracking
         self.monthly_tracking = []
@@ -111,20 +252,51 @@ class Backtesting:
             from_date_str, to_date_str, look_back=252, forward_period=40
         )
 
-    def load_vnindex(self) -> pd.DataFrame:
+    def load_vnindex(self, timeline: Optional[Timeline] = None) -> pd.DataFrame:
         """
         Load VNINDEX from csv
 
+        Args:
+            timeline (Timeline, optional): records the stages. Defaults to None.
+
         Returns:
             pd.DataFrame
         """
-        df = pd.DataFrame(
-            self.get_vnindex(),
-            columns=["date", "open", "close", "prev_close", "return", "ac_return"],
-        )
-        df.to_csv(self.index_path)
+        timeline = timeline if timeline is not None else Timeline()
+        with timeline.stage(f"{self.index_path} query"):
+            df = pd.DataFrame(
+                self.get_vnindex(),
+                columns=["date", "open", "close", "prev_close", "return", "ac_return"],
+            )
+        with timeline.stage(f"{self.index_path} write"):
+            df.to_csv(self.index_path)
+            write_cache(df, self.index_path, self.dataset_manifest(with_codes=False))
         return df
 
+    def dataset_manifest(self, with_codes: bool = True) -> Dict:
+        """
+        Get manifest describing the dataset, used to detect stale caches
+
+        Args:
+            with_codes (bool, optional): include financial codes. Defaults to True.
+
+        Returns:
+            Dict
+        """
+        manifest = {
+            "from_date_str": self.from_date_str,
+            "to_date_str": self.to_date_str,
+            "window": [
+                str(self.start),
+                str(self.from_date),
+                str(self.to_date),
+                str(self.end),
+            ],
+        }
+        if with_codes:
+            manifest["codes"] = self.code
+        return manifest
+
     def get_vnindex(self) -> pd.DataFrame:
         """
         Get VNINDEX price
@@ -140,6 +312,18 @@ class Backtesting:
         vnindex_data = self.data_service.get_index_data(
             self.from_date_str, end.strftime("%Y-%m-%d")
         )
+        return self.transform_vnindex(vnindex_data)
+
+    def transform_vnindex(self, vnindex_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compute VNINDEX previous close, return and accumulated return
+
+        Args:
+            vnindex_data (pd.DataFrame): date, open, close
+
+        Returns:
+            pd.DataFrame
+        """
         vnindex_data["prev_close"] = vnindex_data["close"].copy().shift(1)
         vnindex_data.loc[0, "prev_close"] = vnindex_data.loc[0, "close"]
         vnindex_data["return"] = (
@@ -152,96 +336,76 @@ class Backtesting:
 
         return vnindex_data
 
-    def total_asset(self, current_stocks: pd.DataFrame) -> Decimal:
+    def total_asset(self, prev_close: np.ndarray, held_qty: np.ndarray) -> Decimal:
         """
         Get total asset
 
         Args:
-            current_stocks (pd.DataFrame)
+            prev_close (np.ndarray): previous close of the held stocks
+            held_qty (np.ndarray): held quantity aligned with prev_close
 
         Returns:
             Decimal
         """
         total_asset = self.portfolio["CASH"]
-        for _, row in current_stocks.iterrows():
-            total_asset += (
-                Decimal(row["prev_close"]) * self.portfolio[row["tickersymbol"]]
-            )
+        for price, qty in zip(prev_close.tolist(), held_qty.tolist()):
+            total_asset += Decimal(price) * qty
         return total_asset
 
     def sell_stocks(
-        self, current_stocks: pd.DataFrame, target_stocks: pd.DataFrame
-    ) -> Tuple[Decimal, Decimal, pd.DataFrame]:
+        self,
+        symbols: np.ndarray,
+        prev_close: np.ndarray,
+        close: np.ndarray,
+        held_qty: np.ndarray,
+        target_qty: np.ndarray,
+    ) -> Tuple[Decimal, Decimal, np.ndarray]:
         """
         Sell stock before going to buy phase
 
+        All arrays are aligned with the currently held stocks.
+
         Args:
-            current_stocks (pd.DataFrame)
-            target_stocks (pd.DataFrame)
+            symbols (np.ndarray)
+            prev_close (np.ndarray)
+            close (np.ndarray)
+            held_qty (np.ndarray)
+            target_qty (np.ndarray): 0 for stocks leaving the portfolio
 
         Returns:
-            Tuple[Decimal, Decimal, pd.DataFrame]: cash, total stock price, target portfolio
+            Tuple[Decimal, Decimal, np.ndarray]: cash, total stock price, required
+            quantity (non-positive where the stock was sold)
         """
         total_cash = self.portfolio["CASH"]
         stock_asset = Decimal('0.0')
-        selling_data = []
-        for _, row in current_stocks.iterrows():
-            target_qty = (
-                target_stocks[target_stocks["tickersymbol"] == row["tickersymbol"]][
-                    "qty"
-                ].iloc[0]
-                if target_stocks["tickersymbol"].isin([row["tickersymbol"]]).any()
-                else 0
-            )
-
-            required_qty = target_qty - self.portfolio[row["tickersymbol"]]
-
-            if required_qty <= 0:
-                selling_data.append(
-                    [
-                        row["tickersymbol"],
-                        -1 * required_qty,
-                        self.portfolio[row["tickersymbol"]],
-                        row["prev_close"] * required_qty * -1,
-                    ]
-                )
-                total_cash += (
-                    Decimal(row["prev_close"])
-                    * -required_qty
-                    * (Decimal('1.0') - self.sell_fee)
-                )
-                self.portfolio[row["tickersymbol"]] += required_qty
-
-                # update target stock
-                target_stocks.drop(
-                    target_stocks[
-                        target_stocks["tickersymbol"] == row["tickersymbol"]
-                    ].index,
-                    inplace=True,
-                )
-            else:
-                target_stocks.loc[
-                    target_stocks["tickersymbol"] == row["tickersymbol"], "qty"
-                ] = required_qty
-
-            stock_asset += Decimal(row["close"]) * self.portfolio[row["tickersymbol"]]
-            if self.portfolio[row["tickersymbol"]] == 0:
-                del self.portfolio[row["tickersymbol"]]
-
-        target_stocks["adjusted_qty"] = float(total_cash) / (
-            len(target_stocks)
-            * target_stocks["prev_close"].copy()
-            * (1 + float(self.buy_fee))
-        )
-        target_stocks["adjusted_qty"] = (
-            target_stocks["adjusted_qty"].apply(round_lot).copy()
-        )
-        target_stocks = target_stocks[target_stocks["adjusted_qty"] > 0].copy()
-
-        return total_cash, stock_asset, target_stocks
+        required_qty = target_qty - held_qty
+        is_selling = required_qty <= 0
+        remaining_qty = np.where(is_selling, target_qty, held_qty)
+
+        for symbol, price, cur_price, qty, sell, remaining in zip(
+            symbols.tolist(),
+            prev_close.tolist(),
+            close.tolist(),
+            required_qty.tolist(),
+            is_selling.tolist(),
+            remaining_qty.tolist(),
+        ):
+            if sell:
+                total_cash += Decimal(price) * -qty * (Decimal('1.0') - self.sell_fee)
+                self.portfolio[symbol] = remaining
+
+            stock_asset += Decimal(cur_price) * remaining
+            if remaining == 0:
+                del self.portfolio[symbol]
+
+        return total_cash, stock_asset, required_qty
 
     def rebalancing(
-        self, group: pd.DataFrame, pe: List[float], dy: List[float]
+        self,
+        group: pd.DataFrame,
+        pe: List[float],
+        dy: List[float],
+        row: Optional[int] = None,
     ) -> Decimal:
         """
         Buy and return current asset: cash + stock asset
@@ -250,137 +414,438 @@ class Backtesting:
             group (pd.DataFrame)
             pe (List(float))
             dy (List(float))
+            row (int, optional): panel row of the date, required by the factor
+                filters and ranking. Defaults to None.
 
         Returns:
             Decimal
         """
-        qualified_stocks = group[
-            (group['pe'].between(pe[0], pe[1])) & (group['dy'].between(dy[0], dy[1]))
-        ].copy()
-        stock_list = [symbol for symbol in self.portfolio if symbol != "CASH"]
-        current_stocks = group[group["tickersymbol"].isin(stock_list)].copy()
-        total_asset = self.total_asset(current_stocks)
-        qualified_stocks["qty"] = float(total_asset) / (
-            len(qualified_stocks) * qualified_stocks["prev_close"].copy()
+        symbols = group["tickersymbol"].to_numpy()
+        prev_close = group["prev_close"].to_numpy(dtype=float)
+        close = group["close"].to_numpy(dtype=float)
+        columns = np.array(
+            [self.panel.ticker_index[symbol] for symbol in symbols], dtype=np.int32
         )
-        qualified_stocks["qty"] = qualified_stocks["qty"].apply(round_lot)
-        total_cash, stock_asset, qualified_stocks = self.sell_stocks(
-            current_stocks, qualified_stocks
+        is_qualified = (
+            group['pe'].between(pe[0], pe[1]) & group['dy'].between(dy[0], dy[1])
+        ).to_numpy()
+        if row is not None:
+            is_qualified = self.select_factors(row, columns, is_qualified)
+        is_held = np.fromiter(
+            (symbol in self.portfolio for symbol in symbols), bool, len(symbols)
+        )
+        held_qty = np.fromiter(
+            (self.portfolio[symbol] for symbol in symbols[is_held]),
+            np.int64,
+            is_held.sum(),
         )
 
+        total_asset = self.total_asset(prev_close[is_held], held_qty)
+        target_qty = np.zeros(len(symbols), dtype=np.int64)
+        target_qty[is_qualified] = round_lots(
+            float(total_asset) / (is_qualified.sum() * prev_close[is_qualified])
+        )
+        total_cash, stock_asset, required_qty = self.sell_stocks(
+            symbols[is_held],
+            prev_close[is_held],
+            close[is_held],
+            held_qty,
+            target_qty[is_held],
+        )
+
+        # Top up the held stocks, drop the sold ones from the target
+        order_qty = target_qty.copy()
+        order_qty[is_held] = required_qty
+        is_target = is_qualified.copy()
+        is_target[is_held] &= required_qty > 0
+        adjusted_qty = round_lots(
+            float(total_cash)
+            / (is_target.sum() * prev_close[is_target] * (1 + float(self.buy_fee)))
+        )
+        is_buying = np.flatnonzero(is_target)[adjusted_qty > 0]
+
         new_asset = stock_asset
-        allocation = {"holding_capital": new_asset}
-        for _, row in qualified_stocks.iterrows():
-            self.old_price[row["tickersymbol"]] = row["close"]
+        for symbol, price, cur_price, qty in zip(
+            symbols[is_buying].tolist(),
+            prev_close[is_buying].tolist(),
+            close[is_buying].tolist(),
+            order_qty[is_buying].tolist(),
+        ):
+            self.old_price[symbol] = cur_price
 
             # Updating cash
-            total_cash -= (
-                row["qty"]
-                * Decimal(row["prev_close"])
-                * (Decimal("1.0") + self.sell_fee)
-            )
+            total_cash -= qty * Decimal(price) * (Decimal("1.0") + self.sell_fee)
 
             # Updating portfolio qty
-            if row["tickersymbol"] not in self.portfolio:
-                self.portfolio[row["tickersymbol"]] = 0
-            self.portfolio[row["tickersymbol"]] += row["qty"]
+            self.portfolio[symbol] = self.portfolio.get(symbol, 0) + qty
 
-            new_asset += Decimal(row["qty"]) * Decimal(row["close"])
-            allocation["holding_capital"] += Decimal(row["qty"]) * Decimal(row["close"])
+            new_asset += Decimal(qty) * Decimal(cur_price)
 
+        holding_capital = new_asset
         self.portfolio["CASH"] = total_cash
         new_asset += self.portfolio["CASH"]
 
-        # Update cash allocation
-        allocation["cash_remaining"] = self.portfolio["CASH"]
-        allocation["date"] = group["date"].iloc[0]
-        self.allocation.append(allocation)
+        self.record_rebalancing(
+            group["date"].iloc[0],
+            columns[is_held],
+            prev_close[is_held],
+            -required_qty,
+            columns,
+            close,
+            prev_close,
+            order_qty,
+            is_buying,
+        )
+        self.journal.cash.append(
+            np.datetime64(group["date"].iloc[0], "D"),
+            float(total_cash),
+            float(holding_capital),
+        )
 
         return new_asset
 
-    def daily_update_asset(self, group: pd.DataFrame) -> Decimal:
+    def record_rebalancing(
+        self,
+        day,
+        held_columns: np.ndarray,
+        held_prev_close: np.ndarray,
+        sold_qty: np.ndarray,
+        columns: np.ndarray,
+        close: np.ndarray,
+        prev_close: np.ndarray,
+        order_qty: np.ndarray,
+        is_buying: np.ndarray,
+    ):
         """
-        Daily update asset without rebalancing
+        Record the trades of a rebalancing and the positions after it in the journal
+
         Args:
-            group (pd.DataFrame)
+            day (datetime.date)
+            held_columns (np.ndarray): panel columns of the held stocks
+            held_prev_close (np.ndarray): aligned with held_columns
+            sold_qty (np.ndarray): aligned with held_columns, sold where positive
+            columns (np.ndarray): panel columns of the quoted stocks
+            close (np.ndarray): aligned with columns
+            prev_close (np.ndarray): aligned with columns
+            order_qty (np.ndarray): aligned with columns
+            is_buying (np.ndarray): indices of the bought stocks in columns
+        """
+        is_sold = sold_qty > 0
+        self.journal.record_trades(
+            day,
+            held_columns[is_sold],
+            -1,
+            sold_qty[is_sold],
+            held_prev_close[is_sold],
+            float(self.sell_fee),
+        )
+        # The buys are charged the sell fee, see the cash update of rebalancing
+        self.journal.record_trades(
+            day,
+            columns[is_buying],
+            1,
+            order_qty[is_buying],
+            prev_close[is_buying],
+            float(self.sell_fee),
+        )
+
+        # Held stocks are valued at the close, or the old price when not quoted
+        held = [symbol for symbol in self.portfolio if symbol != "CASH"]
+        close_by_column = dict(zip(columns.tolist(), close.tolist()))
+        held_columns = [self.panel.ticker_index[symbol] for symbol in held]
+        self.journal.positions.extend(
+            date=np.datetime64(day, "D"),
+            ticker=held_columns,
+            qty=[self.portfolio[symbol] for symbol in held],
+            price=[
+                close_by_column.get(column, self.old_price[symbol])
+                for column, symbol in zip(held_columns, held)
+            ],
+        )
+
+    @property
+    def allocation(self) -> List[Dict]:
+        """
+        Holding capital and remaining cash after each rebalancing, read from the
+        journal cash table, amounts as floats
 
         Returns:
-            Decimal
+            List[Dict]: holding_capital, cash_remaining and date
         """
-        asset = Decimal('0.0')
-        for symbol, value in self.portfolio.items():
-            if symbol == "CASH":
-                asset += value
-            else:
-                try:
-                    price = group[group['tickersymbol'] == symbol]["close"].iloc[0]
-                    asset += value * Decimal(price)
-                    self.old_price[symbol] = price
-                except Exception as _:
-                    self.suspended_stock.append(
-                        [group["date"].iloc[0], symbol, self.old_price[symbol]]
-                    )
-                    asset += value * Decimal(self.old_price[symbol])
+        if self.journal is None:
+            return []
 
-        return asset
+        cash = self.journal.cash.columns()
+        return [
+            {
+                "holding_capital": holding_capital,
+                "cash_remaining": cash_remaining,
+                "date": day,
+            }
+            for day, cash_remaining, holding_capital in zip(
+                cash["date"].astype(object),
+                cash["cash"].tolist(),
+                cash["holding_capital"].tolist(),
+            )
+        ]
 
-    def update_period_return(
-        self,
-        group: pd.DataFrame,
-        is_rebalancing: bool,
-        pe=List[float],
-        dy=List[float],
-    ):
+    @property
+    def suspended_stock(self) -> List[List]:
+        """
+        Held stocks valued at their old price on a date they are not quoted, read
+        from the journal suspensions table
+
+        Returns:
+            List[List]: date, symbol and price
+        """
+        if self.journal is None:
+            return []
+
+        suspensions = self.journal.suspensions.columns()
+        return [
+            [day, symbol, price]
+            for day, symbol, price in zip(
+                suspensions["date"].astype(object),
+                self.journal.tickers[suspensions["ticker"]].tolist(),
+                suspensions["price"].tolist(),
+            )
+        ]
+
+    def factor_engine(self) -> FactorEngine:
+        """
+        Get the factor engine of the panel, cached next to the dataset and keyed by
+        its fingerprint
+
+        Returns:
+            FactorEngine
+        """
+        if self.factors is None:
+            self.factors = FactorEngine(
+                self.panel,
+                directory=os.path.join(cache_dir(self.path), "factors"),
+                fingerprint=self.dataset_fingerprint(),
+            )
+        return self.factors
+
+    def dataset_fingerprint(self) -> Dict:
+        """
+        Get the manifest of the dataset plus the fingerprint of its csv, the key of
+        the caches derived from the processed data
+
+        Returns:
+            Dict
+        """
+        return {**self.dataset_manifest(), "source": source_fingerprint(self.path)}
+
+    def shared_panel(self) -> MarketPanel:
+        """
+        Get the panel memory-mapped from the dataset cache, processed and saved
+        first if it is missing or stale
+
+        Returns:
+            MarketPanel: read-only, its pages are shared by the processes loading it
+        """
+        directory = os.path.join(cache_dir(self.path), "panel")
+        panel = MarketPanel.load(directory, self.dataset_fingerprint())
+        if panel is not None:
+            self.process_vnindex()
+            return panel
+
+        grouped_data, _ = self.process_data()
+        MarketPanel(list(grouped_data)).save(directory, self.dataset_fingerprint())
+        return MarketPanel.load(directory, self.dataset_fingerprint())
+
+    def select_factors(
+        self, row: int, columns: np.ndarray, is_qualified: np.ndarray
+    ) -> np.ndarray:
+        """
+        Narrow the qualified tickers with the factor filters and ranking
+
+        Args:
+            row (int): panel row of the date
+            columns (np.ndarray): panel columns of the tickers
+            is_qualified (np.ndarray)
+
+        Returns:
+            np.ndarray: bool mask over columns
+        """
+        if not self.factor_filters and self.factor_rank is None:
+            return is_qualified
+
+        return self.factor_engine().select(
+            row, columns, self.factor_filters, self.factor_rank, is_qualified
+        )
+
+    def daily_update_segment(self, start: int, end: int) -> List[Decimal]:
+        """
+        Daily update asset without rebalancing, for the dates start to end - 1 of the
+        panel, between two rebalancing dates where the holdings are constant
+
+        The prices of the held stocks over the whole segment are gathered from the
+        forward-filled close at once. A stock not quoted yet in the segment is valued
+        at its old price. The asset is accumulated in Decimal in portfolio order.
+
+        Args:
+            start (int): first panel row of the segment
+            end (int): panel row after the segment
+
+        Returns:
+            List[Decimal]: asset per date
+        """
+        cash = self.portfolio["CASH"]
+        symbols = [symbol for symbol in self.portfolio if symbol != "CASH"]
+        qty = [self.portfolio[symbol] for symbol in symbols]
+        columns = [self.panel.ticker_index[symbol] for symbol in symbols]
+
+        old_price = np.array([self.old_price[symbol] for symbol in symbols])
+        is_quoted_since = self.panel.last_quote[start:end, columns] >= start
+        prices = np.where(
+            is_quoted_since, self.panel.ffill_close[start:end, columns], old_price
+        )
+
+        is_suspended = ~self.panel.present[start:end, columns]
+        if is_suspended.any():
+            rows, held = np.nonzero(is_suspended)
+            self.journal.suspensions.extend(
+                date=np.array(self.panel.dates[start:end], dtype="datetime64[D]")[rows],
+                ticker=np.array(columns, dtype=np.int32)[held],
+                price=prices[rows, held],
+            )
+        if symbols:
+            self.old_price.update(zip(symbols, prices[-1].tolist()))
+
+        assets = []
+        for day_prices in prices.tolist():
+            asset = Decimal('0.0') + cash
+            for value, price in zip(qty, day_prices):
+                asset += value * Decimal(price)
+            assets.append(asset)
+
+        return assets
+
+    def update_period_return(self, updated_asset: Decimal):
         """
         Update period return
 
         Args:
-            group (pd.DataFrame)
-            is_rebalancing (bool)
-            pe (List(float))
-            dy (List(float))
+            updated_asset (Decimal): asset at the end of the date
         """
         current_asset = self.assets[-1]
-        updated_asset = (
-            self.rebalancing(group, pe, dy)
-            if is_rebalancing
-            else self.daily_update_asset(group)
-        )
         self.period_returns.append(updated_asset / current_asset - 1)
         self.ac_returns.append(updated_asset / self.capital - 1)
         self.assets.append(updated_asset)
 
-    def load_data(self):
+        if self.streaming_metric is None:
+            return
+
+        benchmark_return = (
+            self.vnindex_data["return"].iat[len(self.period_returns) - 1]
+            if self.vnindex_data is not None
+            and len(self.vnindex_data) >= len(self.period_returns)
+            else None
+        )
+        self.streaming_metric.update(self.period_returns[-1], benchmark_return)
+
+    def load_data(self, timeline: Optional[Timeline] = None):
         """
         Load data to csv file
+
+        The financial and daily queries run concurrently.
+
+        Args:
+            timeline (Timeline, optional): records the stages. Defaults to None.
         """
+        timeline = timeline if timeline is not None else Timeline()
         print("Fetching data from db...")
         start, from_date, to_date, end = get_date(
             self.from_date_str, self.to_date_str, look_back=252, forward_period=40
         )
-        financial_data = self.data_service.get_financial_data(
-            from_date.year - 1, to_date.year - 1, self.code
-        )
+
+        def get_financial_data():
+            with timeline.stage(f"{self.path} financial query"):
+                return self.data_service.get_financial_data(
+                    from_date.year - 1, to_date.year - 1, self.code
+                )
+
+        def get_daily_data():
+            with timeline.stage(f"{self.path} daily query"):
+                return self.data_service.get_daily_data(from_date, end)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            financial_future = executor.submit(get_financial_data)
+            daily_future = executor.submit(get_daily_data)
+            financial_data = financial_future.result()
+            daily_data = daily_future.result()
 
         print("Loading data...")
-        daily_data = self.data_service.get_daily_data(from_date, end)
+        with timeline.stage(f"{self.path} transform"):
+            backtesting_data = self.transform_data(
+                daily_data, financial_data, start, to_date
+            )
+        with timeline.stage(f"{self.path} write"):
+            backtesting_data.to_csv(self.path)
+            write_cache(backtesting_data, self.path, self.dataset_manifest())
+        print("Data is loaded...")
+
+    def transform_data(
+        self,
+        daily_data: pd.DataFrame,
+        financial_data: pd.DataFrame,
+        start,
+        to_date,
+    ) -> pd.DataFrame:
+        """
+        Join daily close and financial data, compute pe and dy
+
+        Args:
+            daily_data (pd.DataFrame)
+            financial_data (pd.DataFrame)
+            start (datetime.date): look back start date
+            to_date (datetime.date)
+
+        Returns:
+            pd.DataFrame
+        """
         daily_data['prev_close'] = (
             daily_data.groupby('tickersymbol')['close'].shift(1).dropna()
         )
 
         daily_data["date"] = pd.to_datetime(daily_data["date"]).dt.date
         daily_data = daily_data.astype({"close": float, "prev_close": float})
-        financial = Financial(from_date=start, to_date=to_date, data=financial_data)
-        financial_filtered_data = pd.merge(
-            financial.eps(), financial.dps(), on=["year", "tickersymbol"], how="outer"
-        ).fillna(0)
 
         backtesting_data = pd.merge(
             daily_data,
-            financial_filtered_data,
+            self.financial_factors(financial_data, start, to_date),
             on=["year", "tickersymbol"],
             how="outer",
         )
+        self.compute_ratios(backtesting_data)
+        return backtesting_data[~backtesting_data["date"].isna()].copy()
+
+    def financial_factors(
+        self, financial_data: pd.DataFrame, start, to_date
+    ) -> pd.DataFrame:
+        """
+        Get the per share factors (eps, dps...) per year and ticker
+
+        Args:
+            financial_data (pd.DataFrame)
+            start (datetime.date): look back start date
+            to_date (datetime.date)
+
+        Returns:
+            pd.DataFrame
+        """
+        financial = Financial(from_date=start, to_date=to_date, data=financial_data)
+        return financial.per_share(self.per_share_codes)
+
+    def compute_ratios(self, backtesting_data: pd.DataFrame):
+        """
+        Compute pe and dy columns in place
+
+        Args:
+            backtesting_data (pd.DataFrame)
+        """
         backtesting_data["pe"] = (
             backtesting_data["prev_close"].copy()
             * 1000
@@ -391,46 +856,171 @@ class Backtesting:
             * -1
             / (backtesting_data["prev_close"].copy() * 1000)
         )
-        backtesting_data = backtesting_data[~backtesting_data["date"].isna()].copy()
-        backtesting_data.to_csv(self.path)
-        print("Data is loaded...")
+
+    def refresh_data(self, timeline: Optional[Timeline] = None):
+        """
+        Incrementally refresh the stored dataset
+
+        Only quote rows newer than the last stored date are fetched. Their prev_close
+        is chained to the last stored close of each ticker. Financial data is small and
+        refetched, pe/dy are recomputed only for the new rows and the rows whose
+        eps/dps were restated. New rows are appended to the csv file, which is only
+        rewritten when rows were restated. Falls back to load_data when there is no
+        fresh stored dataset with the same start date and codes.
+
+        Args:
+            timeline (Timeline, optional): records the stages. Defaults to None.
+        """
+        timeline = timeline if timeline is not None else Timeline()
+        stored_data = read_cache(
+            self.path, {"from_date_str": self.from_date_str, "codes": self.code}
+        )
+        if stored_data is None:
+            print("No stored dataset to refresh, loading the full window...")
+            self.load_data(timeline)
+            return
+
+        last_date = stored_data["date"].max()
+        print(f"Refreshing data after {last_date}...")
+        start, from_date, to_date, end = get_date(
+            self.from_date_str, self.to_date_str, look_back=252, forward_period=40
+        )
+
+        def get_financial_data():
+            with timeline.stage(f"{self.path} financial query"):
+                return self.data_service.get_financial_data(
+                    from_date.year - 1, to_date.year - 1, self.code
+                )
+
+        def get_daily_data():
+            with timeline.stage(f"{self.path} daily delta query"):
+                return self.data_service.get_daily_data(last_date, end)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            financial_future = executor.submit(get_financial_data)
+            daily_future = executor.submit(get_daily_data)
+            financial_data = financial_future.result()
+            daily_data = daily_future.result()
+
+        with timeline.stage(f"{self.path} transform"):
+            factors = self.financial_factors(financial_data, start, to_date)
+
+            # Restated eps / dps of the stored rows
+            restated = pd.merge(
+                stored_data[["year", "tickersymbol"]],
+                factors,
+                on=["year", "tickersymbol"],
+                how="left",
+            )
+            is_restated = np.zeros(len(stored_data), dtype=bool)
+            for column in ["eps", "dps"]:
+                old, new = stored_data[column].to_numpy(), restated[column].to_numpy()
+                is_restated |= ~((old == new) | (np.isnan(old) & np.isnan(new)))
+            stored_data.loc[is_restated, ["eps", "dps"]] = restated.loc[
+                is_restated, ["eps", "dps"]
+            ].to_numpy()
+            restated_data = stored_data.loc[is_restated].copy()
+            self.compute_ratios(restated_data)
+            stored_data.loc[is_restated, ["pe", "dy"]] = restated_data[
+                ["pe", "dy"]
+            ].to_numpy()
+
+            # New rows, chained to the last stored close of each ticker
+            daily_data["date"] = pd.to_datetime(daily_data["date"]).dt.date
+            daily_data = daily_data[daily_data["date"] > last_date]
+            last_rows = (
+                stored_data[["year", "date", "tickersymbol", "close"]]
+                .sort_values("date", kind="stable")
+                .drop_duplicates("tickersymbol", keep="last")
+            )
+            new_data = pd.concat([last_rows, daily_data], ignore_index=True)
+            new_data["prev_close"] = new_data.groupby("tickersymbol")["close"].shift(1)
+            new_data = new_data.iloc[len(last_rows) :].astype(
+                {"close": float, "prev_close": float}
+            )
+            new_data = pd.merge(
+                new_data, factors, on=["year", "tickersymbol"], how="left"
+            )
+            self.compute_ratios(new_data)
+            new_data = new_data[stored_data.columns]
+
+        with timeline.stage(f"{self.path} write"):
+            if is_restated.any():
+                backtesting_data = pd.concat([stored_data, new_data], ignore_index=True)
+                backtesting_data.to_csv(self.path)
+            else:
+                new_data.index = (
+                    np.arange(len(new_data)) + last_csv_index(self.path) + 1
+                )
+                new_data.to_csv(self.path, mode="a", header=False)
+                backtesting_data = pd.concat([stored_data, new_data], ignore_index=True)
+            write_cache(backtesting_data, self.path, self.dataset_manifest())
+
+        print(
+            f"Data is refreshed: {len(new_data)} new rows, "
+            f"{is_restated.sum()} restated rows"
+        )
 
     def process_data(self):
         """
         Process and group data to single data frame
 
+        Typed columns are read from the columnar cache next to the csv files, the
+        cache is rebuilt from the csv files when it is missing or stale.
+
         Returns:
             _type_: _description_
         """
-        backtesting_data = pd.read_csv(self.path)
-        backtesting_data["date"] = pd.to_datetime(backtesting_data["date"]).dt.date
-        backtesting_data = backtesting_data.astype(
-            {
-                "close": float,
-                "prev_close": float,
-                "eps": float,
-                "dps": float,
-                "pe": float,
-                "dy": float,
-            }
+        backtesting_data = read_cache(self.path, self.dataset_manifest())
+        if backtesting_data is None:
+            backtesting_data = pd.read_csv(self.path, index_col=0)
+            backtesting_data["date"] = pd.to_datetime(backtesting_data["date"]).dt.date
+            backtesting_data = backtesting_data.astype(
+                {
+                    "close": float,
+                    "prev_close": float,
+                    "eps": float,
+                    "dps": float,
+                    "pe": float,
+                    "dy": float,
+                }
+            )
+            write_cache(backtesting_data, self.path, self.dataset_manifest())
+
+        self.process_vnindex()
+        return backtesting_data.groupby(["date"]), first_date_of_months(
+            self.from_date_str, self.to_date_str
         )
 
-        self.vnindex_data = pd.read_csv(self.index_path)
-        self.vnindex_data["date"] = pd.to_datetime(self.vnindex_data["date"]).dt.date
+    def process_vnindex(self):
+        """
+        Load VNINDEX from the columnar cache, rebuilt from the csv file when it is
+        missing or stale, with Decimal returns
+        """
+        self.vnindex_data = read_cache(
+            self.index_path, self.dataset_manifest(with_codes=False)
+        )
+        if self.vnindex_data is None:
+            self.vnindex_data = pd.read_csv(self.index_path, index_col=0)
+            self.vnindex_data["date"] = pd.to_datetime(
+                self.vnindex_data["date"]
+            ).dt.date
+            write_cache(
+                self.vnindex_data,
+                self.index_path,
+                self.dataset_manifest(with_codes=False),
+            )
         self.vnindex_data["return"] = self.vnindex_data["return"].apply(
             lambda x: Decimal(str(x))
         )
 
-        return backtesting_data.groupby(["date"]), first_date_of_months(
-            self.from_date_str, self.to_date_str
-        )
-
     def run(
         self,
         processed_data,
         execution_dates,
-        pe=BACKTESTING_CONFIG["pe"],
-        dy=BACKTESTING_CONFIG["dy"],
+        pe=None,
+        dy=None,
+        progress_callback: Optional[Callable] = None,
     ):
         """_summary_
 
@@ -439,89 +1029,482 @@ class Backtesting:
             execution_dates (_type_): _description_
             pe (_type_, optional): _description_. Defaults to backtesting_config["pe"].
             dy (_type_, optional): _description_. Defaults to backtesting_config["dy"].
+            progress_callback (Callable, optional): called with (step, date, score) at
+                each rebalancing date, see report_progress. Defaults to None.
 
         Returns:
             _type_: _description_
         """
-        is_rebalancing = False
-        for date, group in processed_data:
-            is_rebalancing = (
-                ((not is_rebalancing) and (date[0] >= execution_dates.queue[0]))
-                if not execution_dates.empty()
-                else False
+        pe = config.BACKTESTING_CONFIG["pe"] if pe is None else pe
+        dy = config.BACKTESTING_CONFIG["dy"] if dy is None else dy
+        if not isinstance(processed_data, (list, PanelGroups)):
+            # The groupby of process_data, split into daily groups while iterated,
+            # MarketData already holds the groups
+            if self.profiler is not None:
+                processed_data = self.profiler.iterate("groupby", processed_data)
+            processed_data = list(processed_data)
+        if self.panel is None:
+            self.panel = (
+                MarketPanel(processed_data)
+                if self.profiler is None
+                else self.profiler.wrap("panel", MarketPanel)(processed_data)
             )
-            self.update_period_return(group, is_rebalancing, pe, dy)
-            if is_rebalancing:
-                self.monthly_tracking.append((date[0], self.assets[-1]))
-                self.rebalancing_dates.append(date[0])
-                execution_dates.get()
-
+        self.journal = Journal(self.panel.tickers)
+        if progress_callback is not None:
+            self.streaming_metric = StreamingMetric()
+
+        is_rebalancing = self.panel.rebalancing_flags(execution_dates)
+        segment_ends = np.append(np.flatnonzero(is_rebalancing), len(processed_data))
+        start = 0
+        for end in segment_ends.tolist():
+            if start < end:
+                for asset in self.daily_update_segment(start, end):
+                    self.update_period_return(asset)
+                self.tracking_dates += self.panel.dates[start:end]
+            if end == len(processed_data):
+                break
+
+            date, group = processed_data[end]
+            self.update_period_return(self.rebalancing(group, pe, dy, end))
+            self.monthly_tracking.append((date[0], self.assets[-1]))
+            self.rebalancing_dates.append(date[0])
+            if progress_callback is not None:
+                self.report_progress(progress_callback, date[0])
             self.tracking_dates.append(date[0])
+            start = end + 1
+
+        return self.compute_metric()
+
+    def run_fixed_point(
+        self, processed_data, execution_dates, pe=None, dy=None
+    ) -> float:
+        """
+        Backtest on the int64 fixed-point ledger instead of Decimal, same selection
+        and trading rules as run, see ledger.py
+
+        Args:
+            processed_data (_type_): daily groups, as returned by process_data
+            execution_dates (_type_): rebalancing dates queue, consumed
+            pe (_type_, optional): Defaults to backtesting_config["pe"].
+            dy (_type_, optional): Defaults to backtesting_config["dy"].
+
+        Returns:
+            float: annualized sharpe ratio, the ledger is kept in self.ledger
+        """
+        pe = config.BACKTESTING_CONFIG["pe"] if pe is None else pe
+        dy = config.BACKTESTING_CONFIG["dy"] if dy is None else dy
+        if self.panel is None:
+            self.panel = MarketPanel(list(processed_data))
+        panel = self.panel
+
+        self.ledger = FixedPointLedger(
+            self.capital, self.buy_fee, self.sell_fee, len(panel.tickers)
+        )
+        is_rebalancing = panel.rebalancing_flags(execution_dates)
+        segment_ends = np.append(np.flatnonzero(is_rebalancing), len(panel.dates))
+        start = 0
+        for end in segment_ends.tolist():
+            if start < end:
+                columns = self.ledger.holdings()
+                self.ledger.mark(
+                    columns,
+                    panel.ffill_close[start:end, columns],
+                    panel.last_quote[start:end, columns] >= start,
+                )
+            if end == len(panel.dates):
+                break
+
+            columns, is_qualified = self.panel_selection(end, pe, dy)
+            self.ledger.rebalance(
+                columns,
+                panel.close[end, columns],
+                panel.prev_close[end, columns],
+                is_qualified,
+            )
+            start = end + 1
+
+        period_returns = self.ledger.period_returns()
+        metric = Metric(
+            period_returns.tolist(),
+            self.vnindex_data["return"].astype(float).to_list(),
+        )
+        return float(metric.sharpe_ratio(0.00023) * np.sqrt(250))
 
+    def panel_selection(
+        self, row: int, pe: List[float], dy: List[float]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Select the stocks of one date from the panel, as rebalancing
+
+        Args:
+            row (int): panel row of the date
+            pe (List[float])
+            dy (List[float])
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: panel columns of the quoted tickers in the
+            order of the daily group, and the bool mask of the qualified ones
+        """
+        panel = self.panel
+        columns = panel.index[1][panel.offsets[row] : panel.offsets[row + 1]]
+        pe_values = panel.pe[row, columns]
+        dy_values = panel.dy[row, columns]
+        is_qualified = (
+            (pe_values >= pe[0])
+            & (pe_values <= pe[1])
+            & (dy_values >= dy[0])
+            & (dy_values <= dy[1])
+        )
+        return columns, self.select_factors(row, columns, is_qualified)
+
+    def selection_signature(self, execution_dates, pe=None, dy=None) -> str:
+        """
+        Hash the stocks selected at every rebalancing date
+
+        The backtest only depends on the parameters through these selections, so
+        parameter sets with the same signature give the same results, e.g. every
+        dy lower bound between two consecutive observed dy values.
+
+        Args:
+            execution_dates (_type_): rebalancing dates queue, consumed
+            pe (_type_, optional): Defaults to backtesting_config["pe"].
+            dy (_type_, optional): Defaults to backtesting_config["dy"].
+
+        Returns:
+            str
+        """
+        pe = config.BACKTESTING_CONFIG["pe"] if pe is None else pe
+        dy = config.BACKTESTING_CONFIG["dy"] if dy is None else dy
+        digest = hashlib.blake2b(digest_size=16)
+        for row in np.flatnonzero(self.panel.rebalancing_flags(execution_dates)):
+            columns, is_qualified = self.panel_selection(row, pe, dy)
+            selected = columns[is_qualified].astype(np.int32)
+            digest.update(np.array([row, len(selected)], dtype=np.int64).tobytes())
+            digest.update(selected.tobytes())
+        return digest.hexdigest()
+
+    def compute_metric(self) -> Decimal:
+        """
+        Compute the metrics of the run
+
+        Returns:
+            Decimal: annualized sharpe ratio
+        """
         self.metric = Metric(self.period_returns, self.vnindex_data["return"].to_list())
         return self.metric.sharpe_ratio(Decimal('0.00023')) * Decimal(np.sqrt(250))
 
-    def plot_hpr(self, path="result/backtest/hpr.svg"):
+    def enable_profiling(self, profiler: Optional[Profiler] = None) -> Profiler:
         """
-        Plot and save NAV chart to path
+        Time the hot path phases and count rows scanned, suspended price fallbacks
+        and orders of this instance, see Profiler.instrument
 
         Args:
-            path (str, optional): _description_. Defaults to "result/backtest/nav.svg".
+            profiler (Profiler, optional): e.g. to share the clock with the data
+                loading stages. Defaults to a new profiler.
+
+        Returns:
+            Profiler
+        """
+        return (profiler or Profiler()).instrument(self)
+
+    def report_progress(self, progress_callback: Callable, date):
+        """
+        Report the interim annualized sharpe ratio to the progress callback
+
+        The step is the number of rebalancing dates so far. Nothing is reported while
+        the sharpe ratio is undefined (less than two returns or no volatility yet).
+        The callback may raise to stop the run, e.g. optuna.TrialPruned.
+
+        Args:
+            progress_callback (Callable): called with (step, date, score)
+            date (datetime.date): rebalancing date
+        """
+        try:
+            score = self.streaming_metric.sharpe_ratio() * Decimal(np.sqrt(250))
+        except (ValueError, ArithmeticError):
+            return
+
+        progress_callback(len(self.monthly_tracking), date, score)
+
+    def rebalancing_many(
+        self,
+        close: np.ndarray,
+        prev_close: np.ndarray,
+        present: np.ndarray,
+        selected: np.ndarray,
+        state: Dict[str, np.ndarray],
+    ) -> np.ndarray:
         """
-        plt.figure(figsize=(10, 6))
+        Rebalance every simulated portfolio at once, float64 mirror of rebalancing
+
+        Args:
+            close (np.ndarray): close of the date, one per ticker
+            prev_close (np.ndarray): previous close of the date, one per ticker
+            present (np.ndarray): ticker is quoted on the date
+            selected (np.ndarray): params x tickers qualified stocks
+            state (Dict[str, np.ndarray]): cash, qty, member and old_price, updated
 
-        percent_portfolio = [100 * val for val in self.ac_returns]
-        percent_index = [100 * val for val in self.vnindex_data["ac_return"].to_numpy()]
+        Returns:
+            np.ndarray: new asset, one per param set
+        """
+        cash, qty, member = state["cash"], state["qty"], state["member"]
+        is_held = member & present
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            total_asset = cash + np.where(is_held, prev_close * qty, 0.0).sum(axis=1)
+            n_selected = selected.sum(axis=1, keepdims=True)
+            target_qty = round_lots(
+                np.where(selected, total_asset[:, None] / (n_selected * prev_close), 0)
+            )
 
-        plt.plot(
-            self.tracking_dates,
-            percent_portfolio,
-            label="Portfolio",
-            color='black',
+            # Sell phase
+            required_qty = target_qty - qty
+            is_selling = is_held & (required_qty <= 0)
+            cash = cash + np.where(
+                is_selling, prev_close * -required_qty * (1 - float(self.sell_fee)), 0.0
+            ).sum(axis=1)
+            remaining_qty = np.where(is_selling, target_qty, qty)
+            stock_asset = np.where(is_held, close * remaining_qty, 0.0).sum(axis=1)
+            member &= ~(is_held & (remaining_qty == 0))
+
+            # Buy phase
+            order_qty = np.where(is_held, required_qty, target_qty)
+            is_target = selected & ~is_selling
+            n_target = is_target.sum(axis=1, keepdims=True)
+            adjusted_qty = round_lots(
+                np.where(
+                    is_target,
+                    cash[:, None] / (n_target * prev_close * (1 + float(self.buy_fee))),
+                    0,
+                )
+            )
+            is_buying = is_target & (adjusted_qty > 0)
+            cash = cash - np.where(
+                is_buying, order_qty * prev_close * (1 + float(self.sell_fee)), 0.0
+            ).sum(axis=1)
+            bought_asset = np.where(is_buying, order_qty * close, 0.0).sum(axis=1)
+
+        qty[:] = np.where(is_buying, remaining_qty + order_qty, remaining_qty)
+        member |= is_buying
+        state["old_price"] = np.where(is_buying, close, state["old_price"])
+        state["cash"] = cash
+
+        return stock_asset + bought_asset + cash
+
+    def daily_update_many(
+        self, close: np.ndarray, present: np.ndarray, state: Dict[str, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Daily update every simulated portfolio at once, float64 mirror of
+        daily_update_segment
+
+        Args:
+            close (np.ndarray): close of the date, one per ticker
+            present (np.ndarray): ticker is quoted on the date
+            state (Dict[str, np.ndarray]): cash, qty, member and old_price, updated
+
+        Returns:
+            np.ndarray: asset, one per param set
+        """
+        state["old_price"] = np.where(
+            state["member"] & present, close, state["old_price"]
         )
-        plt.plot(
-            self.vnindex_data["date"],
-            percent_index,
-            label="VNINDEX",
-            color='red',
+        return state["cash"] + (state["qty"] * state["old_price"]).sum(axis=1)
+
+    def run_many(
+        self, processed_data, execution_dates, param_list: List[Dict]
+    ) -> pd.DataFrame:
+        """
+        Backtest many (pe, dy) parameter sets side by side in one pass over the data
+
+        The selection of every parameter set is built at once as a
+        params x rebalancing dates x tickers boolean cube, then the portfolios are
+        simulated together in float64. Results match run up to float rounding and
+        can be pivoted on pe/dy for sensitivity heatmaps.
+
+        Args:
+            processed_data (_type_): daily groups, as returned by process_data
+            execution_dates (_type_): rebalancing dates queue, consumed
+            param_list (List[Dict]): parameter sets, e.g. {"pe": [0, 15], "dy": [0.01, 1e6]}
+
+        Returns:
+            pd.DataFrame: one metrics row per parameter set
+        """
+        panel = self.panel if self.panel is not None else MarketPanel(processed_data)
+        is_rebalancing = panel.rebalancing_flags(execution_dates)
+        rebalancing_rows = np.flatnonzero(is_rebalancing)
+
+        pe = np.array([params["pe"] for params in param_list], dtype=float)
+        dy = np.array([params["dy"] for params in param_list], dtype=float)
+        pe_values = panel.pe[rebalancing_rows]
+        dy_values = panel.dy[rebalancing_rows]
+        selection = (
+            (pe_values >= pe[:, 0, None, None])
+            & (pe_values <= pe[:, 1, None, None])
+            & (dy_values >= dy[:, 0, None, None])
+            & (dy_values <= dy[:, 1, None, None])
         )
+        if self.factor_filters or self.factor_rank is not None:
+            self.panel = panel
+            columns = np.arange(len(panel.tickers))
+            for i, row in enumerate(rebalancing_rows.tolist()):
+                for params_selection in selection[:, i]:
+                    params_selection[:] = self.select_factors(
+                        row, columns, params_selection
+                    )
+
+        n_params, n_tickers = len(param_list), len(panel.tickers)
+        state = {
+            "cash": np.full(n_params, float(self.capital)),
+            "qty": np.zeros((n_params, n_tickers), dtype=np.int64),
+            "member": np.zeros((n_params, n_tickers), dtype=bool),
+            "old_price": np.zeros((n_params, n_tickers)),
+        }
+        assets = np.empty((n_params, len(panel.dates) + 1))
+        assets[:, 0] = float(self.capital)
+        for i in range(len(panel.dates)):
+            if is_rebalancing[i]:
+                assets[:, i + 1] = self.rebalancing_many(
+                    panel.close[i],
+                    panel.prev_close[i],
+                    panel.present[i],
+                    selection[:, np.searchsorted(rebalancing_rows, i)],
+                    state,
+                )
+            else:
+                assets[:, i + 1] = self.daily_update_many(
+                    panel.close[i], panel.present[i], state
+                )
 
-        plt.title('Holding Period Return Over Time')
-        plt.xlabel('Time Step')
-        plt.ylabel('Holding Period Return (%)')
-        plt.grid(True)
-        plt.legend()
-        plt.savefig(path, dpi=300, bbox_inches='tight', format='svg')
+        # Constant portfolios (nothing ever selected) give inf/nan ratios
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metric = BatchMetric(
+                assets[:, 1:] / assets[:, :-1] - 1,
+                self.vnindex_data["return"].to_numpy(dtype=float),
+            )
+
+        return pd.DataFrame(
+            {
+                "pe": [params["pe"] for params in param_list],
+                "dy": [params["dy"] for params in param_list],
+                "sharpe_ratio": metric.sharpe_ratio(0.00023) * np.sqrt(250),
+                "sortino_ratio": metric.sortino_ratio(0.00023) * np.sqrt(250),
+                "information_ratio": metric.information_ratio() * np.sqrt(250),
+                "maximum_drawdown": metric.maximum_drawdown()[0],
+                "hpr": metric.hpr(),
+                "excess_hpr": metric.excess_hpr(),
+            }
+        )
 
-    def plot_drawdown(self, path="result/backtest/drawdown.svg"):
+    def hpr_chart(self) -> Chart:
         """
-        Plot and save drawdown chart to path
+        Get the holding period return chart of the portfolio and VNINDEX
 
-        Args:
-            path (str, optional): _description_. Defaults to "result/backtest/drawdown.svg".
+        Returns:
+            Chart
+        """
+        return (
+            Chart(
+                'Holding Period Return Over Time',
+                'Time Step',
+                'Holding Period Return (%)',
+            )
+            .add(
+                "Portfolio",
+                self.tracking_dates,
+                [100 * val for val in self.ac_returns],
+                'black',
+            )
+            .add(
+                "VNINDEX",
+                self.vnindex_data["date"].to_numpy(),
+                100 * self.vnindex_data["ac_return"].to_numpy(dtype=float),
+                'red',
+            )
+        )
+
+    def drawdown_chart(self) -> Chart:
+        """
+        Get the drawdown chart of the portfolio
+
+        Returns:
+            Chart
         """
         _, drawdowns = self.metric.maximum_drawdown()
+        return Chart(
+            'Draw down Value Over Time', 'Time Step', 'Percentage', legend=False
+        ).add("Portfolio", self.tracking_dates, drawdowns, 'black')
 
-        plt.figure(figsize=(10, 6))
-        plt.plot(
-            self.tracking_dates,
-            drawdowns,
-            label="Portfolio",
-            color='black',
-        )
+    def plot_hpr(self, path="result/backtest/hpr.svg", **kwargs):
+        """
+        Plot and save NAV chart to path
+
+        Args:
+            path (str, optional): _description_. Defaults to "result/backtest/nav.svg".
+            **kwargs: image_format, dpi and max_points, see report.render
+        """
+        render(self.hpr_chart(), path, **kwargs)
+
+    def plot_drawdown(self, path="result/backtest/drawdown.svg", **kwargs):
+        """
+        Plot and save drawdown chart to path
 
-        plt.title('Draw down Value Over Time')
-        plt.xlabel('Time Step')
-        plt.ylabel('Percentage')
-        plt.grid(True)
-        plt.savefig(path, dpi=300, bbox_inches='tight', format='svg')
+        Args:
+            path (str, optional): _description_. Defaults to "result/backtest/drawdown.svg".
+            **kwargs: image_format, dpi and max_points, see report.render
+        """
+        render(self.drawdown_chart(), path, **kwargs)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="result/profile",
+        help="time the backtest phases and dump the trace to this folder",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        nargs="?",
+        const=10000,
+        help="bootstrap confidence intervals of the ratios with this many resamples",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes of the bootstrap and the charts",
+    )
+    parser.add_argument(
+        "--chart-format", choices=IMAGE_FORMATS, default="svg", help="report charts"
+    )
+    parser.add_argument(
+        "--journal",
+        nargs="?",
+        const="result/backtest/journal",
+        help="export the trades, positions, cash and suspensions to this folder",
+    )
+    parser.add_argument("--journal-format", choices=FILE_FORMATS, default="parquet")
+    parser.add_argument(
+        "--compare-ledger",
+        action="store_true",
+        help="run again on the int64 fixed-point ledger and compare with Decimal",
+    )
+    args = parser.parse_args()
+
     smart_beta, grouped_data, rebalancing_dates = create_bt_instance(
         process_data=True, is_data=True
     )
+    if args.profile:
+        profiler = smart_beta.enable_profiling()
     sr = smart_beta.run(processed_data=grouped_data, execution_dates=rebalancing_dates)
+    if args.profile:
+        print(profiler.summary())
+        profiler.export(args.profile, "backtesting")
+    if args.journal:
+        smart_beta.journal.export(args.journal, args.journal_format)
 
     print(f"Sharpe ratio {sr}")
     print(
@@ -532,6 +1515,32 @@ if __name__ == "__main__":
     )
     mdd, dds = smart_beta.metric.maximum_drawdown()
     print(f"MDD {mdd}")
+    if args.compare_ledger:
+        # pylint: disable-next=import-outside-toplevel
+        from ledger import compare
+
+        fixed_point = copy.copy(smart_beta)
+        fixed_sr = fixed_point.run_fixed_point(
+            grouped_data,
+            first_date_of_months(smart_beta.from_date_str, smart_beta.to_date_str),
+        )
+        print(f"Fixed-point sharpe ratio {fixed_sr}")
+        for key, value in compare(smart_beta.assets, fixed_point.ledger).items():
+            print(f"{key} {value}")
+    if args.bootstrap:
+        # pylint: disable-next=import-outside-toplevel
+        from metrics.bootstrap import bootstrap, format_bootstrap
+
+        print(
+            format_bootstrap(
+                bootstrap(
+                    smart_beta.period_returns,
+                    smart_beta.vnindex_data["return"].to_list(),
+                    n_resamples=args.bootstrap,
+                    workers=args.workers,
+                )
+            )
+        )
 
     monthly_df = pd.DataFrame(smart_beta.monthly_tracking, columns=["date", "asset"])
     monthly_df_index = smart_beta.vnindex_data[
@@ -544,5 +1553,24 @@ if __name__ == "__main__":
     print(f"Monthly return {returns['monthly_return']}")
     print(f"Excess monthly return {returns['excess_monthly_return']}")
     print(f"Annual return {returns['annual_return']}")
-    smart_beta.plot_hpr()
-    smart_beta.plot_drawdown()
+    print(
+        summarize_returns(
+            resample_returns(
+                smart_beta.tracking_dates,
+                smart_beta.period_returns,
+                smart_beta.vnindex_data["return"].to_list(),
+            )
+        )
+        .drop(columns="run")
+        .to_string(index=False)
+    )
+    render_many(
+        [
+            (smart_beta.hpr_chart(), f"result/backtest/hpr.{args.chart_format}"),
+            (
+                smart_beta.drawdown_chart(),
+                f"result/backtest/drawdown.{args.chart_format}",
+            ),
+        ],
+        workers=args.workers,
+    )
@@ -0,0 +1,296 @@
+"""
+Benchmark suite on synthetic market data
+
+Run from the root folder, e.g.:
+    python -m benchmark.benchmark --scales 300x5,1500x5,5000x15
+"""
+
+import os
+import csv
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+
+from backtesting import Backtesting
+from benchmark.synthetic import create_dataset
+from database.cache import MANIFEST_FILE, cache_dir
+from filter.financial import Financial
+from metrics.metric import BatchMetric, Metric, get_returns, resample_returns
+from utils import first_date_of_months
+
+BENCHMARKS = [
+    "process_data_csv",
+    "process_data_cache",
+    "financial",
+    "run",
+    "metric",
+    "batch_metric",
+    "get_returns",
+    "resample_returns",
+]
+RESULT_COLUMNS = [
+    "timestamp",
+    "revision",
+    "benchmark",
+    "tickers",
+    "years",
+    "rows",
+    "seconds",
+    "rows_per_second",
+    "peak_memory_mb",
+]
+
+
+def git_revision() -> str:
+    """
+    Get the current git revision, to compare results between versions
+
+    Returns:
+        str
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(function: Callable, repeat: int) -> Tuple[float, float]:
+    """
+    Measure best wall time over repeat calls, then peak traced memory of one more call
+
+    Args:
+        function (Callable)
+        repeat (int)
+
+    Returns:
+        Tuple[float, float]: seconds, peak memory in bytes
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return seconds, peak
+
+
+def fresh_instance(bt: Backtesting, vnindex_data: pd.DataFrame) -> Backtesting:
+    """
+    Get a fresh backtesting state on the same dataset
+
+    Args:
+        bt (Backtesting)
+        vnindex_data (pd.DataFrame)
+
+    Returns:
+        Backtesting
+    """
+    instance = Backtesting(
+        buy_fee=bt.buy_fee,
+        sell_fee=bt.sell_fee,
+        from_date_str=bt.from_date_str,
+        to_date_str=bt.to_date_str,
+        capital=bt.capital,
+        path=bt.path,
+        index_path=bt.index_path,
+    )
+    instance.vnindex_data = vnindex_data
+    return instance
+
+
+def benchmark_scale(
+    directory: str,
+    n_tickers: int,
+    n_years: int,
+    benchmarks: List[str],
+    args: argparse.Namespace,
+) -> List[Dict]:
+    """
+    Run the selected benchmarks on one synthetic dataset
+
+    Args:
+        directory (str): dataset folder
+        n_tickers (int)
+        n_years (int)
+        benchmarks (List[str])
+        args (argparse.Namespace)
+
+    Returns:
+        List[Dict]: one result row per benchmark
+    """
+    print(f"Generating {n_tickers} tickers x {n_years} years...")
+    bt, financial_data = create_dataset(
+        directory,
+        n_tickers,
+        n_years,
+        suspension_rate=args.suspension_rate,
+        coverage=args.coverage,
+        seed=args.seed,
+    )
+    grouped_data, _ = bt.process_data()
+    grouped_data = list(grouped_data)
+    n_rows = sum(len(group) for _, group in grouped_data)
+
+    done = fresh_instance(bt, bt.vnindex_data)
+    done.run(grouped_data, first_date_of_months(bt.from_date_str, bt.to_date_str))
+    metric = Metric(done.period_returns, done.vnindex_data["return"].to_list())
+    monthly_df = pd.DataFrame(done.monthly_tracking, columns=["date", "asset"])
+
+    def process_data_csv():
+        for path in [bt.path, bt.index_path]:
+            manifest = os.path.join(cache_dir(path), MANIFEST_FILE)
+            if os.path.exists(manifest):
+                os.remove(manifest)
+        bt.process_data()
+
+    def financial():
+        Financial(
+            from_date=bt.start, to_date=bt.to_date, data=financial_data
+        ).per_share(bt.per_share_codes)
+
+    def run():
+        fresh_instance(bt, bt.vnindex_data).run(
+            grouped_data, first_date_of_months(bt.from_date_str, bt.to_date_str)
+        )
+
+    def metrics():
+        metric.sharpe_ratio(Decimal('0.00023'))
+        metric.sortino_ratio(Decimal('0.00023'))
+        metric.information_ratio()
+        metric.maximum_drawdown()
+        metric.longest_drawdown()
+
+    # 256 series scored at once, e.g. trials or bootstrap paths
+    batch_returns = np.tile(np.array(done.period_returns, dtype=float), (256, 1))
+
+    def batch_metrics():
+        batch = BatchMetric(batch_returns, metric.benchmark_returns)
+        batch.sharpe_ratio(0.00023)
+        batch.sortino_ratio(0.00023)
+        batch.information_ratio()
+        batch.maximum_drawdown()
+        batch.longest_drawdown()
+
+    def returns():
+        index_df = bt.vnindex_data[
+            bt.vnindex_data["date"].isin(monthly_df["date"])
+        ].copy()
+        get_returns(monthly_df.copy(), index_df)
+
+    def resampled_returns():
+        resample_returns(
+            done.tracking_dates,
+            done.period_returns,
+            done.vnindex_data["return"].to_list(),
+        )
+
+    cases = {
+        "process_data_csv": (process_data_csv, n_rows),
+        "process_data_cache": (bt.process_data, n_rows),
+        "financial": (financial, len(financial_data)),
+        "run": (run, n_rows),
+        "metric": (metrics, len(metric.period_returns)),
+        "batch_metric": (batch_metrics, batch_returns.size),
+        "get_returns": (returns, len(bt.vnindex_data)),
+        "resample_returns": (resampled_returns, len(done.period_returns)),
+    }
+
+    results = []
+    for name in benchmarks:
+        function, rows = cases[name]
+        seconds, peak = measure(function, args.repeat)
+        results.append(
+            {
+                "benchmark": name,
+                "tickers": n_tickers,
+                "years": n_years,
+                "rows": rows,
+                "seconds": round(seconds, 6),
+                "rows_per_second": round(rows / seconds, 1),
+                "peak_memory_mb": round(peak / 1e6, 3),
+            }
+        )
+        print(
+            f"{name:<20}{n_tickers:>6} x {n_years:<4}{seconds:>12.4f}s"
+            f"{rows / seconds:>16.0f} rows/s{peak / 1e6:>12.2f} MB"
+        )
+
+    return results
+
+
+def write_results(path: str, results: List[Dict]):
+    """
+    Append results to the csv file
+
+    Args:
+        path (str)
+        results (List[Dict])
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    is_new = not os.path.exists(path)
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    revision = git_revision()
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if is_new:
+            writer.writeheader()
+        for result in results:
+            writer.writerow({"timestamp": timestamp, "revision": revision, **result})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        default="300x5",
+        help="comma separated <tickers>x<years>, e.g. 300x5,1500x5,5000x15",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        default=",".join(BENCHMARKS),
+        help=f"comma separated subset of {','.join(BENCHMARKS)}",
+    )
+    parser.add_argument("--suspension-rate", type=float, default=0.02)
+    parser.add_argument("--coverage", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default="result/benchmark/benchmark.csv")
+    parser.add_argument(
+        "--data-dir", default=None, help="keep the synthetic datasets in this folder"
+    )
+    args = parser.parse_args()
+
+    selected = args.benchmarks.split(",")
+    all_results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in args.scales.split(","):
+            tickers, years = (int(value) for value in scale.split("x"))
+            all_results += benchmark_scale(
+                os.path.join(args.data_dir or tmp_dir, scale),
+                tickers,
+                years,
+                selected,
+                args,
+            )
+
+    write_results(args.output, all_results)
+    print(f"Results are appended to {args.output}")
@@ -0,0 +1,191 @@
+"""
+Synthetic market data shaped like the database query results, used to benchmark
+the pipeline without a live database
+"""
+
+import os
+from decimal import Decimal
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+
+from backtesting import Backtesting
+from utils import get_date
+
+CODES = [72, 4110, 308]
+
+
+def ticker_symbols(n_tickers: int) -> List[str]:
+    """
+    Get distinct three letter ticker symbols: AAA, AAB...
+
+    Args:
+        n_tickers (int): at most 26 ** 3
+
+    Returns:
+        List[str]
+    """
+    letters = [chr(ord("A") + i) for i in range(26)]
+    return [
+        letters[i // 676] + letters[i // 26 % 26] + letters[i % 26]
+        for i in range(n_tickers)
+    ]
+
+
+def generate_daily_data(
+    tickers: List[str],
+    dates: pd.DatetimeIndex,
+    suspension_rate: float,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    """
+    Generate daily close prices, shaped like DataService.get_daily_data
+
+    Args:
+        tickers (List[str])
+        dates (pd.DatetimeIndex): trading dates
+        suspension_rate (float): probability that a ticker has no quote on a date
+        rng (np.random.Generator)
+
+    Returns:
+        pd.DataFrame: year, date, tickersymbol, close
+    """
+    log_returns = rng.normal(0.0003, 0.02, (len(dates), len(tickers)))
+    close = np.round(
+        rng.uniform(5, 100, len(tickers)) * np.exp(np.cumsum(log_returns, axis=0)),
+        2,
+    )
+
+    is_quoted = rng.random(close.shape) >= suspension_rate
+    date_ids, ticker_ids = np.nonzero(is_quoted)
+    quoted_dates = dates[date_ids]
+    return pd.DataFrame(
+        {
+            "year": quoted_dates.year - 1,
+            "date": quoted_dates,
+            "tickersymbol": np.array(tickers, dtype=object)[ticker_ids],
+            "close": close[is_quoted],
+        }
+    )
+
+
+def generate_financial_data(
+    tickers: List[str],
+    years: range,
+    coverage: float,
+    rng: np.random.Generator,
+) -> pd.DataFrame:
+    """
+    Generate yearly financial info, shaped like DataService.get_financial_data
+
+    Args:
+        tickers (List[str])
+        years (range)
+        coverage (float): probability that a ticker reports a given year
+        rng (np.random.Generator)
+
+    Returns:
+        pd.DataFrame: year, tickersymbol, value, code
+    """
+    year_grid, ticker_grid = np.meshgrid(
+        np.array(years), np.array(tickers, dtype=object), indexing="ij"
+    )
+    is_reported = rng.random(year_grid.shape) < coverage
+    year_values, ticker_values = year_grid[is_reported], ticker_grid[is_reported]
+    n_reports = len(year_values)
+
+    values = {
+        4110: rng.uniform(1e11, 1e13, n_reports),  # OWNER_CAPITAL
+        72: rng.normal(1e11, 1e11, n_reports),  # NET_PROFIT_AFTER_TAX...
+        308: -rng.uniform(0, 5e10, n_reports),  # DIVIDENDS_PAID
+    }
+    return (
+        pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "year": year_values,
+                        "tickersymbol": ticker_values,
+                        "value": values[code],
+                        "code": code,
+                    }
+                )
+                for code in CODES
+            ]
+        )
+        .sort_values(["year", "tickersymbol", "code"])
+        .reset_index(drop=True)
+    )
+
+
+def generate_index_data(
+    dates: pd.DatetimeIndex, rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    Generate VNINDEX prices, shaped like DataService.get_index_data
+
+    Args:
+        dates (pd.DatetimeIndex): trading dates
+        rng (np.random.Generator)
+
+    Returns:
+        pd.DataFrame: date, open, close
+    """
+    close = 1000 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+    return pd.DataFrame({"date": dates.to_pydatetime(), "open": close, "close": close})
+
+
+def create_dataset(
+    directory: str,
+    n_tickers: int,
+    n_years: int,
+    suspension_rate: float = 0.02,
+    coverage: float = 0.9,
+    seed: int = 2024,
+    from_date_str: str = "2009-01-01",
+) -> Tuple[Backtesting, pd.DataFrame]:
+    """
+    Write a synthetic pe_dps.csv / vnindex.csv pair to directory, through the same
+    transforms as Backtesting.load_data and load_vnindex
+
+    Args:
+        directory (str)
+        n_tickers (int)
+        n_years (int)
+        suspension_rate (float, optional): Defaults to 0.02.
+        coverage (float, optional): financial coverage. Defaults to 0.9.
+        seed (int, optional): Defaults to 2024.
+        from_date_str (str, optional): Defaults to "2009-01-01".
+
+    Returns:
+        Tuple[Backtesting, pd.DataFrame]: backtesting instance reading the dataset,
+        raw financial data
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    from_date = pd.Timestamp(from_date_str)
+    to_date_str = (from_date + pd.DateOffset(years=n_years)).strftime("%Y-%m-%d")
+
+    bt = Backtesting(
+        buy_fee=Decimal("0.00035"),
+        sell_fee=Decimal("0.00035"),
+        from_date_str=from_date_str,
+        to_date_str=to_date_str,
+        capital=Decimal("25e6"),
+        path=os.path.join(directory, "pe_dps.csv"),
+        index_path=os.path.join(directory, "vnindex.csv"),
+    )
+    start, from_date, to_date, end = get_date(
+        from_date_str, to_date_str, look_back=252, forward_period=40
+    )
+    dates = pd.bdate_range(from_date, end)
+
+    tickers = ticker_symbols(n_tickers)
+    financial_data = generate_financial_data(
+        tickers, range(from_date.year - 1, to_date.year), coverage, rng
+    )
+    daily_data = generate_daily_data(tickers, dates, suspension_rate, rng)
+    bt.transform_data(daily_data, financial_data.copy(), start, to_date).to_csv(bt.path)
+    bt.transform_vnindex(generate_index_data(dates, rng)).to_csv(bt.index_path)
+
+    return bt, financial_data
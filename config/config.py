@@ -1,35 +1,59 @@
 """
 Configuration module
+
+Parameter files and the .env file are parsed on first access of the module
+attributes, importing this module does not touch the file system.
 """
 
 import os
 import json
-from dotenv import load_dotenv
-
-
-load_dotenv()
-host = os.getenv("HOST")
-port = os.getenv("PORT")
-database = os.getenv("DATABASE")
-user = os.getenv("USER_DB")
-password = os.getenv("PASSWORD")
-
-db_params = {
-    "host": host,
-    "port": port,
-    "database": database,
-    "user": user,
-    "password": password,
+
+CONFIG_PATHS = {
+    "BACKTESTING_CONFIG": "parameter/backtesting_parameter.json",
+    "OPTIMIZATION_CONFIG": "parameter/optimization_parameter.json",
+    "BEST_CONFIG": "parameter/optimized_parameter.json",
 }
 
-BACKTESTING_CONFIG = None
-with open("parameter/backtesting_parameter.json", 'r', encoding="utf-8") as f:
-    BACKTESTING_CONFIG = json.load(f)
 
-OPTIMIZATION_CONFIG = None
-with open("parameter/optimization_parameter.json", 'r', encoding="utf-8") as f:
-    OPTIMIZATION_CONFIG = json.load(f)
+def load_db_params() -> dict:
+    """
+    Load database secret from environment variables and .env file
+
+    Returns:
+        dict
+    """
+    from dotenv import load_dotenv  # pylint: disable=import-outside-toplevel
+
+    load_dotenv()
+    return {
+        "host": os.getenv("HOST"),
+        "port": os.getenv("PORT"),
+        "database": os.getenv("DATABASE"),
+        "user": os.getenv("USER_DB"),
+        "password": os.getenv("PASSWORD"),
+    }
+
+
+def __getattr__(name: str):
+    """
+    Parse db_params and the *_CONFIG parameter files on first access
+
+    Args:
+        name (str): module attribute
+
+    Raises:
+        AttributeError: Unknown attribute
+
+    Returns:
+        dict
+    """
+    if name == "db_params":
+        value = load_db_params()
+    elif name in CONFIG_PATHS:
+        with open(CONFIG_PATHS[name], 'r', encoding="utf-8") as f:
+            value = json.load(f)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-BEST_CONFIG = None
-with open("parameter/optimized_parameter.json", 'r', encoding="utf-8") as f:
-    BEST_CONFIG = json.load(f)
+    globals()[name] = value
+    return value
@@ -1,5 +1,9 @@
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from backtesting import create_bt_instance
+from utils import Timeline
+from walk_forward import create_wf_instance
 
 
 def init_folder(path: str):
@@ -13,22 +17,52 @@ def init_folder(path: str):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only fetch quotes after the last stored date and restated financials",
+    )
+    parser.add_argument(
+        "--walk-forward",
+        action="store_true",
+        help="also load the whole walk-forward history to data/wf",
+    )
+    args = parser.parse_args()
+
     required_directories = [
         "data",
         "data/is",
         "data/os",
+        "data/wf",
         "result/optimization",
         "result/backtest",
+        "result/walk_forward",
         "result/optimization",
     ]
     for dr in required_directories:
         init_folder(dr)
 
-    # Loading insample data
-    is_instance, _, _ = create_bt_instance(process_data=False, is_data=True)
-    is_instance.load_data()
-    is_instance.load_vnindex()
+    def load_data(instance):
+        return instance.refresh_data if args.incremental else instance.load_data
 
+    timeline = Timeline()
+    is_instance, _, _ = create_bt_instance(process_data=False, is_data=True)
     os_instance, _, _ = create_bt_instance(process_data=False, is_data=False)
-    os_instance.load_data()
-    os_instance.load_vnindex()
+    instances = [is_instance, os_instance]
+    if args.walk_forward:
+        instances.append(create_wf_instance())
+
+    # Loading insample and outsample data concurrently, the transform and write of
+    # one dataset overlap with the queries of the others
+    with ThreadPoolExecutor(max_workers=2 * len(instances)) as executor:
+        futures = []
+        for instance in instances:
+            futures += [
+                executor.submit(load_data(instance), timeline),
+                executor.submit(instance.load_vnindex, timeline),
+            ]
+        for future in futures:
+            future.result()
+
+    print(timeline.report())
@@ -0,0 +1,151 @@
+"""
+Columnar cache for the backtesting datasets
+
+Each dataset csv gets a sibling folder (data/is/pe_dps.csv -> data/is/pe_dps.cache)
+holding one typed .npy file per column and a manifest.json describing it.
+"""
+
+import os
+import json
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+
+
+SCHEMA_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+
+def cache_dir(path: str) -> str:
+    """
+    Get cache folder of a dataset csv
+
+    Args:
+        path (str): dataset csv path
+
+    Returns:
+        str
+    """
+    return os.path.splitext(path)[0] + ".cache"
+
+
+def source_fingerprint(path: str) -> Optional[Dict]:
+    """
+    Fingerprint the source csv by size and modification time
+
+    Args:
+        path (str): dataset csv path
+
+    Returns:
+        Optional[Dict]: None if the csv does not exist
+    """
+    if not os.path.exists(path):
+        return None
+
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def read_manifest(path: str) -> Optional[Dict]:
+    """
+    Read the cache manifest of a dataset csv
+
+    Args:
+        path (str): dataset csv path
+
+    Returns:
+        Optional[Dict]: None if there is no cache
+    """
+    manifest_path = os.path.join(cache_dir(path), MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_fresh(path: str, manifest: Dict) -> bool:
+    """
+    Check whether the cache matches the expected manifest and the source csv
+
+    Args:
+        path (str): dataset csv path
+        manifest (Dict): expected query window, codes...
+
+    Returns:
+        bool
+    """
+    cached = read_manifest(path)
+    if cached is None or cached.get("schema_version") != SCHEMA_VERSION:
+        return False
+
+    if any(cached.get(key) != value for key, value in manifest.items()):
+        return False
+
+    return cached.get("source") == source_fingerprint(path)
+
+
+def write_cache(data: pd.DataFrame, path: str, manifest: Dict):
+    """
+    Write data frame to the columnar cache of a dataset csv
+
+    The source csv must be written before so that its fingerprint is recorded.
+
+    Args:
+        data (pd.DataFrame)
+        path (str): dataset csv path
+        manifest (Dict): query window, codes...
+    """
+    directory = cache_dir(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # Invalidate first, a partially written cache must never look fresh
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    columns = {}
+    for column in data.columns:
+        if column == "date":
+            values = pd.to_datetime(data[column]).to_numpy(dtype="datetime64[D]")
+        elif pd.api.types.infer_dtype(data[column]) == "string":
+            values = data[column].to_numpy(dtype=str)
+        else:
+            # Decimal columns (db numerics, vnindex returns) are stored as float64
+            values = pd.to_numeric(data[column]).to_numpy()
+
+        np.save(os.path.join(directory, f"{column}.npy"), values, allow_pickle=False)
+        columns[column] = values.dtype.str
+
+    manifest = {
+        **manifest,
+        "schema_version": SCHEMA_VERSION,
+        "columns": columns,
+        "source": source_fingerprint(path),
+    }
+    with open(manifest_path + ".tmp", 'w', encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def read_cache(path: str, manifest: Dict) -> Optional[pd.DataFrame]:
+    """
+    Read data frame from the columnar cache of a dataset csv
+
+    Args:
+        path (str): dataset csv path
+        manifest (Dict): expected query window, codes...
+
+    Returns:
+        Optional[pd.DataFrame]: None if the cache is missing or stale
+    """
+    if not is_fresh(path, manifest):
+        return None
+
+    directory = cache_dir(path)
+    data = {}
+    for column in read_manifest(path)["columns"]:
+        values = np.load(os.path.join(directory, f"{column}.npy"), allow_pickle=False)
+        data[column] = pd.Series(values).dt.date if column == "date" else values
+
+    return pd.DataFrame(data)
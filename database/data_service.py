@@ -2,11 +2,43 @@
 Data service
 """
 
-import psycopg2
+import time
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
 import pandas as pd
 
 from database.query import DAILY_DATA_QUERY, FINANCIAL_INFO_QUERY, INDEX_QUERY
-from config.config import db_params
+from config import config
+
+MAX_CONNECTIONS = 4
+FETCH_SIZE = 50000
+
+connection_pool: Optional["ThreadedConnectionPool"] = None
+connection_pool_lock = threading.Lock()
+
+# The pool raises instead of waiting when exhausted, concurrent queries wait here
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+
+def get_connection_pool() -> "ThreadedConnectionPool":
+    """
+    Get the connection pool shared by every data service, created on first query so
+    that offline backtests never import psycopg2 nor connect
+
+    Returns:
+        ThreadedConnectionPool
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from psycopg2.pool import ThreadedConnectionPool
+
+    global connection_pool  # pylint: disable=global-statement
+    with connection_pool_lock:
+        if connection_pool is None:
+            connection_pool = ThreadedConnectionPool(
+                1, MAX_CONNECTIONS, **config.db_params
+            )
+    return connection_pool
 
 
 class DataService:
@@ -16,19 +48,93 @@ class DataService:
 
     def __init__(self) -> None:
         """
-        Initiate database secret
+        Initiate query stats, connections are taken from the shared pool per query
         """
-        if (
+        self.query_stats = []
+
+    @property
+    def is_file(self) -> bool:
+        """
+        Whether the database secret is missing and data must come from files
+
+        Returns:
+            bool
+        """
+        db_params = config.db_params
+        return not (
             db_params["host"]
             and db_params["port"]
             and db_params["database"]
             and db_params["user"]
             and db_params["password"]
-        ):
-            self.connection = psycopg2.connect(**db_params)
-            self.is_file = False
-        else:
-            self.is_file = True
+        )
+
+    def fetch(
+        self,
+        name: str,
+        query: str,
+        params: Tuple,
+        columns: List[Tuple[str, str]],
+    ) -> pd.DataFrame:
+        """
+        Stream a query through a server-side cursor into typed column arrays
+
+        Rows are fetched in chunks of FETCH_SIZE, each chunk is converted to one
+        array per column right away so that the whole result set never lives as
+        Python tuples.
+
+        Args:
+            name (str): query name, used for the cursor and the stats
+            query (str)
+            params (Tuple)
+            columns (List[Tuple[str, str]]): column names and numpy dtypes
+
+        Returns:
+            pd.DataFrame
+        """
+        import psycopg2  # pylint: disable=import-outside-toplevel
+
+        start = time.perf_counter()
+        chunks = [[] for _ in columns]
+
+        pool = get_connection_pool()
+        with connection_slots:
+            connection = pool.getconn()
+            try:
+                with connection.cursor(name=f"data_service_{name}") as cursor:
+                    cursor.itersize = FETCH_SIZE
+                    cursor.execute(query, params)
+                    while rows := cursor.fetchmany(FETCH_SIZE):
+                        for chunk, values, (_, dtype) in zip(
+                            chunks, zip(*rows), columns
+                        ):
+                            chunk.append(np.array(values, dtype=dtype))
+                connection.commit()
+            except psycopg2.Error:
+                connection.rollback()
+                raise
+            finally:
+                pool.putconn(connection)
+
+        df = pd.DataFrame(
+            {
+                column: (np.concatenate(chunk) if chunk else np.array([], dtype=dtype))
+                for chunk, (column, dtype) in zip(chunks, columns)
+            }
+        )
+
+        stats = {
+            "query": name,
+            "rows": len(df),
+            "seconds": time.perf_counter() - start,
+            "bytes": int(df.memory_usage(deep=True).sum()),
+        }
+        self.query_stats.append(stats)
+        print(
+            f"Fetched {stats['rows']} rows of {name} in {stats['seconds']:.2f}s "
+            f"({stats['bytes'] / 1e6:.1f} MB)"
+        )
+        return df
 
     def get_financial_data(
         self,
@@ -47,22 +153,22 @@ class DataService:
         Returns:
             pd.DataFrame: _description_
         """
-        cursor = self.connection.cursor()
-        cursor.execute(
+        return self.fetch(
+            "financial",
             FINANCIAL_INFO_QUERY,
             (
                 from_year,
                 str(to_year),
                 tuple(included_code),
             ),
+            [
+                ("year", "int64"),
+                ("tickersymbol", "object"),
+                ("value", "float64"),
+                ("code", "int64"),
+            ],
         )
 
-        queries = list(cursor)
-        cursor.close()
-
-        columns = ["year", "tickersymbol", "value", "code"]
-        return pd.DataFrame(queries, columns=columns)
-
     def get_daily_data(
         self,
         from_date: str,
@@ -78,14 +184,17 @@ class DataService:
         Returns:
             pd.DataFrame: _description_
         """
-        cursor = self.connection.cursor()
-        cursor.execute(DAILY_DATA_QUERY, (from_date, to_date))
-
-        queries = list(cursor)
-        cursor.close()
-
-        columns = ["year", "date", "tickersymbol", "close"]
-        return pd.DataFrame(queries, columns=columns)
+        return self.fetch(
+            "daily",
+            DAILY_DATA_QUERY,
+            (from_date, to_date),
+            [
+                ("year", "int64"),
+                ("date", "object"),
+                ("tickersymbol", "object"),
+                ("close", "float64"),
+            ],
+        )
 
     def get_index_data(
         self,
@@ -102,14 +211,12 @@ class DataService:
         Returns:
             pd.DataFrame: _description_
         """
-        cursor = self.connection.cursor()
-        cursor.execute(INDEX_QUERY, (from_date, to_date))
-
-        queries = list(cursor)
-        cursor.close()
-
-        columns = ["date", "open", "close"]
-        return pd.DataFrame(queries, columns=columns)
+        return self.fetch(
+            "index",
+            INDEX_QUERY,
+            (from_date, to_date),
+            [("date", "object"), ("open", "float64"), ("close", "float64")],
+        )
 
 
 data_service = DataService()
@@ -2,25 +2,58 @@
 Out-sample evaluation module
 """
 
+import argparse
 import numpy as np
 import pandas as pd
 from decimal import Decimal
-from config.config import BEST_CONFIG
-from metrics.metric import get_returns
+from config import config
+from metrics.bootstrap import bootstrap, format_bootstrap
+from metrics.metric import get_returns, resample_returns, summarize_returns
 from backtesting import create_bt_instance
+from report import IMAGE_FORMATS, render_many
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="result/profile",
+        help="time the backtest phases and dump the trace to this folder",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        type=int,
+        nargs="?",
+        const=10000,
+        help="bootstrap confidence intervals of the ratios with this many resamples",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes of the bootstrap and the charts",
+    )
+    parser.add_argument(
+        "--chart-format", choices=IMAGE_FORMATS, default="svg", help="report charts"
+    )
+    args = parser.parse_args()
+
     bt, grouped_data, rebalancing_dates = create_bt_instance(
         process_data=True, is_data=False
     )
+    if args.profile:
+        profiler = bt.enable_profiling()
 
     sr = bt.run(
         processed_data=grouped_data,
         execution_dates=rebalancing_dates,
-        pe=BEST_CONFIG["pe"],
-        dy=BEST_CONFIG["dy"],
+        pe=config.BEST_CONFIG["pe"],
+        dy=config.BEST_CONFIG["dy"],
     )
+    if args.profile:
+        print(profiler.summary())
+        profiler.export(args.profile, "evaluation")
 
     print(f"Sharpe ratio {sr}")
     print(f"Information ratio {bt.metric.information_ratio() * Decimal(np.sqrt(250))}")
@@ -29,6 +62,19 @@ if __name__ == "__main__":
     )
     mdd, dds = bt.metric.maximum_drawdown()
     print(f"MDD {mdd}")
+    if args.bootstrap:
+        # The best config was picked among the optimization trials
+        print(
+            format_bootstrap(
+                bootstrap(
+                    bt.period_returns,
+                    bt.vnindex_data["return"].to_list(),
+                    n_resamples=args.bootstrap,
+                    n_trials=config.OPTIMIZATION_CONFIG["no_trials"],
+                    workers=args.workers,
+                )
+            )
+        )
 
     monthly_df = pd.DataFrame(bt.monthly_tracking, columns=["date", "asset"])
     monthly_df_index = bt.vnindex_data[
@@ -41,6 +87,22 @@ if __name__ == "__main__":
     print(f"Monthly return {returns['monthly_return']}")
     print(f"Excess monthly return {returns['excess_monthly_return']}")
     print(f"Annual return {returns['annual_return']}")
+    print(
+        summarize_returns(
+            resample_returns(
+                bt.tracking_dates,
+                bt.period_returns,
+                bt.vnindex_data["return"].to_list(),
+            )
+        )
+        .drop(columns="run")
+        .to_string(index=False)
+    )
 
-    bt.plot_hpr(path="result/optimization/hpr.svg")
-    bt.plot_drawdown(path="result/optimization/drawdown.svg")
+    render_many(
+        [
+            (bt.hpr_chart(), f"result/optimization/hpr.{args.chart_format}"),
+            (bt.drawdown_chart(), f"result/optimization/drawdown.{args.chart_format}"),
+        ],
+        workers=args.workers,
+    )
@@ -0,0 +1,329 @@
+"""
+Factor registry: vectorized factors over the market panel, cached on disk per factor
+
+A factor is a function of the MarketPanel returning a date x ticker array, where
+row t only uses information known before the open of date t (previous close, last
+yearly financials). It is cached under a key made of its definition (source code
+and parameters) and the fingerprint of the dataset, so that editing or adding a
+factor only computes that factor, without reloading the data.
+"""
+
+import os
+import json
+import glob
+import inspect
+import hashlib
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from panel import MarketPanel
+
+
+class Factor:
+    """
+    Registered factor definition
+    """
+
+    def __init__(self, name: str, function: Callable, params: Dict):
+        """
+        Args:
+            name (str)
+            function (Callable): (panel, **params) -> date x ticker array
+            params (Dict): keyword parameters of the function
+        """
+        self.name = name
+        self.function = function
+        self.params = params
+
+    def definition(self) -> Dict:
+        """
+        Get the definition the cache is keyed on
+
+        Returns:
+            Dict
+        """
+        return {
+            "name": self.name,
+            "source": inspect.getsource(self.function),
+            "params": self.params,
+        }
+
+    def compute(self, panel: MarketPanel) -> np.ndarray:
+        """
+        Compute the factor on the panel
+
+        Args:
+            panel (MarketPanel)
+
+        Returns:
+            np.ndarray: date x ticker float array, NaN where undefined
+        """
+        return np.asarray(self.function(panel, **self.params), dtype=float)
+
+
+FACTORS: Dict[str, Factor] = {}
+
+
+def register(name: str, **params) -> Callable:
+    """
+    Register a factor function, e.g.
+
+        @register("momentum", window=126, skip=21)
+        def momentum(panel, window, skip): ...
+
+    Args:
+        name (str): factor name used by the filters and the ranking
+        **params: default parameters, part of the cache key
+
+    Returns:
+        Callable: decorator
+    """
+
+    def decorator(function: Callable) -> Callable:
+        FACTORS[name] = Factor(name, function, params)
+        return function
+
+    return decorator
+
+
+@register("pe")
+def price_earning(panel: MarketPanel) -> np.ndarray:
+    """
+    P/E on the previous close, as computed by Backtesting.compute_ratios
+
+    Args:
+        panel (MarketPanel)
+
+    Returns:
+        np.ndarray
+    """
+    return panel.pe
+
+
+@register("dy")
+def dividend_yield(panel: MarketPanel) -> np.ndarray:
+    """
+    D/Y on the previous close, as computed by Backtesting.compute_ratios
+
+    Args:
+        panel (MarketPanel)
+
+    Returns:
+        np.ndarray
+    """
+    return panel.dy
+
+
+@register("pb")
+def price_book(panel: MarketPanel) -> np.ndarray:
+    """
+    P/B on the previous close, needs a bvps column in the dataset: add the equity
+    code to Backtesting.code and {"bvps": <code>} to Backtesting.per_share_codes
+
+    Args:
+        panel (MarketPanel)
+
+    Returns:
+        np.ndarray
+    """
+    return panel.prev_close * 1000 / panel.column("bvps")
+
+
+@register("momentum", window=126, skip=21)
+def momentum(panel: MarketPanel, window: int, skip: int) -> np.ndarray:
+    """
+    Return over window trading days, skipping the last skip days (short term
+    reversal), on the forward-filled previous close
+
+    Args:
+        panel (MarketPanel)
+        window (int)
+        skip (int)
+
+    Returns:
+        np.ndarray
+    """
+    prev_close = pd.DataFrame(panel.ffill_close).shift(1)
+    return (prev_close.shift(skip) / prev_close.shift(window) - 1).to_numpy()
+
+
+@register("volatility", window=60)
+def volatility(panel: MarketPanel, window: int) -> np.ndarray:
+    """
+    Annualized standard deviation of the daily log returns over window trading
+    days, up to the previous close
+
+    Args:
+        panel (MarketPanel)
+        window (int)
+
+    Returns:
+        np.ndarray
+    """
+    prev_close = pd.DataFrame(panel.ffill_close).shift(1)
+    log_returns = np.log(prev_close / prev_close.shift(1))
+    return (log_returns.rolling(window).std() * np.sqrt(250)).to_numpy()
+
+
+class FactorEngine:
+    """
+    Compute registered factors on one panel, memoized in memory and on disk
+    """
+
+    def __init__(
+        self,
+        panel: MarketPanel,
+        directory: Optional[str] = None,
+        fingerprint: Optional[Dict] = None,
+    ):
+        """
+        Args:
+            panel (MarketPanel)
+            directory (str, optional): disk cache folder, no disk cache if None.
+                Defaults to None.
+            fingerprint (Dict, optional): dataset fingerprint, part of the cache
+                key. Defaults to None.
+        """
+        self.panel = panel
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.values: Dict[str, np.ndarray] = {}
+
+    def cache_path(self, factor: Factor) -> str:
+        """
+        Get the cache file of a factor, keyed by its definition and the dataset
+
+        Args:
+            factor (Factor)
+
+        Returns:
+            str
+        """
+        key = hashlib.sha1(
+            json.dumps(
+                {"factor": factor.definition(), "data": self.fingerprint},
+                sort_keys=True,
+                default=str,
+            ).encode()
+        ).hexdigest()[:16]
+        return os.path.join(self.directory, f"{factor.name}-{key}.npy")
+
+    def get(self, name: str) -> np.ndarray:
+        """
+        Get a factor, computed only if neither in memory nor in the disk cache
+
+        Args:
+            name (str): registered factor name
+
+        Returns:
+            np.ndarray: date x ticker array aligned with the panel
+        """
+        if name in self.values:
+            return self.values[name]
+        if name not in FACTORS:
+            raise KeyError(f"Unknown factor {name}, registered: {list(FACTORS)}")
+
+        factor = FACTORS[name]
+        path = self.cache_path(factor) if self.directory is not None else None
+        if path is not None and os.path.exists(path):
+            # Memory-mapped, worker processes share the pages of the cache file
+            values = np.load(path, mmap_mode="r", allow_pickle=False)
+        else:
+            values = factor.compute(self.panel)
+            if path is not None:
+                self.write(path, factor.name, values)
+
+        self.values[name] = values
+        return values
+
+    def write(self, path: str, name: str, values: np.ndarray):
+        """
+        Write a factor to the disk cache, replacing its stale versions
+
+        Args:
+            path (str)
+            name (str)
+            values (np.ndarray)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(self.directory, f"{name}-*.npy")):
+            os.remove(stale)
+
+        # np.save appends .npy to a name without it
+        tmp_path = path[: -len(".npy")] + ".tmp.npy"
+        np.save(tmp_path, values, allow_pickle=False)
+        os.replace(tmp_path, path)
+
+    def select(
+        self,
+        row: int,
+        columns: np.ndarray,
+        filters: Dict[str, List[float]],
+        rank: Optional[Dict] = None,
+        is_selected: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Select tickers of one date on any combination of factor bounds, then keep
+        the top ranked ones
+
+        Args:
+            row (int): panel row of the date
+            columns (np.ndarray): panel columns of the candidate tickers
+            filters (Dict[str, List[float]]): factor name -> [low, high], inclusive
+            rank (Dict, optional): {"factor": name, "top": n, "ascending": bool},
+                ascending defaults to False (highest first). Defaults to None.
+            is_selected (np.ndarray, optional): candidates, e.g. qualified on pe and
+                dy. Defaults to every column.
+
+        Returns:
+            np.ndarray: bool mask over columns
+        """
+        is_selected = (
+            np.ones(len(columns), dtype=bool)
+            if is_selected is None
+            else is_selected.copy()
+        )
+        for name, (low, high) in filters.items():
+            values = self.get(name)[row, columns]
+            is_selected &= (values >= low) & (values <= high)
+
+        if rank is not None:
+            values = self.get(rank["factor"])[row, columns]
+            candidates = np.flatnonzero(is_selected & ~np.isnan(values))
+            sign = 1 if rank.get("ascending", False) else -1
+            order = np.argsort(sign * values[candidates], kind="stable")
+            is_selected = np.zeros(len(columns), dtype=bool)
+            is_selected[candidates[order[: rank["top"]]]] = True
+
+        return is_selected
+
+
+class FactorWindow(FactorEngine):
+    """
+    Factors of a range of dates, sliced from the factors of the whole history so
+    that look back windows (momentum, volatility) are not cut
+    """
+
+    def __init__(self, engine: FactorEngine, rows: slice, panel: MarketPanel):
+        """
+        Args:
+            engine (FactorEngine): factors of the whole history
+            rows (slice): date rows of the window
+            panel (MarketPanel): panel of the window
+        """
+        super().__init__(panel)
+        self.engine = engine
+        self.rows = rows
+
+    def get(self, name: str) -> np.ndarray:
+        """
+        Get a factor of the window
+
+        Args:
+            name (str): registered factor name
+
+        Returns:
+            np.ndarray: date x ticker array aligned with the window panel
+        """
+        return self.engine.get(name)[self.rows]
@@ -3,8 +3,18 @@ Financial module for loading financial data
 """
 
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
+OWNER_CAPITAL = 4110
+PAR_VALUE = 10000
+
+# Per share factors: factor name -> financial code divided by the outstanding share
+PER_SHARE_CODES = {
+    "eps": 72,  # NET_PROFIT_AFTER_TAX_ATTRIBUTE_TO_SHAREHOLDER
+    "dps": 308,  # DIVIDENDS_PAID
+}
+
 
 class Financial:
     """
@@ -22,6 +32,31 @@ class Financial:
         self.from_date = from_date
         self.to_date = to_date
         self.data = data
+        self.pivoted: Dict[Tuple[int, ...], pd.DataFrame] = {}
+
+    def pivot(self, codes: List[int]) -> pd.DataFrame:
+        """
+        Pivot the financial data of the codes once to one row per year and ticker and
+        one column per code, the last value is kept for a code reported twice
+
+        Args:
+            codes (List[int])
+
+        Returns:
+            pd.DataFrame
+        """
+        key = tuple(codes)
+        if key not in self.pivoted:
+            data = self.data[self.data["code"].isin(codes)].drop_duplicates(
+                ["year", "tickersymbol", "code"], keep="last"
+            )
+            self.pivoted[key] = (
+                data.set_index(["year", "tickersymbol", "code"])["value"]
+                .unstack("code")
+                .reindex(columns=list(codes))
+                .sort_index()
+            )
+        return self.pivoted[key]
 
     def total_share(self) -> pd.DataFrame:
         """
@@ -30,16 +65,51 @@ class Financial:
         Returns:
             pd.DataFrame
         """
-        owner_capital = (
-            self.data[self.data["code"] == 4110].copy().drop(columns=["code"])
+        owner_capital = self.data[self.data["code"] == OWNER_CAPITAL]
+        return owner_capital[["year", "tickersymbol"]].assign(
+            outstanding_share=owner_capital["value"] / PAR_VALUE
         )
 
-        outstanding_share = owner_capital.copy()
-        outstanding_share["value"] = outstanding_share["value"].copy() / 10000
-        outstanding_share = outstanding_share.rename(
-            columns={"value": "outstanding_share"}
+    def per_share(self, codes: Optional[Dict[str, int]] = None) -> pd.DataFrame:
+        """
+        Get per share factors in one pass: each code divided by the outstanding
+        share, missing factors are 0 where the ticker has another factor that year
+
+        Args:
+            codes (Dict[str, int], optional): factor name -> code. Defaults to
+                PER_SHARE_CODES.
+
+        Returns:
+            pd.DataFrame: year, tickersymbol and one column per factor
+        """
+        codes = PER_SHARE_CODES if codes is None else codes
+        pivoted = self.pivot([OWNER_CAPITAL, *codes.values()])
+
+        factors = pivoted[list(codes.values())].div(
+            pivoted[OWNER_CAPITAL] / PAR_VALUE, axis=0
         )
-        return outstanding_share.copy()
+        factors.columns = list(codes)
+        return (
+            factors.dropna(how="all")
+            .fillna(0)
+            .reset_index()
+            .astype({name: float for name in codes})
+        )
+
+    def factor(self, name: str, code: int) -> pd.DataFrame:
+        """
+        Get one per share factor, where both the code and the owner capital exist
+
+        Args:
+            name (str)
+            code (int)
+
+        Returns:
+            pd.DataFrame: year, tickersymbol, name
+        """
+        pivoted = self.pivot([OWNER_CAPITAL, code])
+        factor = (pivoted[code] / (pivoted[OWNER_CAPITAL] / PAR_VALUE)).dropna()
+        return factor.rename(name).reset_index().astype({name: float})
 
     def eps(self) -> pd.DataFrame:
         """
@@ -48,19 +118,7 @@ class Financial:
         Returns:
             pd.DataFrame
         """
-        earning = (
-            self.data[self.data["code"] == 72]
-            .copy()
-            .rename(columns={"value": "earning"})
-            .drop(columns=["code"])
-        )
-
-        eps = pd.merge(
-            earning, self.total_share(), on=["year", "tickersymbol"]
-        ).sort_values(by=["year", "tickersymbol"])
-        eps["eps"] = eps["earning"].copy() / eps["outstanding_share"].copy()
-        eps = eps[["year", "tickersymbol", "eps"]].dropna()
-        return eps.astype({"eps": float})
+        return self.factor("eps", PER_SHARE_CODES["eps"])
 
     def dps(self) -> pd.DataFrame:
         """
@@ -69,14 +127,4 @@ class Financial:
         Returns:
             pd.DataFrame
         """
-        dividends_paid = (
-            self.data[self.data["code"] == 308]
-            .copy()
-            .rename(columns={"value": "dividends_paid"})
-            .drop(columns=["code"])
-        )
-
-        dps = pd.merge(dividends_paid, self.total_share(), on=["year", "tickersymbol"])
-        dps["dps"] = dps["dividends_paid"].copy() / dps["outstanding_share"].copy()
-        dps = dps[["year", "tickersymbol", "dps"]].dropna()
-        return dps.astype({"dps": float})
+        return self.factor("dps", PER_SHARE_CODES["dps"])
@@ -0,0 +1,273 @@
+"""
+Trade journal: trades, positions, cash and suspensions of a run in typed tables
+
+Each table has an explicit structured dtype and keeps one contiguous NumPy array
+per field, preallocated and doubled when full, so appends are amortized O(1), the
+memory of a run is a few bytes per record, and every column is handed to Arrow
+without a copy when exported to Parquet or Feather. Tickers are stored as panel
+columns and exported as a dictionary of the panel tickers, or as categories of the
+data frames when pyarrow is not installed.
+"""
+
+import os
+from datetime import date
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+TRADE_DTYPE = np.dtype(
+    [
+        ("date", "datetime64[D]"),
+        ("ticker", np.int32),
+        ("side", np.int8),  # 1 buy, -1 sell
+        ("qty", np.int64),
+        ("price", np.float64),
+        ("value", np.float64),
+        ("fee", np.float64),
+    ]
+)
+POSITION_DTYPE = np.dtype(
+    [
+        ("date", "datetime64[D]"),
+        ("ticker", np.int32),
+        ("qty", np.int64),
+        ("price", np.float64),
+    ]
+)
+CASH_DTYPE = np.dtype(
+    [
+        ("date", "datetime64[D]"),
+        ("cash", np.float64),
+        ("holding_capital", np.float64),
+    ]
+)
+SUSPENSION_DTYPE = np.dtype(
+    [
+        ("date", "datetime64[D]"),
+        ("ticker", np.int32),
+        ("price", np.float64),
+    ]
+)
+FILE_FORMATS = ["parquet", "feather", "csv"]
+
+
+class RecordTable:
+    """
+    Growable columnar table with the fields of a structured dtype
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int = 1024):
+        """
+        Args:
+            dtype (np.dtype): structured dtype, one column per field
+            capacity (int, optional): preallocated records. Defaults to 1024.
+        """
+        self.dtype = np.dtype(dtype)
+        self.size = 0
+        self.data = {
+            name: np.empty(capacity, dtype=self.dtype[name])
+            for name in self.dtype.names
+        }
+
+    def __len__(self) -> int:
+        return self.size
+
+    def reserve(self, n: int):
+        """
+        Make room for n more records, at least doubling the capacity when full
+
+        Args:
+            n (int)
+        """
+        capacity = len(self.data[self.dtype.names[0]])
+        if self.size + n <= capacity:
+            return
+
+        capacity = max(2 * capacity, self.size + n)
+        for name, values in self.data.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[: self.size] = values[: self.size]
+            self.data[name] = grown
+
+    def append(self, *values):
+        """
+        Append one record, values in the order of the dtype fields
+        """
+        self.reserve(1)
+        for name, value in zip(self.dtype.names, values):
+            self.data[name][self.size] = value
+        self.size += 1
+
+    def extend(self, **columns):
+        """
+        Append many records, one array per field, scalars are broadcast
+        """
+        n = max(
+            (len(values) for values in columns.values() if np.ndim(values)), default=1
+        )
+        self.reserve(n)
+        for name in self.dtype.names:
+            self.data[name][self.size : self.size + n] = columns[name]
+        self.size += n
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Get the filled part of every column, without copy
+
+        Returns:
+            Dict[str, np.ndarray]
+        """
+        return {name: values[: self.size] for name, values in self.data.items()}
+
+    def to_records(self) -> np.ndarray:
+        """
+        Get the table as one structured array
+
+        Returns:
+            np.ndarray
+        """
+        records = np.empty(self.size, dtype=self.dtype)
+        for name, values in self.columns().items():
+            records[name] = values
+        return records
+
+
+class Journal:
+    """
+    Trades, positions after each rebalancing, cash and suspended price fallbacks
+    """
+
+    def __init__(self, tickers: np.ndarray, capacity: int = 1024):
+        """
+        Args:
+            tickers (np.ndarray): panel tickers, the ticker fields are their indices
+            capacity (int, optional): preallocated records per table. Defaults
+                to 1024.
+        """
+        self.tickers = tickers
+        self.trades = RecordTable(TRADE_DTYPE, capacity)
+        self.positions = RecordTable(POSITION_DTYPE, capacity)
+        self.cash = RecordTable(CASH_DTYPE, capacity)
+        self.suspensions = RecordTable(SUSPENSION_DTYPE, capacity)
+
+    def tables(self) -> Dict[str, RecordTable]:
+        """
+        Get the tables by name
+
+        Returns:
+            Dict[str, RecordTable]
+        """
+        return {
+            "trades": self.trades,
+            "positions": self.positions,
+            "cash": self.cash,
+            "suspensions": self.suspensions,
+        }
+
+    def record_trades(
+        self,
+        day: date,
+        columns: np.ndarray,
+        side: int,
+        qty: np.ndarray,
+        price: np.ndarray,
+        fee: float,
+    ):
+        """
+        Record the orders of one side of a rebalancing
+
+        Args:
+            day (date)
+            columns (np.ndarray): panel columns of the traded tickers
+            side (int): 1 buy, -1 sell
+            qty (np.ndarray): positive quantities
+            price (np.ndarray)
+            fee (float): fee rate charged on the value
+        """
+        value = qty * price
+        self.trades.extend(
+            date=np.datetime64(day, "D"),
+            ticker=columns,
+            side=side,
+            qty=qty,
+            price=price,
+            value=value,
+            fee=value * fee,
+        )
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """
+        Get a table as a data frame, tickers as categories of the panel tickers
+
+        Args:
+            name (str): trades, positions, cash or suspensions
+
+        Returns:
+            pd.DataFrame
+        """
+        columns = self.tables()[name].columns()
+        if "ticker" in columns:
+            columns["ticker"] = pd.Categorical.from_codes(
+                columns["ticker"], categories=self.tickers.tolist()
+            )
+        return pd.DataFrame(columns)
+
+    def to_arrow(self, name: str) -> "pyarrow.Table":
+        """
+        Get a table as an Arrow table sharing the NumPy columns, tickers as a
+        dictionary of the panel tickers
+
+        Args:
+            name (str): trades, positions, cash or suspensions
+
+        Returns:
+            pyarrow.Table
+        """
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        arrays = {}
+        for field, values in self.tables()[name].columns().items():
+            arrays[field] = (
+                pa.DictionaryArray.from_arrays(values, self.tickers.tolist())
+                if field == "ticker"
+                else pa.array(values)
+            )
+        return pa.table(arrays)
+
+    def export(self, directory: str, file_format: str = "parquet"):
+        """
+        Write every table to directory as <name>.parquet, <name>.feather or
+        <name>.csv
+
+        Parquet and Feather are written from to_arrow with pyarrow. Without pyarrow,
+        the data frames of frame are written by pandas, Parquet with another engine
+        such as fastparquet. CSV is always written by pandas.
+
+        Args:
+            directory (str)
+            file_format (str, optional): "parquet", "feather" or "csv". Defaults to
+                "parquet".
+        """
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unknown file format {file_format}, use {FILE_FORMATS}")
+
+        # pylint: disable=import-outside-toplevel
+        write_table = None
+        if file_format != "csv":
+            try:
+                if file_format == "parquet":
+                    from pyarrow.parquet import write_table
+                else:
+                    from pyarrow.feather import write_feather as write_table
+            except ImportError:
+                pass
+
+        os.makedirs(directory, exist_ok=True)
+        for name in self.tables():
+            path = os.path.join(directory, f"{name}.{file_format}")
+            if write_table is not None:
+                write_table(self.to_arrow(name), path)
+            elif file_format == "csv":
+                self.frame(name).to_csv(path, index=False)
+            else:
+                getattr(self.frame(name), f"to_{file_format}")(path)
@@ -0,0 +1,210 @@
+"""
+Fixed-point ledger: exact int64 accounting of one portfolio
+
+Prices are quoted in thousand VND with at most 3 decimals, so every amount is kept
+as an int64 number of minor units (price * PRICE_SCALE * quantity) and every
+quantity as an int64 number of shares in round lots. Fees are rational rates
+rounded half up to the minor unit. The accounting is exact and independent of the
+order of the stocks; only the returns and the metrics are float64.
+"""
+
+from decimal import Decimal
+from typing import Dict, List, Tuple
+import numpy as np
+
+from utils import round_lots
+
+# Minor units per price unit
+PRICE_SCALE = 1000
+
+
+def to_minor(prices: np.ndarray) -> np.ndarray:
+    """
+    Convert prices to int64 minor units, NaN (no price) to 0
+
+    Args:
+        prices (np.ndarray): float prices
+
+    Returns:
+        np.ndarray
+    """
+    return np.rint(np.nan_to_num(np.asarray(prices, dtype=float)) * PRICE_SCALE).astype(
+        np.int64
+    )
+
+
+def apply_rate(amounts: np.ndarray, rate: Tuple[int, int]) -> np.ndarray:
+    """
+    Multiply amounts by a rational rate, rounded half up to the minor unit
+
+    Args:
+        amounts (np.ndarray): int64 minor units
+        rate (Tuple[int, int]): numerator, denominator, e.g. a fee
+
+    Returns:
+        np.ndarray: int64 minor units
+    """
+    numerator, denominator = rate
+    return (amounts * numerator + denominator // 2) // denominator
+
+
+class FixedPointLedger:
+    """
+    Cash, holdings and asset history of one portfolio over the panel tickers
+
+    Follows the rules of Backtesting.rebalancing and daily_update_segment, including
+    their quirks, so that it can be compared with the Decimal ledger.
+    """
+
+    def __init__(
+        self, capital: Decimal, buy_fee: Decimal, sell_fee: Decimal, n_tickers: int
+    ):
+        """
+        Args:
+            capital (Decimal): in price units
+            buy_fee (Decimal)
+            sell_fee (Decimal)
+            n_tickers (int): panel tickers
+        """
+        self.capital = int(Decimal(capital) * PRICE_SCALE)
+        self.cash = self.capital
+        self.buy_fee = Decimal(buy_fee).as_integer_ratio()
+        self.sell_fee = Decimal(sell_fee).as_integer_ratio()
+        self.qty = np.zeros(n_tickers, dtype=np.int64)
+        self.old_price = np.zeros(n_tickers, dtype=np.int64)
+        self.assets: List[int] = [self.capital]
+
+    def rebalance(
+        self,
+        columns: np.ndarray,
+        close: np.ndarray,
+        prev_close: np.ndarray,
+        is_qualified: np.ndarray,
+    ) -> int:
+        """
+        Sell then buy the quoted stocks of one date, as Backtesting.rebalancing
+
+        Held stocks that are not quoted on the date are neither valued nor traded.
+
+        Args:
+            columns (np.ndarray): panel columns of the quoted tickers
+            close (np.ndarray): float close, aligned with columns
+            prev_close (np.ndarray): float previous close, aligned with columns
+            is_qualified (np.ndarray): selected stocks, aligned with columns
+
+        Returns:
+            int: asset at the end of the date, in minor units
+        """
+        close_minor = to_minor(close)
+        prev_close_minor = to_minor(prev_close)
+        held_qty = self.qty[columns]
+        is_held = held_qty > 0
+
+        total_asset = self.cash + int(prev_close_minor @ held_qty)
+        target_qty = np.zeros(len(columns), dtype=np.int64)
+        target_qty[is_qualified] = round_lots(
+            total_asset / PRICE_SCALE / (is_qualified.sum() * prev_close[is_qualified])
+        )
+
+        # Sell phase
+        required_qty = target_qty - held_qty
+        is_selling = is_held & (required_qty <= 0)
+        sold = np.where(is_selling, prev_close_minor * -required_qty, 0)
+        cash = self.cash + int((sold - apply_rate(sold, self.sell_fee)).sum())
+        remaining_qty = np.where(is_selling, target_qty, held_qty)
+        stock_asset = int(close_minor[is_held] @ remaining_qty[is_held])
+
+        # Buy phase, the cash is charged the sell fee as in Backtesting.rebalancing
+        order_qty = np.where(is_held, required_qty, target_qty)
+        is_target = is_qualified & ~is_selling
+        is_buying = np.zeros(len(columns), dtype=bool)
+        with np.errstate(divide="ignore"):
+            is_buying[is_target] = (
+                round_lots(
+                    cash
+                    / PRICE_SCALE
+                    / (
+                        is_target.sum()
+                        * prev_close[is_target]
+                        * (1 + self.buy_fee[0] / self.buy_fee[1])
+                    )
+                )
+                > 0
+            )
+        bought = np.where(is_buying, prev_close_minor * order_qty, 0)
+        cash -= int((bought + apply_rate(bought, self.sell_fee)).sum())
+        stock_asset += int(close_minor[is_buying] @ order_qty[is_buying])
+
+        self.qty[columns] = np.where(
+            is_buying, remaining_qty + order_qty, remaining_qty
+        )
+        self.old_price[columns[is_buying]] = close_minor[is_buying]
+        self.cash = cash
+        self.assets.append(stock_asset + cash)
+        return self.assets[-1]
+
+    def mark(
+        self, columns: np.ndarray, ffill_close: np.ndarray, is_quoted: np.ndarray
+    ) -> np.ndarray:
+        """
+        Value the holdings over dates without trades, as daily_update_segment: a
+        stock not quoted yet is valued at its old price
+
+        Args:
+            columns (np.ndarray): panel columns of the held tickers
+            ffill_close (np.ndarray): dates x columns forward-filled close
+            is_quoted (np.ndarray): dates x columns, quoted since the first date
+
+        Returns:
+            np.ndarray: int64 asset per date, in minor units
+        """
+        prices = np.where(is_quoted, to_minor(ffill_close), self.old_price[columns])
+        assets = self.cash + prices @ self.qty[columns]
+        if len(columns):
+            self.old_price[columns] = prices[-1]
+        self.assets += assets.tolist()
+        return assets
+
+    def holdings(self) -> np.ndarray:
+        """
+        Get the panel columns of the held tickers
+
+        Returns:
+            np.ndarray
+        """
+        return np.flatnonzero(self.qty)
+
+    def period_returns(self) -> np.ndarray:
+        """
+        Get the float64 return of every date
+
+        Returns:
+            np.ndarray
+        """
+        assets = np.array(self.assets, dtype=np.int64)
+        return assets[1:] / assets[:-1] - 1
+
+
+def compare(assets: List[Decimal], ledger: FixedPointLedger) -> Dict:
+    """
+    Compare the Decimal ledger of a run with the fixed-point ledger of the same run
+
+    Args:
+        assets (List[Decimal]): Backtesting.assets, in price units
+        ledger (FixedPointLedger)
+
+    Returns:
+        Dict: max absolute asset difference in minor units, max relative asset
+        difference and max absolute return difference
+    """
+    reference = np.array([float(asset) * PRICE_SCALE for asset in assets])
+    fixed = np.array(ledger.assets, dtype=float)
+    reference_returns = reference[1:] / reference[:-1] - 1
+    return {
+        "dates": len(fixed) - 1,
+        "max_asset_difference": np.abs(fixed - reference).max(),
+        "max_relative_difference": (np.abs(fixed - reference) / reference).max(),
+        "max_return_difference": np.abs(
+            ledger.period_returns() - reference_returns
+        ).max(),
+    }
@@ -0,0 +1,290 @@
+"""
+Bootstrap significance of the sharpe, sortino and information ratios
+
+Every resample of the daily returns is a row of one index matrix, the ratios of
+all resamples are computed at once in NumPy on float64 copies of the returns.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from statistics import NormalDist
+from typing import Dict, List, Optional
+import numpy as np
+
+from metrics.metric import BatchMetric
+
+EULER_GAMMA = 0.5772156649015329
+
+
+def bootstrap_indices(
+    n_periods: int,
+    n_resamples: int,
+    block_size: float,
+    rng: np.random.Generator,
+    method: str = "stationary",
+) -> np.ndarray:
+    """
+    Draw the resample index matrix of a block bootstrap, blocks wrap around
+
+    Args:
+        n_periods (int): length of the return series
+        n_resamples (int)
+        block_size (float): mean block length (stationary) or block length
+            (circular), ~ the autocorrelation horizon
+        rng (np.random.Generator)
+        method (str, optional): "stationary" (Politis-Romano, geometric block
+            lengths) or "circular" (fixed block lengths). Defaults to "stationary".
+
+    Returns:
+        np.ndarray: n_resamples x n_periods indices
+    """
+    positions = np.arange(n_periods)
+    if method == "stationary":
+        is_block_start = rng.random((n_resamples, n_periods)) < 1 / block_size
+        is_block_start[:, 0] = True
+    elif method == "circular":
+        is_block_start = np.broadcast_to(
+            positions % int(block_size) == 0, (n_resamples, n_periods)
+        )
+    else:
+        raise ValueError(f"Unknown bootstrap method {method}")
+
+    # Position of the current block start, then offset from the block random origin
+    block_start = np.maximum.accumulate(np.where(is_block_start, positions, 0), axis=1)
+    origins = rng.integers(0, n_periods, (n_resamples, n_periods))
+    origin = np.take_along_axis(origins, block_start, axis=1)
+    return (origin + positions - block_start) % n_periods
+
+
+def resampled_ratios(
+    returns: np.ndarray,
+    benchmark_returns: np.ndarray,
+    indices: np.ndarray,
+    risk_free_return: float,
+) -> Dict[str, np.ndarray]:
+    """
+    Per-period ratios of every resample, see BatchMetric
+
+    Args:
+        returns (np.ndarray)
+        benchmark_returns (np.ndarray): aligned with returns
+        indices (np.ndarray): resamples x periods
+        risk_free_return (float)
+
+    Returns:
+        Dict[str, np.ndarray]: sharpe_ratio, sortino_ratio, information_ratio, one
+        value per resample
+    """
+    metric = BatchMetric(returns[indices], benchmark_returns[indices])
+    return {
+        "sharpe_ratio": metric.sharpe_ratio(risk_free_return),
+        "sortino_ratio": metric.sortino_ratio(risk_free_return),
+        "information_ratio": metric.information_ratio(),
+    }
+
+
+def bootstrap_chunk(
+    returns: np.ndarray,
+    benchmark_returns: np.ndarray,
+    n_resamples: int,
+    block_size: float,
+    method: str,
+    risk_free_return: float,
+    seed: np.random.SeedSequence,
+) -> Dict[str, np.ndarray]:
+    """
+    Resample and compute the ratios of one chunk, run in a worker process
+
+    Args:
+        returns (np.ndarray)
+        benchmark_returns (np.ndarray)
+        n_resamples (int)
+        block_size (float)
+        method (str)
+        risk_free_return (float)
+        seed (np.random.SeedSequence): chunk seed
+
+    Returns:
+        Dict[str, np.ndarray]
+    """
+    indices = bootstrap_indices(
+        len(returns), n_resamples, block_size, np.random.default_rng(seed), method
+    )
+    return resampled_ratios(returns, benchmark_returns, indices, risk_free_return)
+
+
+def expected_max_sharpe(n_trials: int, sharpe_variance: float) -> float:
+    """
+    Expected maximum of n_trials sharpe ratios of zero-skill strategies (False
+    Strategy Theorem, Bailey & Lopez de Prado)
+
+    Args:
+        n_trials (int)
+        sharpe_variance (float): variance of the sharpe ratio across trials
+
+    Returns:
+        float
+    """
+    if n_trials < 2:
+        return 0.0
+
+    normal = NormalDist()
+    return np.sqrt(sharpe_variance) * (
+        (1 - EULER_GAMMA) * normal.inv_cdf(1 - 1 / n_trials)
+        + EULER_GAMMA * normal.inv_cdf(1 - 1 / (n_trials * np.e))
+    )
+
+
+def deflated_sharpe_ratio(
+    returns: np.ndarray, sharpe: float, benchmark_sharpe: float
+) -> float:
+    """
+    Probability that the true per-period sharpe ratio exceeds benchmark_sharpe,
+    accounting for the sample length, skewness and kurtosis of the returns
+
+    Args:
+        returns (np.ndarray)
+        sharpe (float): per-period sharpe ratio
+        benchmark_sharpe (float): e.g. expected_max_sharpe of the trials
+
+    Returns:
+        float
+    """
+    deviations = returns - returns.mean()
+    std = deviations.std()
+    skewness = (deviations**3).mean() / std**3
+    kurtosis = (deviations**4).mean() / std**4
+    variance = 1 - skewness * sharpe + (kurtosis - 1) / 4 * sharpe**2
+    return NormalDist().cdf(
+        (sharpe - benchmark_sharpe) * np.sqrt(len(returns) - 1) / np.sqrt(variance)
+    )
+
+
+def bootstrap(
+    period_returns: List[Decimal],
+    benchmark_returns: List[Decimal],
+    n_resamples: int = 10000,
+    block_size: float = 20,
+    method: str = "stationary",
+    confidence: float = 0.95,
+    risk_free_return: Decimal = Decimal('0.00023'),
+    n_trials: int = 1,
+    trial_sharpe_ratios: Optional[List[float]] = None,
+    annualization: float = np.sqrt(250),
+    seed: int = 2024,
+    chunk_size: int = 2000,
+    workers: int = 1,
+) -> Dict:
+    """
+    Block bootstrap confidence intervals of the sharpe, sortino and information
+    ratios, and deflated sharpe ratio for the number of optimization trials
+
+    The resamples are drawn in chunks of chunk_size from independent seeds, so the
+    result does not depend on the number of workers.
+
+    Args:
+        period_returns (List[Decimal])
+        benchmark_returns (List[Decimal]): aligned with period_returns
+        n_resamples (int, optional): Defaults to 10000.
+        block_size (float, optional): Defaults to 20 (about a month).
+        method (str, optional): "stationary" or "circular". Defaults to "stationary".
+        confidence (float, optional): Defaults to 0.95.
+        risk_free_return (Decimal, optional): Defaults to Decimal('0.00023').
+        n_trials (int, optional): number of parameter sets tried to pick this one,
+            e.g. the optuna trials. Defaults to 1.
+        trial_sharpe_ratios (List[float], optional): per-period sharpe ratios of the
+            trials, their variance is estimated by the bootstrap when missing.
+            Defaults to None.
+        annualization (float, optional): applied to the ratios and intervals.
+            Defaults to np.sqrt(250).
+        seed (int, optional): Defaults to 2024.
+        chunk_size (int, optional): Defaults to 2000.
+        workers (int, optional): processes, 1 runs in process. Defaults to 1.
+
+    Returns:
+        Dict: estimate, low, high and std of each ratio (low, high and std are NaN
+        when less than two resamples have a finite ratio),
+        expected_max_sharpe_ratio and deflated_sharpe_ratio
+    """
+    returns = np.array(period_returns, dtype=float)
+    benchmark = np.array(benchmark_returns, dtype=float)
+    risk_free = float(risk_free_return)
+
+    chunks = [
+        min(chunk_size, n_resamples - start)
+        for start in range(0, n_resamples, chunk_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    arguments = [
+        [returns] * len(chunks),
+        [benchmark] * len(chunks),
+        chunks,
+        [block_size] * len(chunks),
+        [method] * len(chunks),
+        [risk_free] * len(chunks),
+        seeds,
+    ]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(bootstrap_chunk, *arguments))
+    else:
+        results = list(map(bootstrap_chunk, *arguments))
+
+    estimates = resampled_ratios(
+        returns, benchmark, np.arange(len(returns))[None, :], risk_free
+    )
+    alpha = (1 - confidence) / 2
+    summary = {}
+    for name, estimate in estimates.items():
+        values = np.concatenate([result[name] for result in results])
+        # NaN resamples, e.g. information ratios of a series with a -100% day
+        values = values[np.isfinite(values)]
+        low, high, std = (
+            (*np.quantile(values, [alpha, 1 - alpha]), values.std(ddof=1))
+            if len(values) > 1
+            else (np.nan, np.nan, np.nan)
+        )
+        summary[name] = {
+            "estimate": estimate[0] * annualization,
+            "low": low * annualization,
+            "high": high * annualization,
+            "std": std * annualization,
+        }
+
+    sharpe_variance = (
+        np.var(trial_sharpe_ratios, ddof=1)
+        if trial_sharpe_ratios is not None and len(trial_sharpe_ratios) > 1
+        else (summary["sharpe_ratio"]["std"] / annualization) ** 2
+    )
+    max_sharpe = expected_max_sharpe(n_trials, sharpe_variance)
+    summary["expected_max_sharpe_ratio"] = max_sharpe * annualization
+    summary["deflated_sharpe_ratio"] = deflated_sharpe_ratio(
+        returns, estimates["sharpe_ratio"][0], max_sharpe
+    )
+    return summary
+
+
+def format_bootstrap(summary: Dict, confidence: float = 0.95) -> str:
+    """
+    Format the bootstrap summary for printing
+
+    Args:
+        summary (Dict): as returned by bootstrap
+        confidence (float, optional): Defaults to 0.95.
+
+    Returns:
+        str
+    """
+    lines = []
+    for name in ["sharpe_ratio", "sortino_ratio", "information_ratio"]:
+        ratio = summary[name]
+        lines.append(
+            f"{name} {ratio['estimate']:.4f}, {confidence:.0%} CI "
+            f"[{ratio['low']:.4f}, {ratio['high']:.4f}], std {ratio['std']:.4f}"
+        )
+    lines.append(
+        f"Expected max sharpe ratio of the trials "
+        f"{summary['expected_max_sharpe_ratio']:.4f}, deflated sharpe ratio "
+        f"{summary['deflated_sharpe_ratio']:.4f}"
+    )
+    return "\n".join(lines)
@@ -2,18 +2,22 @@
 This module is used for calculating metric
 """
 
-from typing import List
+from typing import Dict, List, Optional, Sequence, Tuple
 from decimal import Decimal
 import numpy as np
 import pandas as pd
 
+# Report frequencies: name -> pandas period alias
+FREQUENCIES = {"weekly": "W", "monthly": "M", "quarterly": "Q", "yearly": "Y"}
+PERIODS_PER_YEAR = {"weekly": 52, "monthly": 12, "quarterly": 4, "yearly": 1}
+
 
 def get_returns(
     monthly_df: pd.DataFrame,
     index_df: pd.DataFrame,
 ):
     """
-    Get multiple period returns
+    Get multiple period returns, the input frames are not modified
 
     Args:
         monthly_df (pd.DataFrame): _description_
@@ -22,17 +26,18 @@ def get_returns(
     Returns:
         _type_: _description_
     """
-    monthly_df["monthly_return"] = monthly_df["asset"].copy().pct_change()
-    index_df["index_monthly_return"] = (
-        index_df["ac_return"]
-        .rolling(2)
-        .apply(lambda x: ((x.iloc[1] + 1) / (x.iloc[0] + 1)) - 1)
-    ).copy()
-    monthly_df = monthly_df.astype({"monthly_return": float})
+    monthly_df = monthly_df.assign(
+        monthly_return=monthly_df["asset"].pct_change()
+    ).astype({"monthly_return": float})
+    index_df = index_df.assign(
+        index_monthly_return=(index_df["ac_return"] + 1)
+        / (index_df["ac_return"].shift(1) + 1)
+        - 1
+    )
     merged_monthly_index = pd.merge(monthly_df, index_df, on=["date"])
     merged_monthly_index["exess_monthly_return"] = (
-        merged_monthly_index["monthly_return"].copy()
-        - merged_monthly_index["index_monthly_return"].copy()
+        merged_monthly_index["monthly_return"]
+        - merged_monthly_index["index_monthly_return"]
     )
 
     annual_return = (
@@ -48,6 +53,100 @@ def get_returns(
     }
 
 
+def resample_returns(
+    dates: Sequence,
+    returns: np.ndarray,
+    benchmark_returns: np.ndarray,
+    frequencies: Optional[Dict[str, str]] = None,
+) -> Dict[str, Dict]:
+    """
+    Resample daily returns of one run or a batch of runs to every frequency in one
+    pass: the wealth curves are cumulative products, read at the last date of each
+    period
+
+    Args:
+        dates (Sequence): sorted dates of the daily returns
+        returns (np.ndarray): dates, or runs x dates, Decimal included
+        benchmark_returns (np.ndarray): dates, e.g. VNINDEX returns
+        frequencies (Dict[str, str], optional): name -> pandas period alias.
+            Defaults to FREQUENCIES.
+
+    Returns:
+        Dict[str, Dict]: per frequency name, the period labels and runs x periods
+        arrays of return, benchmark_return, excess_return, compounded_return and
+        benchmark_compounded_return (since the first date)
+    """
+    frequencies = FREQUENCIES if frequencies is None else frequencies
+    wealth = np.cumprod(1 + np.atleast_2d(np.asarray(returns, dtype=float)), axis=1)
+    benchmark_wealth = np.cumprod(
+        1 + np.asarray(benchmark_returns, dtype=float)[None, :], axis=1
+    )
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+
+    resampled = {}
+    for name, alias in frequencies.items():
+        periods = dates.to_period(alias)
+        codes = periods.asi8
+        is_period_end = np.append(codes[1:] != codes[:-1], True)
+
+        period_wealth = wealth[:, is_period_end]
+        period_benchmark = benchmark_wealth[:, is_period_end]
+        period_return = (
+            period_wealth
+            / np.hstack([np.ones((len(wealth), 1)), period_wealth[:, :-1]])
+            - 1
+        )
+        benchmark_return = (
+            period_benchmark / np.hstack([[[1]], period_benchmark[:, :-1]]) - 1
+        )
+        resampled[name] = {
+            "period": periods[is_period_end],
+            "return": period_return,
+            "benchmark_return": benchmark_return,
+            "excess_return": period_return - benchmark_return,
+            "compounded_return": period_wealth - 1,
+            "benchmark_compounded_return": period_benchmark - 1,
+        }
+
+    return resampled
+
+
+def summarize_returns(resampled: Dict[str, Dict]) -> pd.DataFrame:
+    """
+    Summarize resampled returns: mean period and excess returns, compounded and
+    annualized returns, one row per run and frequency
+
+    Args:
+        resampled (Dict[str, Dict]): as returned by resample_returns
+
+    Returns:
+        pd.DataFrame
+    """
+    frames = []
+    for name, values in resampled.items():
+        n_runs, n_periods = values["return"].shape
+        compounded = values["compounded_return"][:, -1]
+        frames.append(
+            pd.DataFrame(
+                {
+                    "run": np.arange(n_runs),
+                    "frequency": name,
+                    "periods": n_periods,
+                    "mean_return": values["return"].mean(axis=1),
+                    "mean_excess_return": values["excess_return"].mean(axis=1),
+                    "compounded_return": compounded,
+                    "excess_compounded_return": compounded
+                    - values["benchmark_compounded_return"][:, -1],
+                    "annualized_return": (1 + compounded)
+                    ** (PERIODS_PER_YEAR[name] / n_periods)
+                    - 1,
+                }
+            )
+        )
+
+    return pd.concat(frames, ignore_index=True)
+
+
 class Metric:
     """
     Metric: sharpe, sortino, information ratios, MDD
@@ -223,3 +322,306 @@ class Metric:
         )
 
         return (mean_period_returns - mean_benchmark_returns) / excess_returns.std()
+
+
+class BatchMetric:
+    """
+    Metric of many return series at once, e.g. trials, parameter sets or bootstrap
+    resamples: same definitions as Metric on a series x periods float64 array, one
+    value per series, NaN for a series on which Metric raises
+    """
+
+    def __init__(self, period_returns: np.ndarray, benchmark_returns: np.ndarray):
+        """
+        Args:
+            period_returns (np.ndarray): series x periods, or one series
+            benchmark_returns (np.ndarray): periods, or series x periods
+
+        Raises:
+            ValueError: empty or not aligned returns
+        """
+        self.period_returns = np.atleast_2d(np.asarray(period_returns, dtype=float))
+        self.benchmark_returns = np.atleast_2d(
+            np.asarray(benchmark_returns, dtype=float)
+        )
+        if not self.period_returns.size:
+            raise ValueError("Invalid Input")
+        if self.benchmark_returns.shape[1] != self.period_returns.shape[1]:
+            raise ValueError(
+                f"Not equal length {self.period_returns.shape[1]} - "
+                f"{self.benchmark_returns.shape[1]}"
+            )
+
+    def is_invalid(self, benchmark: bool = False) -> np.ndarray:
+        """
+        Flag the series with a return <= -1, where Metric raises ValueError
+
+        Args:
+            benchmark (bool, optional): check the benchmark returns too. Defaults
+                to False.
+
+        Returns:
+            np.ndarray: bool per series
+        """
+        is_invalid = (self.period_returns <= -1).any(axis=1)
+        if benchmark:
+            is_invalid |= (self.benchmark_returns <= -1).any(axis=1)
+        return is_invalid
+
+    def performance(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the cumulative performance and its running peak, starting from 1
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: series x periods performance and peak
+        """
+        performance = np.cumprod(1 + self.period_returns, axis=1)
+        return performance, np.maximum.accumulate(np.maximum(performance, 1), axis=1)
+
+    def hpr(self) -> np.ndarray:
+        return np.cumprod(1 + self.period_returns, axis=1)[:, -1] - 1
+
+    def excess_hpr(self) -> np.ndarray:
+        return (
+            np.cumprod(1 + self.period_returns, axis=1)[:, -1]
+            - np.cumprod(1 + self.benchmark_returns, axis=1)[:, -1]
+        )
+
+    def sharpe_ratio(self, risk_free_return: float) -> np.ndarray:
+        """
+        Calculate sharpe ratios
+
+        Args:
+            risk_free_return (float)
+
+        Returns:
+            np.ndarray: NaN or inf for constant series
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.mean(self.period_returns - risk_free_return, axis=1) / np.std(
+                self.period_returns, axis=1, ddof=1
+            )
+
+    def sortino_ratio(self, risk_free_return: float) -> np.ndarray:
+        """
+        Calculate sortino ratios
+
+        Args:
+            risk_free_return (float)
+
+        Returns:
+            np.ndarray: NaN or inf without downside
+        """
+        downside_returns = np.minimum(0, self.period_returns - risk_free_return)
+        downside_risk = np.sqrt(np.mean(downside_returns**2, axis=1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (
+                np.mean(self.period_returns, axis=1) - risk_free_return
+            ) / downside_risk
+
+    def maximum_drawdown(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Calculate maximum drawdowns from the running peak
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: maximum drawdown per series, series x
+            periods drawdowns, NaN for the invalid series
+        """
+        performance, peak = self.performance()
+        drawdowns = performance / peak - 1
+        is_invalid = self.is_invalid()
+        drawdowns[is_invalid] = np.nan
+        return (
+            np.where(is_invalid, np.nan, np.minimum(drawdowns.min(axis=1), 0)),
+            drawdowns,
+        )
+
+    def longest_drawdown(self) -> np.ndarray:
+        """
+        Calculate longest drawdowns: most periods since the last new peak
+
+        Returns:
+            np.ndarray: periods per series, NaN for the invalid series
+        """
+        performance, peak = self.performance()
+        periods = np.arange(performance.shape[1])
+        previous_peak = np.hstack([np.ones((len(peak), 1)), peak[:, :-1]])
+        is_new_peak = performance > previous_peak
+        last_peak = np.maximum.accumulate(np.where(is_new_peak, periods, -1), axis=1)
+        return np.where(self.is_invalid(), np.nan, (periods - last_peak).max(axis=1))
+
+    def information_ratio(self) -> np.ndarray:
+        """
+        Calculate information ratios, 0 where the means are equal, NaN for the
+        invalid series
+
+        Raises:
+            ValueError: Invalid length
+
+        Returns:
+            np.ndarray
+        """
+        if self.period_returns.shape[1] == 1:
+            raise ValueError("Invalid length")
+
+        mean_period_returns = self.period_returns.mean(axis=1)
+        mean_benchmark_returns = self.benchmark_returns.mean(axis=1)
+        excess_returns = self.period_returns - self.benchmark_returns
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                self.is_invalid(benchmark=True),
+                np.nan,
+                np.where(
+                    mean_period_returns == mean_benchmark_returns,
+                    0.0,
+                    (mean_period_returns - mean_benchmark_returns)
+                    / excess_returns.std(axis=1),
+                ),
+            )
+
+
+class StreamingMetric:
+    """
+    Online metric: O(1) update per period return, every ratio is readable at any
+    point of a run without rescanning the returns
+    """
+
+    def __init__(self, risk_free_return: Decimal = Decimal('0.00023')):
+        """
+        Args:
+            risk_free_return (Decimal, optional): daily risk free return, fixed
+                upfront for the downside moments. Defaults to Decimal('0.00023').
+        """
+        self.risk_free_return = risk_free_return
+        self.count = 0
+
+        # Welford mean / sum of squared deviations of period returns
+        self.mean = Decimal('0')
+        self.m2 = Decimal('0')
+        self.downside_sum = Decimal('0')
+
+        # Running performance, peak and drawdowns
+        self.performance = Decimal('1')
+        self.peak = Decimal('1')
+        self.drawdown = Decimal('0')
+        self.mdd = Decimal('0')
+        self.cur_period = 0
+        self.max_period = 0
+
+        # Tracking error against the benchmark
+        self.benchmark_count = 0
+        self.active_mean = Decimal('0')
+        self.active_m2 = Decimal('0')
+        self.benchmark_performance = Decimal('1')
+
+    def update(self, period_return: Decimal, benchmark_return: Decimal = None):
+        """
+        Add one period return
+
+        Args:
+            period_return (Decimal)
+            benchmark_return (Decimal, optional): benchmark return of the same
+                period. Defaults to None.
+        """
+        self.count += 1
+        delta = period_return - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (period_return - self.mean)
+        self.downside_sum += min(0, period_return - self.risk_free_return) ** 2
+
+        self.performance *= 1 + period_return
+        if self.performance > self.peak:
+            self.peak = self.performance
+            self.cur_period = 0
+        else:
+            self.cur_period += 1
+            self.max_period = max(self.max_period, self.cur_period)
+        self.drawdown = self.performance / self.peak - 1
+        self.mdd = min(self.drawdown, self.mdd)
+
+        if benchmark_return is not None:
+            self.benchmark_count += 1
+            active_return = period_return - benchmark_return
+            delta = active_return - self.active_mean
+            self.active_mean += delta / self.benchmark_count
+            self.active_m2 += delta * (active_return - self.active_mean)
+            self.benchmark_performance *= 1 + benchmark_return
+
+    def hpr(self) -> Decimal:
+        return self.performance - 1
+
+    def excess_hpr(self) -> Decimal:
+        return self.performance - self.benchmark_performance
+
+    def sharpe_ratio(self, risk_free_return: Decimal = None) -> Decimal:
+        """
+        Calculate sharpe ratio
+
+        Args:
+            risk_free_return (Decimal, optional): Defaults to the accumulator one.
+
+        Raises:
+            ValueError: Less than two period returns
+
+        Returns:
+            Decimal
+        """
+        if self.count < 2:
+            raise ValueError('Period returns should have at least two values')
+
+        if risk_free_return is None:
+            risk_free_return = self.risk_free_return
+
+        return (self.mean - risk_free_return) / (self.m2 / (self.count - 1)).sqrt()
+
+    def sortino_ratio(self) -> Decimal:
+        """
+        Calculate sortino ratio with the accumulator risk free return
+
+        Raises:
+            ValueError: None or empty period returns
+
+        Returns:
+            Decimal
+        """
+        if not self.count:
+            raise ValueError('Period returns should not be empty')
+
+        downside_risk = (self.downside_sum / self.count).sqrt()
+        return (self.mean - self.risk_free_return) / downside_risk
+
+    def maximum_drawdown(self) -> Decimal:
+        """
+        Get maximum drawdown so far
+
+        Returns:
+            Decimal
+        """
+        return self.mdd
+
+    def longest_drawdown(self) -> int:
+        """
+        Get longest drawdown so far, in periods
+
+        Returns:
+            int
+        """
+        return self.max_period
+
+    def information_ratio(self) -> Decimal:
+        """
+        Calculate information ratio
+
+        Raises:
+            ValueError: Less than two benchmarked period returns
+
+        Returns:
+            Decimal
+        """
+        if self.benchmark_count < 2:
+            raise ValueError("Invalid length")
+
+        if self.active_mean == 0:
+            return 0
+
+        return self.active_mean / (self.active_m2 / self.benchmark_count).sqrt()
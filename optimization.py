@@ -1,13 +1,29 @@
 """
 Optimization module
+
+The study is kept in memory, or in an on-disk storage (SQLite or an Optuna journal
+file) shared by several worker processes. A stored study is resumed where it was
+interrupted.
 """
 
-import logging
-import optuna
-from optuna.samplers import TPESampler
-from config.config import OPTIMIZATION_CONFIG
+import os
+import time
+import argparse
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from config import config
+
+from backtesting import MarketData, create_bt_instance
+from report import IMAGE_FORMATS, Chart, render_many
 
-from backtesting import create_bt_instance
+# In-sample data of the worker process, see init_worker
+market_data: Optional[MarketData] = None
+# Seconds between the heartbeats of a running trial in a database storage, and
+# without heartbeat before the trial is failed and retried
+HEARTBEAT_INTERVAL = 60
+GRACE_PERIOD = 180
 
 
 class OptunaCallBack:
@@ -15,21 +31,30 @@ class OptunaCallBack:
     Optuna call back class
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self, path: str = "result/optimization/optimization.log.csv", append=False
+    ) -> None:
         """
-        Init optuna callback
+        Init optuna callback, the header is written unless appending to a log
+
+        Every row is written by one write call on the file opened in append mode,
+        so that the rows of concurrent workers are never interleaved or overwritten.
+
+        Args:
+            path (str, optional): Defaults to
+                "result/optimization/optimization.log.csv".
+            append (bool, optional): continue the log of a resumed study. Defaults
+                to False.
         """
-        logging.basicConfig(
-            filename="result/optimization/optimization.log.csv",
-            format="%(message)s",
-            filemode="w",
-        )
-        logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
-        self.logger = logger
-        self.logger.info("number,pelb,peub,dylb,dyub")
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not append or not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("number,peub,dylb,value\n")
 
-    def __call__(self, _: optuna.study.Study, trial: optuna.trial.FrozenTrial) -> None:
+    def __call__(
+        self, _: "optuna.study.Study", trial: "optuna.trial.FrozenTrial"
+    ) -> None:
         """
 
         Args:
@@ -38,16 +63,167 @@ class OptunaCallBack:
         """
         peub = trial.params["peub"]
         dylb = trial.params["dylb"]
-        self.logger.info(
-            "%s,%s,%s,%s",
-            trial.number,
-            peub,
-            dylb,
-            trial.value,
+        row = f"{trial.number},{peub},{dylb},{trial.value}\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            os.write(fd, row.encode())
+        finally:
+            os.close(fd)
+
+
+class SelectionCache:
+    """
+    Sharpe ratios of the completed trials by selection signature, see
+    Backtesting.selection_signature
+    """
+
+    def __init__(self) -> None:
+        self.sharpe_ratios: Dict[str, float] = {}
+
+    def get(
+        self, signature: str, study: Optional["optuna.study.Study"] = None
+    ) -> Optional[float]:
+        """
+        Look up the trials of this process, then the completed trials of the study,
+        e.g. of the other workers or of the interrupted run
+
+        Args:
+            signature (str)
+            study (optuna.study.Study, optional): Defaults to None.
+
+        Returns:
+            Optional[float]: None if no equivalent trial was completed
+        """
+        import optuna  # pylint: disable=import-outside-toplevel
+
+        if signature not in self.sharpe_ratios and study is not None:
+            for trial in study.get_trials(
+                deepcopy=False, states=[optuna.trial.TrialState.COMPLETE]
+            ):
+                if trial.user_attrs.get("selection") == signature:
+                    self.sharpe_ratios[signature] = trial.value
+                    break
+        return self.sharpe_ratios.get(signature)
+
+    def put(self, signature: str, sharpe_ratio: float):
+        """
+        Args:
+            signature (str)
+            sharpe_ratio (float)
+        """
+        self.sharpe_ratios[signature] = float(sharpe_ratio)
+
+
+def cache_stats(study: "optuna.study.Study") -> Dict[str, int]:
+    """
+    Count the trials of the study answered by the selection cache
+
+    Args:
+        study (optuna.study.Study)
+
+    Returns:
+        Dict[str, int]: hits and misses
+    """
+    cached = [
+        trial.user_attrs["cached"]
+        for trial in study.get_trials(deepcopy=False)
+        if "cached" in trial.user_attrs
+    ]
+    return {"hits": sum(cached), "misses": len(cached) - sum(cached)}
+
+
+def create_pruner(name: str) -> "optuna.pruners.BasePruner":
+    """
+    Create pruner from its config name
+
+    Args:
+        name (str): "median", "successive_halving" or "none"
+
+    Returns:
+        optuna.pruners.BasePruner
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    if name == "median":
+        return optuna.pruners.MedianPruner(
+            n_warmup_steps=config.OPTIMIZATION_CONFIG["pruner_warmup_steps"]
         )
+    if name == "successive_halving":
+        return optuna.pruners.SuccessiveHalvingPruner(
+            min_resource=config.OPTIMIZATION_CONFIG["pruner_warmup_steps"]
+        )
+    if name == "none":
+        return optuna.pruners.NopPruner()
 
+    raise ValueError(f"Unknown pruner {name}")
 
-if __name__ == "__main__":
+
+def print_timing(study: "optuna.study.Study", data: MarketData):
+    """
+    Print timing breakdown of the study
+
+    Args:
+        study (optuna.study.Study)
+        data (MarketData): market data of the study
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    trials = study.get_trials(
+        states=[optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED]
+    )
+    # Missing on the trials of an older study or interrupted before being timed
+    load_times = [trial.user_attrs.get("load_time") for trial in trials]
+    load_times = [value for value in load_times if value is not None]
+    run_times = [trial.user_attrs.get("run_time") for trial in trials]
+    run_times = [value for value in run_times if value is not None]
+    pruned_trials = study.get_trials(states=[optuna.trial.TrialState.PRUNED])
+    print(f"Pruned trials {len(pruned_trials)}/{len(study.trials)}")
+    print(f"Market data load (once per study) {data.load_time:.4f}s")
+    if load_times:
+        print(f"Mean load time per trial {np.mean(load_times):.4f}s")
+    if run_times:
+        print(f"Mean run time per trial {np.mean(run_times):.4f}s")
+    print(f"Total trial time {np.sum(load_times) + np.sum(run_times):.4f}s")
+    stats = cache_stats(study)
+    if stats["hits"] + stats["misses"]:
+        print(
+            f"Selection cache {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hits'] / (stats['hits'] + stats['misses']):.1%} of the "
+            "trials not run)"
+        )
+
+
+def create_objective(
+    data: MarketData,
+    profile: Optional[str] = None,
+    charts: Optional[List[Tuple[int, str, Chart]]] = None,
+    memoize: bool = True,
+) -> Callable:
+    """
+    Create the sharpe ratio objective on preloaded market data
+
+    With memoize, a trial selecting the same stocks at every rebalancing date as a
+    completed trial gets its sharpe ratio without running the backtest. The
+    signature of the selection and whether it was cached are kept in the trial
+    user attributes "selection" and "cached".
+
+    Args:
+        data (MarketData): e.g. the in-sample data or a walk-forward window
+        profile (str, optional): folder to dump one profiler trace per trial.
+            Defaults to None.
+        charts (List[Tuple[int, str, Chart]], optional): collects the hpr and
+            drawdown charts of every completed trial as (trial number, name,
+            chart), to be rendered after the study. The charts of a cached trial
+            are those of its equivalent trial, they are not collected again.
+            Defaults to None.
+        memoize (bool, optional): Defaults to True.
+
+    Returns:
+        Callable: objective of a trial
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    cache = SelectionCache() if memoize else None
 
     def objective(trial):
         """
@@ -59,27 +235,399 @@ if __name__ == "__main__":
         Returns:
             _type_: _description_
         """
+        start = time.perf_counter()
         smart_beta, grouped_data, rebalancing_dates = create_bt_instance(
-            process_data=True, is_data=True
+            is_data=True, market_data=data
         )
+        trial.set_user_attr("load_time", time.perf_counter() - start)
         peub = trial.suggest_int(
             "peub",
-            OPTIMIZATION_CONFIG["pe_high"][0],
-            OPTIMIZATION_CONFIG["pe_high"][1],
+            config.OPTIMIZATION_CONFIG["pe_high"][0],
+            config.OPTIMIZATION_CONFIG["pe_high"][1],
             step=1,
         )
         dylb = trial.suggest_float(
-            "dylb", OPTIMIZATION_CONFIG["dy_low"][0], OPTIMIZATION_CONFIG["dy_low"][1]
+            "dylb",
+            config.OPTIMIZATION_CONFIG["dy_low"][0],
+            config.OPTIMIZATION_CONFIG["dy_low"][1],
         )
 
-        return smart_beta.run(grouped_data, rebalancing_dates, [0, peub], [dylb, 1e6])
+        def report(step, _, score):
+            trial.report(float(score), step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        profiler = smart_beta.enable_profiling() if profile else None
+        start = time.perf_counter()
+        try:
+            if cache is not None:
+                signature = smart_beta.selection_signature(
+                    data.rebalancing_dates(), [0, peub], [dylb, 1e6]
+                )
+                trial.set_user_attr("selection", signature)
+                sharpe_ratio = cache.get(signature, trial.study)
+                trial.set_user_attr("cached", sharpe_ratio is not None)
+                if sharpe_ratio is not None:
+                    return sharpe_ratio
+
+            sharpe_ratio = smart_beta.run(
+                grouped_data,
+                rebalancing_dates,
+                [0, peub],
+                [dylb, 1e6],
+                progress_callback=report,
+            )
+            if charts is not None:
+                charts.append((trial.number, "hpr", smart_beta.hpr_chart()))
+                charts.append((trial.number, "drawdown", smart_beta.drawdown_chart()))
+            if cache is not None:
+                cache.put(signature, sharpe_ratio)
+            return sharpe_ratio
+        finally:
+            trial.set_user_attr("run_time", time.perf_counter() - start)
+            if profiler is not None:
+                profiler.export(profile, f"trial_{trial.number}")
+
+    return objective
+
+
+def create_storage(url: str) -> "optuna.storages.BaseStorage":
+    """
+    Create an on-disk study storage
+
+    A database storage records the heartbeat of the running trials: a trial
+    without heartbeat for GRACE_PERIOD, e.g. of a crashed process, is failed and
+    its parameters are retried by the next trial of any worker. The journal file
+    has no heartbeat, see retry_interrupted_trials.
+
+    Args:
+        url (str): "journal:<path>" for an Optuna journal file, safe for many
+            processes, or a database URL such as "sqlite:///<path>"
+
+    Returns:
+        optuna.storages.BaseStorage
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    # The journal storage and the retry of stale trials are experimental in Optuna
+    warnings.filterwarnings("ignore", category=optuna.exceptions.ExperimentalWarning)
+    for prefix in ["journal:", "sqlite:///"]:
+        if url.startswith(prefix):
+            os.makedirs(os.path.dirname(url[len(prefix) :]) or ".", exist_ok=True)
+    if url.startswith("journal:"):
+        return optuna.storages.JournalStorage(
+            optuna.storages.JournalFileStorage(url[len("journal:") :])
+        )
+
+    # Wait for the lock of the other writers instead of failing at once
+    return optuna.storages.RDBStorage(
+        url,
+        engine_kwargs={"connect_args": {"timeout": 60}},
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        grace_period=GRACE_PERIOD,
+        failed_trial_callback=optuna.storages.RetryFailedTrialCallback(),
+    )
+
+
+def sampler_seed(worker: int = 0, resumed_trials: int = 0) -> int:
+    """
+    Seed of the sampler of one worker, distinct for every worker of a study and for
+    every resumption, so that no worker samples the parameters of another again
+
+    Args:
+        worker (int, optional): Defaults to 0.
+        resumed_trials (int, optional): trials of the study when it was resumed.
+            Defaults to 0.
+
+    Returns:
+        int: the seed of the config for the first worker of a new study
+    """
+    seed = config.OPTIMIZATION_CONFIG["random_seed"]
+    if resumed_trials == 0:
+        return seed + worker
+    return int(
+        np.random.SeedSequence([seed, resumed_trials, worker]).generate_state(1)[0]
+    )
+
+
+def create_study(
+    storage: Optional[str] = None,
+    study_name: Optional[str] = None,
+    seed: Optional[int] = None,
+) -> "optuna.study.Study":
+    """
+    Create the study with the seeded sampler and the pruner of the config, or load
+    it from storage if it exists
+
+    Args:
+        storage (str, optional): see create_storage, None keeps the study in
+            memory. Defaults to None.
+        study_name (str, optional): Defaults to None.
+        seed (int, optional): see sampler_seed. Defaults to the seed of the
+            config.
 
-    optunaCallBack = OptunaCallBack()
-    # TODO: correct the seed to get input from the parameter/optimization_parameter.json
-    study = optuna.create_study(
-        sampler=TPESampler(seed=OPTIMIZATION_CONFIG["random_seed"]),
+    Returns:
+        optuna.study.Study
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+    from optuna.samplers import TPESampler  # pylint: disable=import-outside-toplevel
+
+    return optuna.create_study(
+        storage=create_storage(storage) if storage else None,
+        sampler=TPESampler(seed=sampler_seed() if seed is None else seed),
         direction="maximize",
+        pruner=create_pruner(config.OPTIMIZATION_CONFIG["pruner"]),
+        study_name=study_name,
+        load_if_exists=True,
     )
+
+
+def retry_interrupted_trials(study: "optuna.study.Study") -> int:
+    """
+    Fail every running trial of the study and queue its parameters again, for a
+    study interrupted in a storage without heartbeat: the trials of a process
+    still running on the study would be duplicated
+
+    Args:
+        study (optuna.study.Study)
+
+    Returns:
+        int: number of trials queued again
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    trials = study.get_trials(deepcopy=False, states=[optuna.trial.TrialState.RUNNING])
+    for trial in trials:
+        study.tell(trial.number, state=optuna.trial.TrialState.FAIL)
+        study.enqueue_trial(trial.params)
+    return len(trials)
+
+
+def finished_trials(study: "optuna.study.Study") -> int:
+    """
+    Count the completed and pruned trials of the study
+
+    Args:
+        study (optuna.study.Study)
+
+    Returns:
+        int
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    return len(
+        study.get_trials(
+            deepcopy=False,
+            states=[optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED],
+        )
+    )
+
+
+def optimize(
+    study: "optuna.study.Study",
+    n_trials: int,
+    callback: OptunaCallBack,
+    profile: Optional[str] = None,
+    charts: bool = False,
+    memoize: bool = True,
+) -> List[Tuple[int, str, Chart]]:
+    """
+    Run trials on the in-sample data of the process until the study has n_trials
+    finished trials
+
+    Args:
+        study (optuna.study.Study)
+        n_trials (int): finished trials of the whole study
+        callback (OptunaCallBack)
+        profile (str, optional): see create_objective. Defaults to None.
+        charts (bool, optional): collect the charts of the trials. Defaults to
+            False.
+        memoize (bool, optional): see create_objective. Defaults to True.
+
+    Returns:
+        List[Tuple[int, str, Chart]]: charts of the trials, see create_objective
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    init_worker()
+    trial_charts = [] if charts else None
     study.optimize(
-        objective, n_trials=OPTIMIZATION_CONFIG["no_trials"], callbacks=[optunaCallBack]
+        create_objective(market_data, profile, trial_charts, memoize),
+        n_trials=max(n_trials - finished_trials(study), 0),
+        callbacks=[
+            optuna.study.MaxTrialsCallback(
+                n_trials,
+                states=[
+                    optuna.trial.TrialState.COMPLETE,
+                    optuna.trial.TrialState.PRUNED,
+                ],
+            ),
+            callback,
+        ],
+    )
+    return trial_charts or []
+
+
+def init_worker(memory_map: bool = True):
+    """
+    Load the in-sample data once per process, inherited when the pool forks
+
+    Args:
+        memory_map (bool, optional): share the panel between the worker
+            processes, see MarketData. Defaults to True.
+    """
+    global market_data  # pylint: disable=global-statement
+    if market_data is None:
+        market_data = MarketData(is_data=True, memory_map=memory_map)
+
+
+def run_worker(
+    seed: int,
+    storage: str,
+    study_name: str,
+    n_trials: int,
+    callback: OptunaCallBack,
+    profile: Optional[str] = None,
+    charts: bool = False,
+    memoize: bool = True,
+) -> List[Tuple[int, str, Chart]]:
+    """
+    Run trials of the stored study in a worker process
+
+    Args:
+        seed (int): see sampler_seed
+        storage (str): see create_storage
+        study_name (str)
+        n_trials (int): finished trials of the whole study
+        callback (OptunaCallBack)
+        profile (str, optional): Defaults to None.
+        charts (bool, optional): Defaults to False.
+        memoize (bool, optional): Defaults to True.
+
+    Returns:
+        List[Tuple[int, str, Chart]]
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    return optimize(
+        create_study(storage, study_name, seed),
+        n_trials,
+        callback,
+        profile,
+        charts,
+        memoize,
+    )
+
+
+def main():
+    """
+    Run the optimization study from the command line
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="result/profile",
+        help="time the backtest phases and dump one trace per trial to this folder",
+    )
+    parser.add_argument(
+        "--charts",
+        nargs="?",
+        const="result/optimization/trials",
+        help="render the hpr and drawdown charts of every trial to this folder",
+    )
+    parser.add_argument("--chart-format", choices=IMAGE_FORMATS, default="png")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="processes running trials of the study, then rendering the charts",
+    )
+    parser.add_argument(
+        "--storage",
+        help="keep the study in journal:<path> or sqlite:///<path> and resume it, "
+        "needed by more than one worker",
     )
+    parser.add_argument("--study-name", default="smart_beta")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="retry the trials left running by an interrupted study, only when no "
+        "other process runs it (a database storage retries them on its own)",
+    )
+    parser.add_argument(
+        "--no-memoize",
+        action="store_true",
+        help="run every trial, even when an equivalent selection was already run",
+    )
+    args = parser.parse_args()
+    if args.workers > 1 and not args.storage:
+        parser.error("--workers above 1 needs a --storage shared by the workers")
+
+    n_trials = config.OPTIMIZATION_CONFIG["no_trials"]
+    study = create_study(args.storage, args.study_name)
+    retried = retry_interrupted_trials(study) if args.resume else 0
+    resumed_trials = len(study.trials)
+    if resumed_trials:
+        print(
+            f"Resuming study {args.study_name}: {finished_trials(study)}/{n_trials} "
+            f"trials finished, {retried} interrupted trials queued again"
+        )
+        study = create_study(
+            args.storage, args.study_name, sampler_seed(0, resumed_trials)
+        )
+    optuna_callback = OptunaCallBack(append=resumed_trials > 0)
+
+    # Loaded before forking, so that workers share it
+    init_worker(memory_map=args.workers > 1)
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            worker_charts = executor.map(
+                run_worker,
+                [
+                    sampler_seed(worker, resumed_trials)
+                    for worker in range(args.workers)
+                ],
+                [args.storage] * args.workers,
+                [args.study_name] * args.workers,
+                [n_trials] * args.workers,
+                [optuna_callback] * args.workers,
+                [args.profile] * args.workers,
+                [bool(args.charts)] * args.workers,
+                [not args.no_memoize] * args.workers,
+            )
+            trial_charts = [chart for charts in worker_charts for chart in charts]
+    else:
+        trial_charts = optimize(
+            study,
+            n_trials,
+            optuna_callback,
+            args.profile,
+            bool(args.charts),
+            not args.no_memoize,
+        )
+    print_timing(study, market_data)
+    if args.charts:
+        start = time.perf_counter()
+        os.makedirs(args.charts, exist_ok=True)
+        render_many(
+            [
+                (
+                    chart,
+                    os.path.join(
+                        args.charts, f"trial_{number}_{name}.{args.chart_format}"
+                    ),
+                )
+                for number, name, chart in trial_charts
+            ],
+            workers=args.workers,
+        )
+        print(
+            f"{len(trial_charts)} charts rendered in "
+            f"{time.perf_counter() - start:.4f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+Dense market panel: date x ticker arrays built from the processed daily groups
+
+The panel can be saved as one .npy file per array and loaded memory-mapped, so that
+worker processes read the same pages of the OS cache instead of each processing
+and holding its own copy of the dataset.
+"""
+
+import os
+import copy
+import json
+from collections.abc import Sequence
+from queue import Queue
+from typing import Dict, Iterable, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+
+# Date x ticker arrays, saved along with the columns of the daily groups
+DENSE_ARRAYS = [
+    "present",
+    "close",
+    "prev_close",
+    "pe",
+    "dy",
+    "ffill_close",
+    "last_quote",
+]
+
+
+class MarketPanel:
+    """
+    Market panel, one row per trading date and one column per ticker
+    """
+
+    def __init__(self, processed_data: Iterable[Tuple[tuple, pd.DataFrame]]):
+        """
+        Pivot the daily groups to date x ticker arrays, NaN where there is no quote,
+        and forward-fill the close over the suspensions
+
+        Args:
+            processed_data (Iterable[Tuple[tuple, pd.DataFrame]]): daily groups, as
+                returned by Backtesting.process_data or MarketData.grouped_data
+        """
+        keys, groups = zip(*processed_data)
+        self.dates = [key[0] for key in keys]
+
+        data = pd.concat(groups)
+        self.group_columns = list(data.columns)
+        # Rows of the daily groups in data, date i is offsets[i]:offsets[i + 1]
+        self.offsets = np.concatenate(
+            [[0], np.cumsum([len(group) for group in groups])]
+        )
+        self.tickers, ticker_ids = np.unique(
+            data["tickersymbol"].to_numpy(dtype=str), return_inverse=True
+        )
+        self.columns = {
+            name: data[name].to_numpy()
+            for name in data.columns
+            if name not in ("date", "tickersymbol")
+        }
+        self.index = (
+            np.repeat(np.arange(len(groups)), np.diff(self.offsets)),
+            ticker_ids,
+        )
+
+        self.present = np.zeros((len(self.dates), len(self.tickers)), dtype=bool)
+        self.present[self.index] = True
+        self.close = self.pivot(self.columns["close"])
+        self.prev_close = self.pivot(self.columns["prev_close"])
+        self.pe = self.pivot(self.columns["pe"])
+        self.dy = self.pivot(self.columns["dy"])
+
+        # Row of the last quote of each ticker up to each date, -1 before the first
+        self.last_quote = np.maximum.accumulate(
+            np.where(self.present, np.arange(len(self.dates))[:, None], -1), axis=0
+        )
+        # Close forward-filled over the suspensions, NaN before the first quote
+        self.ffill_close = np.where(
+            self.last_quote >= 0,
+            np.take_along_axis(self.close, np.maximum(self.last_quote, 0), axis=0),
+            np.nan,
+        )
+        self.ticker_index = {
+            ticker: i for i, ticker in enumerate(self.tickers.tolist())
+        }
+
+    def pivot(self, values: np.ndarray) -> np.ndarray:
+        """
+        Pivot a column of the concatenated daily groups to a date x ticker array
+
+        Args:
+            values (np.ndarray)
+
+        Returns:
+            np.ndarray
+        """
+        pivoted = np.full((len(self.dates), len(self.tickers)), np.nan)
+        pivoted[self.index] = np.asarray(values, dtype=float)
+        return pivoted
+
+    def window(self, rows: slice) -> "MarketPanel":
+        """
+        Get the panel of a contiguous range of dates, with the same tickers
+
+        The forward-filled close keeps the quotes before the window, the last
+        quote rows become relative to the window (negative before it).
+
+        Args:
+            rows (slice): contiguous date rows
+
+        Returns:
+            MarketPanel
+        """
+        start, stop, _ = rows.indices(len(self.dates))
+        data_rows = slice(int(self.offsets[start]), int(self.offsets[stop]))
+
+        window = copy.copy(self)
+        window.dates = self.dates[rows]
+        window.offsets = self.offsets[start : stop + 1] - self.offsets[start]
+        window.columns = {
+            name: values[data_rows] for name, values in self.columns.items()
+        }
+        window.index = (
+            self.index[0][data_rows] - start,
+            self.index[1][data_rows],
+        )
+        for name in DENSE_ARRAYS:
+            setattr(window, name, getattr(self, name)[rows])
+        window.last_quote = self.last_quote[rows] - start
+        return window
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Pivot any other column of the daily groups, e.g. a per share factor
+
+        Args:
+            name (str)
+
+        Returns:
+            np.ndarray
+        """
+        if name not in self.columns:
+            raise KeyError(f"Column {name} is not in the dataset, reload the data")
+        return self.pivot(self.columns[name])
+
+    def group(self, row: int) -> pd.DataFrame:
+        """
+        Rebuild the daily group of one date from the columns, same rows and order
+
+        Args:
+            row (int)
+
+        Returns:
+            pd.DataFrame: same columns as the daily groups
+        """
+        rows = slice(int(self.offsets[row]), int(self.offsets[row + 1]))
+        data = {
+            "tickersymbol": self.tickers[self.index[1][rows]].astype(object),
+            "date": [self.dates[row]] * (rows.stop - rows.start),
+            **{name: values[rows] for name, values in self.columns.items()},
+        }
+        return pd.DataFrame({name: data[name] for name in self.group_columns})
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Get every array of the panel by file name, dates as datetime64[D]
+
+        Returns:
+            Dict[str, np.ndarray]
+        """
+        return {
+            "dates": np.array(self.dates, dtype="datetime64[D]"),
+            "tickers": self.tickers,
+            "offsets": self.offsets,
+            "ticker_ids": self.index[1],
+            **{name: getattr(self, name) for name in DENSE_ARRAYS},
+            **{f"column.{name}": values for name, values in self.columns.items()},
+        }
+
+    def save(self, directory: str, fingerprint: Dict):
+        """
+        Save the panel to directory, one .npy file per array
+
+        Args:
+            directory (str)
+            fingerprint (Dict): dataset fingerprint, checked by load
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        # Invalidate first, a partially written panel must never look fresh
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        arrays = self.arrays()
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), values, allow_pickle=False)
+
+        with open(manifest_path + ".tmp", 'w', encoding="utf-8") as f:
+            json.dump(
+                {
+                    "fingerprint": fingerprint,
+                    "group_columns": self.group_columns,
+                    "arrays": list(arrays),
+                },
+                f,
+                indent=4,
+                default=str,
+            )
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @classmethod
+    def load(cls, directory: str, fingerprint: Dict) -> Optional["MarketPanel"]:
+        """
+        Load a saved panel memory-mapped and read-only: processes loading the same
+        panel share its pages, nothing is copied until sliced with fancy indexing
+
+        Args:
+            directory (str)
+            fingerprint (Dict): expected dataset fingerprint
+
+        Returns:
+            Optional[MarketPanel]: None if the panel is missing or stale
+        """
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, 'r', encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["fingerprint"] != json.loads(json.dumps(fingerprint, default=str)):
+            return None
+
+        arrays = {
+            name: np.load(
+                os.path.join(directory, f"{name}.npy"),
+                mmap_mode="r",
+                allow_pickle=False,
+            )
+            for name in manifest["arrays"]
+        }
+
+        panel = cls.__new__(cls)
+        panel.dates = arrays["dates"].astype(object).tolist()
+        panel.group_columns = manifest["group_columns"]
+        panel.tickers = np.asarray(arrays["tickers"])
+        panel.offsets = arrays["offsets"]
+        panel.columns = {
+            name[len("column.") :]: values
+            for name, values in arrays.items()
+            if name.startswith("column.")
+        }
+        panel.index = (
+            np.repeat(np.arange(len(panel.dates)), np.diff(panel.offsets)),
+            arrays["ticker_ids"],
+        )
+        for name in DENSE_ARRAYS:
+            setattr(panel, name, arrays[name])
+        panel.ticker_index = {
+            ticker: i for i, ticker in enumerate(panel.tickers.tolist())
+        }
+        return panel
+
+    def rebalancing_flags(self, execution_dates: Queue) -> np.ndarray:
+        """
+        Flag the rebalancing dates the same way as Backtesting.run, the queue is consumed
+
+        Args:
+            execution_dates (Queue)
+
+        Returns:
+            np.ndarray: bool array, one flag per date
+        """
+        flags = np.zeros(len(self.dates), dtype=bool)
+        is_rebalancing = False
+        for i, date in enumerate(self.dates):
+            is_rebalancing = (
+                ((not is_rebalancing) and (date >= execution_dates.queue[0]))
+                if not execution_dates.empty()
+                else False
+            )
+            if is_rebalancing:
+                execution_dates.get()
+            flags[i] = is_rebalancing
+
+        return flags
+
+
+class PanelGroups(Sequence):
+    """
+    Daily groups of a panel, rebuilt on access instead of kept in memory: a
+    drop-in for the list of (key, group) of Backtesting.process_data
+    """
+
+    def __init__(self, panel: MarketPanel):
+        """
+        Args:
+            panel (MarketPanel)
+        """
+        self.panel = panel
+
+    def __len__(self) -> int:
+        return len(self.panel.dates)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return PanelGroups(self.panel.window(item))
+        row = range(len(self))[item]
+        return (self.panel.dates[row],), self.panel.group(row)
@@ -0,0 +1,247 @@
+"""
+Opt-in instrumentation of the backtesting hot path: phase timers, counters and
+trace export
+"""
+
+import os
+import csv
+import json
+import time
+import threading
+from collections import defaultdict
+from functools import wraps
+from typing import Callable, Dict, Iterable
+
+from utils import Timeline
+
+# Backtesting methods timed by Profiler.instrument, nested phases are kept nested
+PHASES = [
+    "update_period_return",
+    "rebalancing",
+    "total_asset",
+    "sell_stocks",
+    "daily_update_segment",
+    "compute_metric",
+    "rebalancing_many",
+    "daily_update_many",
+]
+
+
+class Profiler(Timeline):
+    """
+    Timeline of phases plus counters
+
+    Nothing in Backtesting refers to the profiler until instrument is called, which
+    shadows the hot methods of one instance with timed wrappers, so a backtest that
+    is not profiled runs the plain methods at no cost.
+    """
+
+    def __init__(self):
+        """
+        Start the clock, no phase nor counter yet
+        """
+        super().__init__()
+        self.counters: Dict[str, int] = defaultdict(int)
+
+    def count(self, name: str, value: int = 1):
+        """
+        Increase a counter
+
+        Args:
+            name (str)
+            value (int, optional): Defaults to 1.
+        """
+        self.counters[name] += value
+
+    def record(self, name: str, start: float, end: float):
+        """
+        Record a phase measured with time.perf_counter
+
+        Args:
+            name (str)
+            start (float)
+            end (float)
+        """
+        self.stages.append(
+            (
+                name,
+                threading.current_thread().name,
+                start - self.origin,
+                end - self.origin,
+            )
+        )
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        """
+        Time every call of function as the phase name
+
+        Args:
+            name (str)
+            function (Callable)
+
+        Returns:
+            Callable
+        """
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter())
+
+        return timed
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterable:
+        """
+        Time the production of every item of iterable as the phase name, e.g. the
+        groupby iteration
+
+        Args:
+            name (str)
+            iterable (Iterable)
+
+        Yields:
+            items of iterable
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.record(name, start, time.perf_counter())
+            yield item
+
+    def instrument(self, bt: "Backtesting") -> "Profiler":
+        """
+        Time the hot methods of one backtesting instance and count rows scanned,
+        suspended price fallbacks and orders
+
+        Args:
+            bt (Backtesting)
+
+        Returns:
+            Profiler: self
+        """
+        for name in PHASES:
+            setattr(bt, name, self.wrap(name, getattr(bt, name)))
+
+        rebalancing = bt.rebalancing
+        daily_update_segment = bt.daily_update_segment
+
+        @wraps(rebalancing)
+        def counted_rebalancing(group, *args):
+            before = dict(bt.portfolio)
+            try:
+                return rebalancing(group, *args)
+            finally:
+                self.count("rows_scanned", len(group))
+                for symbol in before.keys() | bt.portfolio.keys():
+                    if symbol != "CASH":
+                        qty = bt.portfolio.get(symbol, 0) - before.get(symbol, 0)
+                        if qty:
+                            self.count("buy_orders" if qty > 0 else "sell_orders")
+
+        @wraps(daily_update_segment)
+        def counted_daily_update_segment(start, end):
+            suspended = len(bt.journal.suspensions)
+            try:
+                return daily_update_segment(start, end)
+            finally:
+                self.count("rows_scanned", (end - start) * (len(bt.portfolio) - 1))
+                self.count(
+                    "suspended_price_fallbacks", len(bt.journal.suspensions) - suspended
+                )
+
+        bt.rebalancing = counted_rebalancing
+        bt.daily_update_segment = counted_daily_update_segment
+        bt.profiler = self
+        return self
+
+    def summary(self) -> str:
+        """
+        Format total time per phase, nested phases are included in their parents,
+        then the counters
+
+        Returns:
+            str
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        for name, _, start, end in self.stages:
+            totals[name][0] += 1
+            totals[name][1] += end - start
+
+        lines = [f"{'phase':<28}{'calls':>10}{'total':>12}{'mean (ms)':>12}"]
+        for name, (calls, total) in sorted(totals.items(), key=lambda x: -x[1][1]):
+            lines.append(
+                f"{name:<28}{calls:>10}{total:>12.4f}{total / calls * 1e3:>12.4f}"
+            )
+        for name, value in self.counters.items():
+            lines.append(f"{name:<28}{value:>10}")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self, path: str):
+        """
+        Write the trace in Chrome trace-event format, open it in chrome://tracing or
+        https://ui.perfetto.dev
+
+        Args:
+            path (str)
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "pid": pid,
+                "tid": thread,
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+            }
+            for name, thread, start, end in self.stages
+        ]
+        end = max((end for *_, end in self.stages), default=0.0)
+        events += [
+            {
+                "name": name,
+                "ph": "C",
+                "pid": pid,
+                "ts": end * 1e6,
+                "args": {name: value},
+            }
+            for name, value in self.counters.items()
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def to_csv(self, path: str):
+        """
+        Write the trace as a flat csv: one row per phase call, then one per counter
+
+        Args:
+            path (str)
+        """
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["type", "name", "thread", "start", "duration", "value"])
+            for name, thread, start, end in self.stages:
+                writer.writerow(["phase", name, thread, start, end - start, ""])
+            for name, value in self.counters.items():
+                writer.writerow(["counter", name, "", "", "", value])
+
+    def export(self, directory: str, name: str):
+        """
+        Write the trace to directory as name.json in Chrome trace-event format and
+        as name.csv
+
+        Args:
+            directory (str)
+            name (str): e.g. the run or the trial
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.to_chrome_trace(os.path.join(directory, f"{name}.json"))
+        self.to_csv(os.path.join(directory, f"{name}.csv"))
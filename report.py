@@ -0,0 +1,187 @@
+"""
+Chart rendering for the backtest reports
+
+Charts are plain picklable descriptions rendered on the Agg canvas, without the
+pyplot state machine, so that every figure is released after it is saved. Long
+series are downsampled with Largest-Triangle-Three-Buckets (LTTB), which keeps the
+visual shape (peaks, drawdowns) with a bounded number of points, and many charts
+can be rendered in parallel processes.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+IMAGE_FORMATS = ["svg", "png"]
+
+
+class Chart:
+    """
+    Line chart description: title, axis labels and series
+    """
+
+    def __init__(self, title: str, xlabel: str, ylabel: str, legend: bool = True):
+        """
+        Args:
+            title (str)
+            xlabel (str)
+            ylabel (str)
+            legend (bool, optional): Defaults to True.
+        """
+        self.title = title
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.legend = legend
+        self.series: List[Tuple[str, np.ndarray, np.ndarray, str]] = []
+
+    def add(self, label: str, x: Sequence, y: Sequence, color: str) -> "Chart":
+        """
+        Add a line
+
+        Args:
+            label (str)
+            x (Sequence): dates or numbers
+            y (Sequence): numbers, Decimal included
+            color (str)
+
+        Returns:
+            Chart: self
+        """
+        self.series.append((label, np.asarray(x), np.asarray(y, dtype=float), color))
+        return self
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Select the points of a series kept by Largest-Triangle-Three-Buckets: the first
+    and last points, then in each bucket the point forming the largest triangle
+    with the previous selected point and the mean of the next bucket
+
+    Args:
+        x (np.ndarray): increasing numbers
+        y (np.ndarray)
+        n_out (int): number of points to keep
+
+    Returns:
+        np.ndarray: indices of the kept points, increasing
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        areas = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(np.nan_to_num(areas, nan=-1.0)))
+        selected[i + 1] = a
+
+    return selected
+
+
+def as_numbers(x: np.ndarray) -> np.ndarray:
+    """
+    Convert x values to float, dates as days since the epoch
+
+    Args:
+        x (np.ndarray)
+
+    Returns:
+        np.ndarray
+    """
+    if x.dtype == object or np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[D]").astype(float)
+    return x.astype(float)
+
+
+def render(
+    chart: Chart,
+    path: str,
+    image_format: Optional[str] = None,
+    dpi: int = 300,
+    max_points: Optional[int] = 2000,
+):
+    """
+    Render a chart on the Agg canvas and save it, the figure is released after
+
+    Args:
+        chart (Chart)
+        path (str)
+        image_format (str, optional): "svg" or "png". Defaults to the extension of
+            path.
+        dpi (int, optional): Defaults to 300.
+        max_points (int, optional): series longer than this are downsampled with
+            LTTB, None keeps every point. Defaults to 2000.
+    """
+    # pylint: disable=import-outside-toplevel
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    image_format = image_format or os.path.splitext(path)[1][1:]
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown image format {image_format}, use {IMAGE_FORMATS}")
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    try:
+        axes = figure.add_subplot()
+        for label, x, y, color in chart.series:
+            if max_points is not None:
+                kept = lttb(as_numbers(x), y, max_points)
+                x, y = x[kept], y[kept]
+            axes.plot(x, y, label=label, color=color)
+
+        axes.set_title(chart.title)
+        axes.set_xlabel(chart.xlabel)
+        axes.set_ylabel(chart.ylabel)
+        axes.grid(True)
+        if chart.legend:
+            axes.legend()
+        figure.savefig(path, dpi=dpi, bbox_inches='tight', format=image_format)
+    finally:
+        figure.clear()
+
+
+def render_many(
+    charts: List[Tuple[Chart, str]],
+    workers: int = 1,
+    image_format: Optional[str] = None,
+    dpi: int = 300,
+    max_points: Optional[int] = 2000,
+):
+    """
+    Render many charts, e.g. the reports of every optimization trial
+
+    Args:
+        charts (List[Tuple[Chart, str]]): chart and path
+        workers (int, optional): processes, 1 renders in process. Defaults to 1.
+        image_format (str, optional): Defaults to the extension of each path.
+        dpi (int, optional): Defaults to 300.
+        max_points (int, optional): Defaults to 2000.
+    """
+    arguments = [
+        [chart for chart, _ in charts],
+        [path for _, path in charts],
+        [image_format] * len(charts),
+        [dpi] * len(charts),
+        [max_points] * len(charts),
+    ]
+    if workers > 1 and len(charts) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(charts))) as executor:
+            list(executor.map(render, *arguments))
+    else:
+        list(map(render, *arguments))
@@ -0,0 +1,406 @@
+"""
+Backtesting tests on a synthetic market
+"""
+
+from datetime import date
+from decimal import Decimal
+from queue import Queue
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtesting import Backtesting
+from ledger import compare
+from panel import MarketPanel
+
+DATES = [date(2021, 1, 4), date(2021, 1, 5), date(2021, 2, 1), date(2021, 2, 2)]
+
+
+def create_bt(
+    rows,
+    days,
+    returns,
+    rebalancing_days,
+    capital=Decimal("1e6"),
+    backtesting=Backtesting,
+):
+    """
+    Backtesting over a synthetic market
+
+    Args:
+        rows (list): date, tickersymbol, close, prev_close, pe, dy
+        days (list): trading dates of the VNINDEX
+        returns (list): VNINDEX returns
+        rebalancing_days (list): rebalancing dates
+        capital (Decimal, optional). Defaults to Decimal("1e6").
+        backtesting (type, optional): Defaults to Backtesting.
+
+    Returns:
+        _type_: smart_beta, grouped_data, rebalancing_dates
+    """
+    data = pd.DataFrame(
+        rows, columns=["date", "tickersymbol", "close", "prev_close", "pe", "dy"]
+    )
+    grouped_data = [((day,), group) for day, group in data.groupby("date", sort=True)]
+
+    bt = backtesting(
+        buy_fee=Decimal("0.00035"),
+        sell_fee=Decimal("0.00035"),
+        from_date_str="2021-01-01",
+        to_date_str="2021-04-01",
+        capital=capital,
+    )
+    bt.vnindex_data = pd.DataFrame(
+        {"date": days, "return": [Decimal(r) for r in returns]}
+    )
+    rebalancing_dates = Queue()
+    for day in rebalancing_days:
+        rebalancing_dates.put(day)
+    return bt, grouped_data, rebalancing_dates
+
+
+def create_synthetic_bt():
+    """
+    Two tickers over four dates: A is bought on the first rebalancing date for the
+    whole capital, so the fee overdraws the cash, then A is not quoted on the
+    second rebalancing date and the asset is the negative cash
+
+    Returns:
+        _type_: smart_beta, grouped_data, rebalancing_dates
+    """
+    rows = [
+        (DATES[0], "A", 10.0, 10.0, 5.0, 0.2),
+        (DATES[0], "B", 20.0, 20.0, 30.0, 0.0),
+        (DATES[1], "A", 10.5, 10.0, 5.0, 0.2),
+        (DATES[1], "B", 20.0, 20.0, 30.0, 0.0),
+        (DATES[2], "B", 21.0, 20.0, 30.0, 0.0),
+        (DATES[3], "A", 11.0, 10.5, 5.0, 0.2),
+        (DATES[3], "B", 21.0, 21.0, 30.0, 0.0),
+    ]
+    return create_bt(rows, DATES, ["0.01", "-0.01"] * 2, [DATES[0], DATES[2]])
+
+
+FIXED_DATES = [
+    date(2021, 1, 4),
+    date(2021, 1, 5),
+    date(2021, 1, 6),
+    date(2021, 2, 1),
+    date(2021, 2, 2),
+    date(2021, 2, 3),
+    date(2021, 3, 1),
+    date(2021, 3, 2),
+]
+FIXED_RETURNS = [
+    "0.01",
+    "-0.005",
+    "0.002",
+    "0.003",
+    "-0.01",
+    "0.004",
+    "0.006",
+    "-0.002",
+]
+
+
+def fixed_rows(b_pe=40.0):
+    """
+    Three tickers over three monthly rebalancings with pe in [0, 15] and dy >= 0.05:
+    the held B is suspended on 2021-01-05 and closes at 0 on 2021-01-06, C is not
+    quoted on the 2021-03-01 rebalancing date and nothing qualifies on that date
+
+    Args:
+        b_pe (float, optional): pe of B on 2021-02-01, where its prev_close is 0.
+            Defaults to 40.0, B is not qualified and is sold.
+
+    Returns:
+        list: date, tickersymbol, close, prev_close, pe, dy
+    """
+    d = FIXED_DATES
+    return [
+        (d[0], "A", 10.2, 10.0, 8.0, 0.1),
+        (d[0], "B", 19.8, 20.0, 12.0, 0.06),
+        (d[0], "C", 5.1, 5.0, 30.0, 0.01),
+        (d[1], "A", 10.5, 10.2, 8.0, 0.1),
+        (d[1], "C", 5.2, 5.1, 30.0, 0.01),
+        (d[2], "A", 10.4, 10.5, 8.0, 0.1),
+        (d[2], "B", 0.0, 19.8, 12.0, 0.06),
+        (d[2], "C", 5.0, 5.2, 30.0, 0.01),
+        (d[3], "A", 10.6, 10.4, 9.0, 0.08),
+        (d[3], "B", 21.0, 0.0, b_pe, 0.06),
+        (d[3], "C", 5.05, 5.0, 10.0, 0.07),
+        (d[4], "A", 10.8, 10.6, 9.0, 0.08),
+        (d[4], "B", 21.0, 21.0, 40.0, 0.01),
+        (d[5], "A", 10.7, 10.8, 9.0, 0.08),
+        (d[5], "B", 21.5, 21.0, 40.0, 0.01),
+        (d[5], "C", 5.3, 5.05, 10.0, 0.07),
+        (d[6], "A", 10.9, 10.7, 50.0, 0.08),
+        (d[6], "B", 21.0, 21.5, 50.0, 0.01),
+        (d[7], "A", 11.0, 10.9, 50.0, 0.08),
+        (d[7], "B", 21.0, 21.0, 50.0, 0.01),
+        (d[7], "C", 5.5, 5.3, 50.0, 0.07),
+    ]
+
+
+def create_fixed_bt(b_pe=40.0):
+    """
+    Backtesting over fixed_rows, rebalancing on the first trading day of each month
+
+    Args:
+        b_pe (float, optional): see fixed_rows. Defaults to 40.0.
+
+    Returns:
+        _type_: smart_beta, grouped_data, rebalancing_dates
+    """
+    return create_bt(
+        fixed_rows(b_pe),
+        FIXED_DATES,
+        FIXED_RETURNS,
+        [FIXED_DATES[0], FIXED_DATES[3], FIXED_DATES[6]],
+    )
+
+
+def test_run_fixed_market():
+    # Values of the original per-day loop on the same market
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    sharpe_ratio = bt.run(grouped_data, rebalancing_dates, [0, 15], [0.05, 1e6])
+
+    assert [str(asset) for asset in bt.assets] == [
+        "1E+6",
+        "1004649.999999999982236431606",
+        "1019650.000000000017763568394",
+        "519650.0000000000177635683940",
+        "527042.8109999999908486412181",
+        "532022.8110000000173874123987",
+        "542507.8109999999820023841579",
+        "267344.5604999999912278685343",
+        "552794.5604999999912278685343",
+    ]
+    assert bt.portfolio == {
+        "CASH": Decimal("267344.5604999999912278685343"),
+        "C": 51900,
+    }
+    assert sharpe_ratio == Decimal("0.5366167477623501010553134341")
+
+
+def test_run_zero_prev_close_selected():
+    # A qualified ticker without a price can not be sized, as the per-day loop
+    bt, grouped_data, rebalancing_dates = create_fixed_bt(b_pe=12.0)
+    with pytest.raises(ValueError):
+        bt.run(grouped_data, rebalancing_dates, [0, 15], [0.05, 1e6])
+
+
+def test_run_many_negative_asset():
+    bt, grouped_data, rebalancing_dates = create_synthetic_bt()
+    sharpe_ratio = bt.run(grouped_data, rebalancing_dates, [0, 10], [0.1, 1e6])
+    assert bt.assets[3] < 0
+
+    bt, grouped_data, rebalancing_dates = create_synthetic_bt()
+    results = bt.run_many(
+        grouped_data,
+        rebalancing_dates,
+        [{"pe": [0, 10], "dy": [0.1, 1e6]}, {"pe": [0, 50], "dy": [0, 1e6]}],
+    )
+
+    assert len(results) == 2
+    assert np.isclose(results["sharpe_ratio"][0], float(sharpe_ratio), rtol=1e-12)
+    ratios = results.drop(columns=["pe", "dy"]).to_numpy(dtype=float)
+    # Metric raises on a return <= -1, BatchMetric gives NaN for that series only
+    assert np.isfinite(ratios[0, [0, 1, 4, 5]]).all()
+    assert np.isnan(ratios[0, [2, 3]]).all()
+    assert np.isfinite(ratios[1]).all()
+
+
+# Parameters avoiding B on 2021-02-01, where its prev_close is 0
+PARAMS = [
+    ([0, 15], [0.05, 1e6]),
+    ([0, 35], [0, 1e6]),
+    ([0, 10], [0.06, 1e6]),
+    ([8.5, 35], [0.07, 0.2]),
+    ([0, 8.5], [0, 1e6]),
+]
+
+
+class PerDayBacktesting(Backtesting):
+    """
+    Checks every segment against the original per-day loop on the daily groups
+    """
+
+    def daily_update_segment(self, start, end):
+        old_price = dict(self.old_price)
+        expected = []
+        for _, group in self.grouped_data[start:end]:
+            asset = Decimal('0.0')
+            for symbol, value in self.portfolio.items():
+                if symbol == "CASH":
+                    asset += value
+                    continue
+                close = group.loc[group["tickersymbol"] == symbol, "close"]
+                if len(close):
+                    old_price[symbol] = close.iloc[0]
+                asset += value * Decimal(old_price[symbol])
+            expected.append(asset)
+
+        assets = super().daily_update_segment(start, end)
+        assert assets == expected
+        assert self.old_price == old_price
+        return assets
+
+
+def create_large_bt(backtesting=Backtesting):
+    """
+    fixed_rows with the capital of parameter/backtesting_parameter.json, the
+    tolerances of the ledger are in minor units
+
+    Args:
+        backtesting (type, optional): Defaults to Backtesting.
+
+    Returns:
+        _type_: smart_beta, grouped_data, rebalancing_dates
+    """
+    bt, grouped_data, rebalancing_dates = create_bt(
+        fixed_rows(),
+        FIXED_DATES,
+        FIXED_RETURNS,
+        [FIXED_DATES[0], FIXED_DATES[3], FIXED_DATES[6]],
+        capital=Decimal("25e6"),
+        backtesting=backtesting,
+    )
+    return bt, grouped_data, rebalancing_dates
+
+
+@pytest.mark.parametrize("pe, dy", PARAMS)
+def test_segment_matches_per_day(pe, dy):
+    bt, grouped_data, rebalancing_dates = create_large_bt(PerDayBacktesting)
+    bt.grouped_data = grouped_data
+    bt.run(grouped_data, rebalancing_dates, pe, dy)
+
+    assert len(bt.assets) == len(FIXED_DATES) + 1
+
+
+@pytest.mark.parametrize("pe, dy", PARAMS)
+def test_run_many_matches_run(pe, dy):
+    bt, grouped_data, rebalancing_dates = create_large_bt()
+    sharpe_ratio = bt.run(grouped_data, rebalancing_dates, pe, dy)
+
+    bt, grouped_data, rebalancing_dates = create_large_bt()
+    results = bt.run_many(grouped_data, rebalancing_dates, [{"pe": pe, "dy": dy}])
+
+    # float64 instead of Decimal, up to 2.9e-15 on the in-sample grid
+    assert np.isclose(
+        results["sharpe_ratio"][0], float(sharpe_ratio), rtol=3e-15, atol=0
+    )
+
+
+@pytest.mark.parametrize("pe, dy", PARAMS)
+def test_run_fixed_point_matches_run(pe, dy):
+    bt, grouped_data, rebalancing_dates = create_large_bt()
+    sharpe_ratio = bt.run(grouped_data, rebalancing_dates, pe, dy)
+
+    fixed_point, grouped_data, rebalancing_dates = create_large_bt()
+    fixed_sharpe_ratio = fixed_point.run_fixed_point(
+        grouped_data, rebalancing_dates, pe, dy
+    )
+    differences = compare(bt.assets, fixed_point.ledger)
+
+    assert differences["dates"] == len(FIXED_DATES)
+    assert differences["max_asset_difference"] <= 50
+    assert differences["max_relative_difference"] <= 1.5e-9
+    assert differences["max_return_difference"] <= 1e-9
+    assert np.isclose(fixed_sharpe_ratio, float(sharpe_ratio), rtol=1e-8, atol=0)
+
+
+@pytest.mark.parametrize(
+    "params, other",
+    [
+        # No pe between 12 and 15 nor dy between 0.05 and 0.055 on a rebalancing date
+        (([0, 15], [0.05, 1e6]), ([0, 12.5], [0.055, 1e6])),
+        (([0, 35], [0, 1e6]), ([0, 31], [0.005, 1e3])),
+        (([8.5, 35], [0.07, 0.2]), ([9, 30], [0.065, 0.15])),
+    ],
+)
+def test_equal_signature_equal_sharpe(params, other):
+    signatures, sharpe_ratios = [], []
+    for pe, dy in (params, other):
+        bt, grouped_data, rebalancing_dates = create_large_bt()
+        bt.panel = MarketPanel(grouped_data)
+        signatures.append(bt.selection_signature(rebalancing_dates, pe, dy))
+
+        bt, grouped_data, rebalancing_dates = create_large_bt()
+        sharpe_ratios.append(bt.run(grouped_data, rebalancing_dates, pe, dy))
+
+    assert signatures[0] == signatures[1]
+    assert sharpe_ratios[0] == sharpe_ratios[1]
+
+
+def test_signature_differs():
+    signatures = []
+    for pe, dy in PARAMS:
+        bt, grouped_data, rebalancing_dates = create_large_bt()
+        bt.panel = MarketPanel(grouped_data)
+        signatures.append(bt.selection_signature(rebalancing_dates, pe, dy))
+
+    assert len(set(signatures)) == len(PARAMS)
+
+
+def test_run_progress_callback():
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    sharpe_ratio = bt.run(grouped_data, rebalancing_dates, [0, 15], [0.05, 1e6])
+    assert bt.streaming_metric is None
+
+    reports = []
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    bt.run(
+        grouped_data,
+        rebalancing_dates,
+        [0, 15],
+        [0.05, 1e6],
+        progress_callback=lambda *report: reports.append(report),
+    )
+
+    # Undefined on the first rebalancing date, with a single return
+    assert [(step, day) for step, day, _ in reports] == [
+        (2, FIXED_DATES[3]),
+        (3, FIXED_DATES[6]),
+    ]
+    assert bt.streaming_metric.count == len(bt.period_returns)
+    assert np.isclose(
+        float(bt.streaming_metric.sharpe_ratio() * Decimal(np.sqrt(250))),
+        float(sharpe_ratio),
+        rtol=1e-12,
+    )
+
+
+def test_run_allocation_suspended_stock():
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    assert bt.allocation == [] and bt.suspended_stock == []
+    bt.run(grouped_data, rebalancing_dates, [0, 15], [0.05, 1e6])
+
+    assert [allocation["date"] for allocation in bt.allocation] == [
+        FIXED_DATES[0],
+        FIXED_DATES[3],
+        FIXED_DATES[6],
+    ]
+    assert bt.allocation[-1]["cash_remaining"] == float(bt.portfolio["CASH"])
+    # B held on 2021-01-05 and C on 2021-02-02, valued at their old price
+    assert bt.suspended_stock == [
+        [FIXED_DATES[1], "B", 19.8],
+        [FIXED_DATES[4], "C", 5.05],
+    ]
+
+
+def test_run_profiler_phases():
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    profiler = bt.enable_profiling()
+    bt.run(grouped_data, rebalancing_dates, [0, 15], [0.05, 1e6])
+    phases = {name for name, *_ in profiler.stages}
+    # Already grouped, e.g. by MarketData
+    assert "groupby" not in phases
+    assert {"panel", "rebalancing", "daily_update_segment"} <= phases
+
+    bt, grouped_data, rebalancing_dates = create_fixed_bt()
+    data = pd.concat([group for _, group in grouped_data])
+    profiler = bt.enable_profiling()
+    bt.run(data.groupby(["date"]), rebalancing_dates, [0, 15], [0.05, 1e6])
+    calls = [name for name, *_ in profiler.stages]
+    assert calls.count("groupby") == len(FIXED_DATES) + 1
+    assert calls.count("panel") == 1
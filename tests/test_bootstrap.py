@@ -0,0 +1,38 @@
+"""
+Bootstrap tests
+"""
+
+import numpy as np
+
+from metrics.bootstrap import bootstrap
+
+
+def test_bootstrap_total_loss_day():
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.001, 0.01, 250)
+    returns[100] = -1.0
+    benchmark_returns = rng.normal(0.0005, 0.01, 250)
+
+    summary = bootstrap(
+        returns.tolist(), benchmark_returns.tolist(), n_resamples=500, seed=1
+    )
+
+    for name in ["sharpe_ratio", "sortino_ratio"]:
+        assert np.isfinite(summary[name]["estimate"])
+        assert summary[name]["low"] <= summary[name]["high"]
+    # Undefined on the full series, estimated on the resamples without the day
+    assert np.isnan(summary["information_ratio"]["estimate"])
+    assert np.isfinite(summary["information_ratio"]["std"])
+    assert 0 <= summary["deflated_sharpe_ratio"] <= 1
+
+
+def test_bootstrap_no_finite_resample():
+    # One circular block of the whole series: every resample has the -100% day
+    returns = [0.01, -1.0, 0.02]
+    summary = bootstrap(
+        returns, [0.0, 0.01, 0.0], n_resamples=50, block_size=3, method="circular"
+    )
+
+    assert np.isfinite(summary["sharpe_ratio"]["low"])
+    assert np.isnan(summary["information_ratio"]["low"])
+    assert np.isnan(summary["information_ratio"]["std"])
@@ -0,0 +1,67 @@
+"""
+Financial tests on synthetic financial data
+"""
+
+import pandas as pd
+
+from filter.financial import OWNER_CAPITAL, PER_SHARE_CODES, Financial
+
+
+def create_financial(rows):
+    """
+    Financial over year, tickersymbol, code, value rows
+
+    Args:
+        rows (list)
+
+    Returns:
+        Financial
+    """
+    data = pd.DataFrame(rows, columns=["year", "tickersymbol", "code", "value"])
+    return Financial(from_date=None, to_date=None, data=data)
+
+
+def test_per_share():
+    financial = create_financial(
+        [
+            (2020, "A", OWNER_CAPITAL, 1e9),
+            (2020, "A", 72, 2e8),
+            (2020, "B", OWNER_CAPITAL, 2e9),
+            (2020, "B", 308, 1e8),
+            (2020, "C", 72, 1e8),
+        ]
+    )
+
+    per_share = financial.per_share()
+
+    assert per_share.to_dict("records") == [
+        {"year": 2020, "tickersymbol": "A", "eps": 2000.0, "dps": 0.0},
+        {"year": 2020, "tickersymbol": "B", "eps": 0.0, "dps": 500.0},
+    ]
+    assert financial.eps().to_dict("records") == [
+        {"year": 2020, "tickersymbol": "A", "eps": 2000.0}
+    ]
+    assert financial.dps().to_dict("records") == [
+        {"year": 2020, "tickersymbol": "B", "dps": 500.0}
+    ]
+
+
+def test_per_share_duplicates_and_other_codes():
+    financial = create_financial(
+        [
+            (2020, "A", OWNER_CAPITAL, 1e9),
+            (2020, "A", 72, 1e8),
+            # Restated, the last value is kept
+            (2020, "A", 72, 2e8),
+            (2020, "A", 9999, 1.0),
+            (2020, "A", 9999, 2.0),
+            (2020, "D", 9999, 1.0),
+        ]
+    )
+
+    per_share = financial.per_share()
+
+    assert per_share.to_dict("records") == [
+        {"year": 2020, "tickersymbol": "A", "eps": 2000.0, "dps": 0.0}
+    ]
+    assert list(per_share.columns) == ["year", "tickersymbol", *PER_SHARE_CODES]
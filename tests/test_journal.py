@@ -0,0 +1,55 @@
+"""
+Journal tests
+"""
+
+from datetime import date
+import numpy as np
+import pandas as pd
+import pytest
+
+from journal import FILE_FORMATS, Journal
+
+
+def create_journal():
+    """
+    Journal of one buy and one suspension over two tickers
+
+    Returns:
+        Journal
+    """
+    journal = Journal(np.array(["A", "B"]), capacity=1)
+    journal.record_trades(
+        date(2021, 1, 4), np.array([1]), 1, np.array([100]), np.array([10.0]), 0.001
+    )
+    journal.suspensions.append(np.datetime64("2021-01-05"), 1, 10.0)
+    journal.suspensions.append(np.datetime64("2021-01-06"), 1, 10.0)
+    return journal
+
+
+def test_frame():
+    trades = create_journal().frame("trades")
+
+    assert trades["ticker"].tolist() == ["B"]
+    assert trades[["qty", "value", "fee"]].to_numpy().tolist() == [[100, 1000, 1]]
+
+
+def test_export_csv(tmp_path):
+    create_journal().export(str(tmp_path), "csv")
+
+    suspensions = pd.read_csv(tmp_path / "suspensions.csv")
+    assert suspensions.to_dict("records") == [
+        {"date": "2021-01-05", "ticker": "B", "price": 10.0},
+        {"date": "2021-01-06", "ticker": "B", "price": 10.0},
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "cash.csv",
+        "positions.csv",
+        "suspensions.csv",
+        "trades.csv",
+    ]
+
+
+def test_export_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        create_journal().export(str(tmp_path), "xlsx")
+    assert "xlsx" not in FILE_FORMATS
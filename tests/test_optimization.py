@@ -0,0 +1,34 @@
+"""
+Optimization tests on in-memory studies
+"""
+
+from types import SimpleNamespace
+import optuna
+
+from optimization import print_timing
+
+
+def test_print_timing_missing_user_attrs(capsys):
+    study = optuna.create_study(direction="maximize")
+    distributions = {"peub": optuna.distributions.IntDistribution(10, 20)}
+    study.add_trial(
+        optuna.trial.create_trial(
+            params={"peub": 12},
+            distributions=distributions,
+            value=1.0,
+            user_attrs={"load_time": 0.5, "run_time": 1.5},
+        )
+    )
+    # e.g. a trial of a study started before the timing attributes
+    study.add_trial(
+        optuna.trial.create_trial(
+            params={"peub": 15}, distributions=distributions, value=2.0
+        )
+    )
+
+    print_timing(study, SimpleNamespace(load_time=0.25))
+
+    output = capsys.readouterr().out
+    assert "Mean load time per trial 0.5000s" in output
+    assert "Mean run time per trial 1.5000s" in output
+    assert "Total trial time 2.0000s" in output
@@ -2,9 +2,14 @@
 This module provides helper functions
 """
 
+import os
+import time
+import threading
+from contextlib import contextmanager
 from typing import Tuple
 from datetime import datetime, timedelta, date
 from queue import Queue
+import numpy as np
 
 
 def get_date(
@@ -76,3 +81,95 @@ def round_lot(quantity: int) -> int:
         int
     """
     return int(quantity // 100) * 100
+
+
+def round_lots(quantities: np.ndarray) -> np.ndarray:
+    """
+    Rounding quantities to trading lots, vectorized version of round_lot
+
+    Args:
+        quantities (np.ndarray)
+
+    Raises:
+        ValueError: inf or NaN quantities, e.g. from a zero or missing price, as
+            round_lot
+
+    Returns:
+        np.ndarray: int64 quantities
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    if not np.isfinite(quantities).all():
+        raise ValueError(
+            "Quantities should be finite, check for zero or missing prices"
+        )
+
+    return (np.floor_divide(quantities, 100) * 100).astype(np.int64)
+
+
+def last_csv_index(path: str) -> int:
+    """
+    Get the index of the last row of a csv file written by DataFrame.to_csv,
+    without parsing the file
+
+    Args:
+        path (str)
+
+    Returns:
+        int
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        last_line = f.read().rstrip(b"\r\n").splitlines()[-1]
+
+    return int(last_line.split(b",", 1)[0])
+
+
+class Timeline:
+    """
+    Thread-safe record of named stages, used to find the critical path of a job
+    """
+
+    def __init__(self):
+        """
+        Start the timeline clock
+        """
+        self.origin = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Record the wall time of the wrapped block
+
+        Args:
+            name (str): stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                (
+                    name,
+                    threading.current_thread().name,
+                    start - self.origin,
+                    time.perf_counter() - self.origin,
+                )
+            )
+
+    def report(self) -> str:
+        """
+        Format the stages as a table ordered by start time
+
+        Returns:
+            str
+        """
+        lines = [f"{'stage':<48}{'thread':<24}{'start':>9}{'end':>9}{'duration':>10}"]
+        for name, thread, start, end in sorted(self.stages, key=lambda x: x[2]):
+            lines.append(
+                f"{name:<48}{thread:<24}{start:>9.2f}{end:>9.2f}{end - start:>10.2f}"
+            )
+        total = max((end for *_, end in self.stages), default=0.0)
+        lines.append(f"Total wall time {total:.2f}s")
+        return "\n".join(lines)
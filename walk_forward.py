@@ -0,0 +1,248 @@
+"""
+Walk-forward optimization module
+
+The history is sliced into train/test windows, each train window is optimized and
+the best parameters are evaluated on the following test window. Windows run in
+parallel in a process pool and the test windows are stitched into one
+out-of-sample NAV.
+"""
+
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from config import config
+
+from backtesting import Backtesting, MarketData, create_bt_instance
+from metrics.metric import Metric
+from optimization import cache_stats, create_objective, create_study
+
+# Full history of the worker process, see init_worker
+market_data: Optional[MarketData] = None
+
+
+def create_wf_instance() -> Backtesting:
+    """
+    Create backtesting instance of the whole walk-forward history
+
+    Returns:
+        Backtesting
+    """
+    return Backtesting(
+        buy_fee=Decimal(config.BACKTESTING_CONFIG["buy_fee"]),
+        sell_fee=Decimal(config.BACKTESTING_CONFIG["sell_fee"]),
+        from_date_str=config.OPTIMIZATION_CONFIG["walk_forward"]["from_date_str"],
+        to_date_str=config.OPTIMIZATION_CONFIG["walk_forward"]["to_date_str"],
+        capital=Decimal(config.BACKTESTING_CONFIG["capital"]),
+        path="data/wf/pe_dps.csv",
+        index_path="data/wf/vnindex.csv",
+    )
+
+
+def walk_forward_windows(
+    from_date_str: str,
+    to_date_str: str,
+    train_months: int,
+    test_months: int,
+    anchored: bool = False,
+) -> List[Dict]:
+    """
+    Slice the history into consecutive test windows, each one preceded by its train
+    window: the previous train_months (rolling) or the whole history (anchored)
+
+    Args:
+        from_date_str (str)
+        to_date_str (str)
+        train_months (int)
+        test_months (int)
+        anchored (bool, optional): Defaults to False.
+
+    Returns:
+        List[Dict]: train_from, train_to, test_from, test_to, end dates excluded
+    """
+    from_date = pd.Timestamp(from_date_str)
+    to_date = pd.Timestamp(to_date_str)
+    test_from = from_date + pd.DateOffset(months=train_months)
+
+    windows = []
+    while test_from < to_date:
+        test_to = min(test_from + pd.DateOffset(months=test_months), to_date)
+        train_from = (
+            from_date if anchored else test_from - pd.DateOffset(months=train_months)
+        )
+        windows.append(
+            {
+                "window": len(windows),
+                "train_from": train_from.strftime("%Y-%m-%d"),
+                "train_to": test_from.strftime("%Y-%m-%d"),
+                "test_from": test_from.strftime("%Y-%m-%d"),
+                "test_to": test_to.strftime("%Y-%m-%d"),
+            }
+        )
+        test_from = test_to
+
+    return windows
+
+
+def init_worker():
+    """
+    Load the history once per worker process, inherited when the pool forks, the
+    panel is memory-mapped so that every worker reads the same pages
+    """
+    global market_data  # pylint: disable=global-statement
+    if market_data is None:
+        market_data = MarketData(bt=create_wf_instance(), memory_map=True)
+
+
+def run_window(window: Dict) -> Dict:
+    """
+    Optimize the train window then evaluate the best parameters on the test window
+
+    Args:
+        window (Dict): as returned by walk_forward_windows
+
+    Returns:
+        Dict: window, best parameters, train and test sharpe ratios, trials
+        answered by the selection cache, test dates, returns and benchmark returns
+    """
+    import optuna  # pylint: disable=import-outside-toplevel
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    init_worker()
+    start = time.perf_counter()
+
+    study = create_study()
+    study.optimize(
+        create_objective(market_data.window(window["train_from"], window["train_to"])),
+        n_trials=config.OPTIMIZATION_CONFIG["no_trials"],
+    )
+
+    test_data = market_data.window(window["test_from"], window["test_to"])
+    bt, grouped_data, rebalancing_dates = create_bt_instance(market_data=test_data)
+    test_sharpe = bt.run(
+        grouped_data,
+        rebalancing_dates,
+        [0, study.best_params["peub"]],
+        [study.best_params["dylb"], 1e6],
+    )
+
+    return {
+        **window,
+        **study.best_params,
+        "train_sharpe": study.best_value,
+        "test_sharpe": test_sharpe,
+        "cache_hits": cache_stats(study)["hits"],
+        "seconds": time.perf_counter() - start,
+        "dates": bt.tracking_dates,
+        "returns": bt.period_returns,
+        "benchmark_returns": test_data.vnindex_data["return"].to_list(),
+    }
+
+
+def stitch(results: List[Dict], capital: Decimal) -> pd.DataFrame:
+    """
+    Chain the test windows returns into one out-of-sample NAV
+
+    Args:
+        results (List[Dict]): run_window results, in window order
+        capital (Decimal)
+
+    Returns:
+        pd.DataFrame: date, window, return, benchmark_return, nav
+    """
+    rows = []
+    nav = capital
+    for result in results:
+        for date, period_return, benchmark_return in zip(
+            result["dates"], result["returns"], result["benchmark_returns"]
+        ):
+            nav *= 1 + period_return
+            rows.append((date, result["window"], period_return, benchmark_return, nav))
+
+    return pd.DataFrame(
+        rows, columns=["date", "window", "return", "benchmark_return", "nav"]
+    )
+
+
+def stitched_metrics(nav: pd.DataFrame) -> Dict:
+    """
+    Metrics of the stitched out-of-sample returns
+
+    Args:
+        nav (pd.DataFrame): as returned by stitch
+
+    Returns:
+        Dict
+    """
+    metric = Metric(nav["return"].to_list(), nav["benchmark_return"].to_list())
+    annualize = Decimal(np.sqrt(250))
+    return {
+        "sharpe_ratio": metric.sharpe_ratio(Decimal('0.00023')) * annualize,
+        "sortino_ratio": metric.sortino_ratio(Decimal('0.00023')) * annualize,
+        "information_ratio": metric.information_ratio() * annualize,
+        "maximum_drawdown": metric.maximum_drawdown()[0],
+        "hpr": metric.hpr(),
+        "excess_hpr": metric.excess_hpr(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of windows optimized in parallel",
+    )
+    parser.add_argument("--output", default="result/walk_forward")
+    args = parser.parse_args()
+
+    walk_forward_config = config.OPTIMIZATION_CONFIG["walk_forward"]
+    windows = walk_forward_windows(
+        walk_forward_config["from_date_str"],
+        walk_forward_config["to_date_str"],
+        walk_forward_config["train_months"],
+        walk_forward_config["test_months"],
+        walk_forward_config["anchored"],
+    )
+
+    start = time.perf_counter()
+    # Loaded before forking, so that workers share it and factors are cached once
+    init_worker()
+    factor_names = list(config.BACKTESTING_CONFIG.get("factor_filters", {}))
+    if config.BACKTESTING_CONFIG.get("factor_rank"):
+        factor_names.append(config.BACKTESTING_CONFIG["factor_rank"]["factor"])
+    for name in factor_names:
+        market_data.factors.get(name)
+    with ProcessPoolExecutor(
+        max_workers=min(args.workers, len(windows)), initializer=init_worker
+    ) as executor:
+        results = list(executor.map(run_window, windows))
+
+    nav = stitch(results, Decimal(config.BACKTESTING_CONFIG["capital"]))
+    summary = pd.DataFrame(
+        [
+            {
+                key: value
+                for key, value in result.items()
+                if key not in ("dates", "returns", "benchmark_returns")
+            }
+            for result in results
+        ]
+    )
+
+    os.makedirs(args.output, exist_ok=True)
+    summary.to_csv(os.path.join(args.output, "windows.csv"), index=False)
+    nav.to_csv(os.path.join(args.output, "nav.csv"), index=False)
+
+    print(summary.to_string(index=False))
+    for key, value in stitched_metrics(nav).items():
+        print(f"{key} {value}")
+    print(
+        f"{len(windows)} windows in {time.perf_counter() - start:.2f}s "
+        f"({summary['seconds'].sum():.2f}s of window time)"
+    )